@@ -31,13 +31,17 @@ from gwaslab.filtervalue import filterregionin
 from gwaslab.filtervalue import filterregionout
 from gwaslab.filtervalue import inferbuild
 from gwaslab.filtervalue import sampling
+from gwaslab.lazyfilter import SumstatsFilter
 from gwaslab.mqqplot import mqqplot
+from gwaslab.quickfix import _quick_checksum
 from gwaslab.calculate_gc import lambdaGC
 from gwaslab.h2_conversion import _get_per_snp_r2
 from gwaslab.getsig import getsig
+from gwaslab.getsig import getsigbatch
 from gwaslab.getdensity import getsignaldensity
 from gwaslab.getdensity import assigndensity
 from gwaslab.getsig import annogene
+from gwaslab.annotateregion import annoregion
 from gwaslab.getsig import getnovel
 from gwaslab.fill import filldata
 from gwaslab.to_formats import tofmt
@@ -53,6 +57,9 @@ from gwaslab.version import _show_version
 from gwaslab.version import gwaslab_info
 from gwaslab.meta import init_meta
 from gwaslab.trumpetplot import plottrumpet
+from gwaslab.to_parquet import save_sumstats
+from gwaslab.optimize_memory import optimizememory
+from gwaslab.variantkey import pack_variant_key
 import gc
 
 #20220309
@@ -188,6 +195,70 @@ class Sumstats():
             self.meta["gwaslab"]["samples"]["sample_size_median"] = self.data["N"].median()
             self.meta["gwaslab"]["samples"]["sample_size_min"] = int(self.data["N"].min())
 
+    def _spawn(self):
+        '''
+        new Sumstats object with the same build, a copy of meta and log and no data
+        used by filters instead of copy.deepcopy(self) : the data is replaced by the filtered rows anyway
+        '''
+        new_Sumstats_object = Sumstats.__new__(Sumstats)
+        new_Sumstats_object.data = pd.DataFrame()
+        new_Sumstats_object.build = self.build
+        new_Sumstats_object.log = copy.copy(self.log)
+        new_Sumstats_object.meta = copy.deepcopy(self.meta)
+        return new_Sumstats_object
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        # assigning new data empties the plot cache
+        self._data = data
+        self._plot_cache = {}
+
+    def __setstate__(self, state):
+        # objects pickled before data became a property
+        if "data" in state:
+            state["_data"] = state.pop("data")
+        self.__dict__.update(state)
+
+    def _get_plot_cache(self, cols=None):
+        '''
+        plot cache (prepared Manhattan/QQ frames, QQ arrays, lambda GC) of the current data
+        the cache is emptied when .data is assigned, when its shape / columns / dtypes change,
+        or when the values of the plotted columns (cols) are edited in place 
+        numeric columns are checked with a raw 64-bit checksum ; ID / annotation columns are hashed only when they are plotted
+        '''
+        if cols is None:
+            cols = ["CHR","POS","P","MLOG10P","EAF","DENSITY"]
+        fingerprint = (id(self.data), self.data.shape, tuple(self.data.columns), tuple(str(dtype) for dtype in self.data.dtypes))
+        checksums = {col:_quick_checksum(self.data[col]) for col in cols if col in self.data.columns}
+        plot_cache = getattr(self, "_plot_cache", None)
+        if plot_cache is None or plot_cache.get("fingerprint")!=fingerprint:
+            plot_cache = {"fingerprint":fingerprint, "checksums":{}}
+        stored = plot_cache.setdefault("checksums", {})
+        is_edited = any(col in stored and stored[col]!=checksum for col, checksum in checksums.items())
+        # cached frames that were not checked against a column yet can not be trusted for it
+        is_unchecked = len(plot_cache)>2 and any(col not in stored for col in checksums)
+        if is_edited or is_unchecked:
+            plot_cache = {"fingerprint":fingerprint, "checksums":{}}
+        plot_cache["checksums"].update(checksums)
+        self._plot_cache = plot_cache
+        return plot_cache
+
+    @property
+    def variant_key(self):
+        '''
+        packed uint64 CHR:POS:NEA:EA key of each variant (gwaslab.variantkey ; 0 if not encodable)
+        computed from the current CHR / POS / NEA / EA columns so that it always follows QC and harmonization
+        '''
+        if "NEA" in self.data.columns and "EA" in self.data.columns:
+            key = pack_variant_key(self.data["CHR"], self.data["POS"], self.data["NEA"], self.data["EA"])
+        else:
+            key = pack_variant_key(self.data["CHR"], self.data["POS"])
+        return pd.Series(key, index=self.data.index, name="VARIANT_KEY")
+
     def summary(self):
         return summarize(self.data)
 
@@ -207,6 +278,7 @@ class Sumstats():
                     sanitycheckstats_args={},
                     normalize=True,
                     normalizeallele_args={},
+                    optimize_memory=True,
                     verbose=True):
         ###############################################
         # try to fix data without dropping any information
@@ -221,6 +293,8 @@ class Sumstats():
             self.data = parallelnormalizeallele(self.data,n_cores=n_cores,verbose=verbose,log=self.log,**normalizeallele_args)
         self.data = sortcoordinate(self.data,verbose=verbose,log=self.log)
         self.data = sortcolumn(self.data,verbose=verbose,log=self.log)
+        if optimize_memory is True:
+            self.data = optimizememory(self.data,verbose=verbose,log=self.log)
         self.meta["is_sorted"] = True
         ###############################################
         
@@ -246,7 +320,8 @@ class Sumstats():
               fixpos_args={},
               fixallele_args={},
               sanitycheckstats_args={},
-              normalizeallele_args={}
+              normalizeallele_args={},
+              optimize_memory=True
               ):
         
         #Standard pipeline
@@ -332,10 +407,88 @@ class Sumstats():
         self.data = sortcoordinate(self.data,log=self.log)
         
         self.data = sortcolumn(self.data,log=self.log)
+        if optimize_memory is True:
+            self.data = optimizememory(self.data,log=self.log)
         gc.collect()
         self.meta["is_sorted"] = True
         self.meta["is_harmonised"] = True
         return self
+    
+    @classmethod
+    def stream(cls,
+               sumstats,
+               fmt=None,
+               path="./sumstats",
+               to_fmt="gwaslab",
+               chunksize=1000000,
+               basic_check=True,
+               ref_seq=None,
+               ref_infer=None,
+               ref_alt_freq=None,
+               ref_rsid_vcf=None,
+               maf_threshold=0.40,
+               n_cores=1,
+               remove=False,
+               basic_check_args={},
+               checkref_args={},
+               inferstrand_args={},
+               assignrsid_args={},
+               flipallelestats_args={},
+               to_format_args={},
+               verbose=True,
+               **args):
+        '''
+        QC and harmonization for files larger than memory : 
+        the file is read chunk by chunk (chunksize rows ; chromosome by chromosome for paths with @), each chunk goes through
+        basic_check / checkref / infer_strand / assign_rsid (vcf) / flipallelestats and is appended to the output of to_format.
+        peak memory is bounded by chunksize (use build_reference_cache to avoid re-reading the references for each chunk).
+        duplicates are only removed within chunks.
+        args : column and reading arguments for gl.Sumstats()
+        return a Sumstats object with the log and meta data of the run (data is empty)
+        '''
+        if to_fmt not in get_formats_list():
+            raise ValueError("Streaming output only supports formats in the formatbook: {}".format(",".join(get_formats_list())))
+        
+        streamed = cls(sumstats, fmt=fmt, verbose=verbose, chunksize=chunksize, **args)
+        chunks = streamed.data
+        streamed.data = pd.DataFrame()
+        
+        to_format_args = to_format_args.copy()
+        to_format_args["output_log"] = False
+        to_format_args["md5sum"] = False
+        to_format_args["ssfmeta"] = False
+        
+        if verbose: streamed.log.write("Start to process sumstats in chunks of {} rows...".format(chunksize))
+        variant_number = 0
+        for i, chunk in enumerate(chunks):
+            streamed.data = chunk
+            before = len(chunk)
+            if basic_check is True:
+                streamed.basic_check(remove=remove, n_cores=n_cores, verbose=False, **basic_check_args)
+            if ref_seq is not None:
+                streamed.data = checkref(streamed.data, ref_seq, log=streamed.log, verbose=False, **checkref_args)
+                streamed.data = flipallelestats(streamed.data, log=streamed.log, verbose=False, **flipallelestats_args)
+            if ref_infer is not None:
+                streamed.data = parallelinferstrand(streamed.data, ref_infer=ref_infer, ref_alt_freq=ref_alt_freq, maf_threshold=maf_threshold,
+                                                    n_cores=n_cores, log=streamed.log, verbose=False, **inferstrand_args)
+                streamed.data = flipallelestats(streamed.data, log=streamed.log, verbose=False, **flipallelestats_args)
+            if ref_rsid_vcf is not None:
+                streamed.data = parallelizeassignrsid(streamed.data, path=ref_rsid_vcf, ref_mode="vcf",
+                                                      n_cores=n_cores, log=streamed.log, verbose=False, **assignrsid_args)
+            streamed.to_format(path=path, fmt=to_fmt, mode="w" if i==0 else "a", verbose=False, **to_format_args)
+            variant_number += len(streamed.data)
+            if verbose: streamed.log.write(" -Chunk {} : {} variants loaded, {} variants written...".format(i+1, before, len(streamed.data)))
+            streamed.data = pd.DataFrame()
+            gc.collect()
+        
+        streamed.meta["gwaslab"]["variants"]["variant_number"] = variant_number
+        for key, value in [("ref_seq",ref_seq),("ref_infer",ref_infer),("ref_rsid_vcf",ref_rsid_vcf)]:
+            if value is not None:
+                streamed.meta["gwaslab"]["references"][key] = value
+        streamed.meta["is_sorted"] = False
+        streamed.meta["is_harmonised"] = ref_seq is not None
+        if verbose: streamed.log.write("Finished streaming {} variants to {} successfully!".format(variant_number, path))
+        return streamed
     ############################################################################################################
     #customizable API to build your own QC pipeline
     def fix_id(self,**args):
@@ -364,12 +517,13 @@ class Sumstats():
     def assign_rsid(self,
                     ref_rsid_tsv=None,
                     ref_rsid_vcf=None,
+                    ref_mode="vcf",
                     **args):
         if ref_rsid_tsv is not None:
             self.data = parallelizeassignrsid(self.data,path=ref_rsid_tsv,ref_mode="tsv",log=self.log,**args)
             self.meta["gwaslab"]["references"]["ref_rsid_tsv"] = ref_rsid_tsv
         if ref_rsid_vcf is not None:
-            self.data = parallelizeassignrsid(self.data,path=ref_rsid_vcf,ref_mode="vcf",log=self.log,**args)   
+            self.data = parallelizeassignrsid(self.data,path=ref_rsid_vcf,ref_mode=ref_mode,log=self.log,**args)   
             self.meta["gwaslab"]["references"]["ref_rsid_vcf"] = ref_rsid_vcf
     def rsid_to_chrpos(self,**args):
         self.data = rsidtochrpos(self.data,log=self.log,**args)
@@ -392,6 +546,8 @@ class Sumstats():
         self.meta["is_sorted"] = True
     def sort_column(self,**args):
         self.data = sortcolumn(self.data,log=self.log,**args)
+    def optimize_memory(self,**args):
+        self.data = optimizememory(self.data,log=self.log,**args)
     
     ############################################################################################################
     def fill_data(self, **args):
@@ -401,40 +557,43 @@ class Sumstats():
         self.data, self.meta["gwaslab"]["genome_build"] = inferbuild(self.data,**args)
 # utilities ############################################################################################################
     # filter series ######################################################################
+    def filter(self, verbose=True):
+        return SumstatsFilter(self, verbose=verbose)
+
     def filter_value(self, expr, inplace=False, **args):
         if inplace is False:
-            new_Sumstats_object = copy.deepcopy(self)
-            new_Sumstats_object.data = filtervalues(new_Sumstats_object.data,expr,log=new_Sumstats_object.log, **args)
+            new_Sumstats_object = self._spawn()
+            new_Sumstats_object.data = filtervalues(self.data,expr,log=new_Sumstats_object.log, **args)
             return new_Sumstats_object
         else:
             self.data = filtervalues(self.data, expr,log=self.log,**args)
     
     def filter_out(self, inplace=False, **args):
         if inplace is False:
-            new_Sumstats_object = copy.deepcopy(self)
-            new_Sumstats_object.data = filterout(new_Sumstats_object.data,log=new_Sumstats_object.log,**args)
+            new_Sumstats_object = self._spawn()
+            new_Sumstats_object.data = filterout(self.data,log=new_Sumstats_object.log,**args)
             return new_Sumstats_object
         else:
             self.data = filterout(self.data,log=self.log,**args)
             
     def filter_in(self, inplace=False, **args):
         if inplace is False:
-            new_Sumstats_object = copy.deepcopy(self)
-            new_Sumstats_object.data = filterin(new_Sumstats_object.data,log=new_Sumstats_object.log,**args)
+            new_Sumstats_object = self._spawn()
+            new_Sumstats_object.data = filterin(self.data,log=new_Sumstats_object.log,**args)
             return new_Sumstats_object
         else:
             self.data = filterin(self.data,log=self.log,**args)
     def filter_region_in(self, inplace=False, **args):
         if inplace is False:
-            new_Sumstats_object = copy.deepcopy(self)
-            new_Sumstats_object.data = filterregionin(new_Sumstats_object.data,log=new_Sumstats_object.log,**args)
+            new_Sumstats_object = self._spawn()
+            new_Sumstats_object.data = filterregionin(self.data,log=new_Sumstats_object.log,**args)
             return new_Sumstats_object
         else:
             self.data = filterregionin(self.data,log=self.log,**args)
     def filter_region_out(self, inplace=False, **args):
         if inplace is False:
-            new_Sumstats_object = copy.deepcopy(self)
-            new_Sumstats_object.data = filterregionout(new_Sumstats_object.data,log=new_Sumstats_object.log,**args)
+            new_Sumstats_object = self._spawn()
+            new_Sumstats_object.data = filterregionout(self.data,log=new_Sumstats_object.log,**args)
             return new_Sumstats_object
         else:
             self.data = filterregionout(self.data,log=self.log,**args)
@@ -443,8 +602,8 @@ class Sumstats():
         if inplace is True:
             self.data = sampling(self.data,n=n,p=p,log=self.log,**args)
         else:
-            new_Sumstats_object = copy.deepcopy(self)
-            new_Sumstats_object.data = sampling(new_Sumstats_object.data,n=n,p=p,log=new_Sumstats_object.log,**args)
+            new_Sumstats_object = self._spawn()
+            new_Sumstats_object.data = sampling(self.data,n=n,p=p,log=new_Sumstats_object.log,**args)
             return new_Sumstats_object
     ######################################################################
     
@@ -459,7 +618,7 @@ class Sumstats():
     def plot_daf(self, **args):
         fig,outliers = plotdaf(self.data, **args)
         return fig, outliers
-    def plot_mqq(self, build=None, **args):
+    def plot_mqq(self, build=None, cache=True, **args):
 
         chrom="CHR"
         pos="POS"
@@ -479,6 +638,15 @@ class Sumstats():
         if build is None:
             build = self.meta["gwaslab"]["genome_build"]
 
+        # prepared frames are reused by later calls on the same data (cache=False to disable)
+        if cache is True:
+            cols = ["CHR","POS","P","MLOG10P","EAF","DENSITY"]
+            if args.get("anno", None) not in [None, False] or len(args.get("highlight",[]))>0 or len(args.get("anno_set",[]))>0 or len(args.get("pinpoint",[]))>0:
+                cols.append(snpid)
+            if isinstance(args.get("anno", None), str) and args["anno"]!="GENENAME":
+                cols.append(args["anno"])
+            args["_cache"] = self._get_plot_cache(cols=cols)
+
         plot = mqqplot(self.data,
                        snpid=snpid, 
                        chrom=chrom, 
@@ -514,21 +682,44 @@ class Sumstats():
                            **args)
         # return sumstats object    
         if gls == True:
-            new_Sumstats_object = copy.deepcopy(self)
+            new_Sumstats_object = self._spawn()
             new_Sumstats_object.data = output
             gc.collect()
             return new_Sumstats_object
         return output
 
-    def get_density(self, sig_list=None, windowsizekb=100,**args):
+    def get_lead_batch(self, sig_level=[5e-8], windowsizekb=[500], build=None, **args):
+        # dict : (sig_level, windowsizekb) -> lead variants
+        if "SNPID" in self.data.columns:
+            id_to_use = "SNPID"
+        else:
+            id_to_use = "rsID"
         
+        if build is None:
+            build = self.meta["gwaslab"]["genome_build"]
+        
+        output = getsigbatch(self.data,
+                           id=id_to_use,
+                           chrom="CHR",
+                           pos="POS",
+                           p="P",
+                           sig_level=sig_level,
+                           windowsizekb=windowsizekb,
+                           log=self.log,
+                           build=build,
+                           **args)
+        return output
+
+    def get_density(self, sig_list=None, windowsizekb=100,**args):
+        # windowsizekb : a window size (DENSITY) or a list of window sizes (DENSITY_{windowsizekb}KB)
         if "SNPID" in self.data.columns:
             id_to_use = "SNPID"
         else:
             id_to_use = "rsID"
         
+        density = None
         if sig_list is None:
-            self.data["DENSITY"] = getsignaldensity(self.data,
+            density = getsignaldensity(self.data,
                                                     id=id_to_use,
                                                     chrom="CHR",
                                                     pos="POS",
@@ -536,13 +727,18 @@ class Sumstats():
                                                     log=self.log)
         else:
             if isinstance(sig_list, pd.DataFrame):
-                self.data["DENSITY"] = assigndensity(self.data,
+                density = assigndensity(self.data,
                                                     sig_list,
                                                     id=id_to_use, 
                                                     chrom="CHR", 
                                                     pos="POS", 
                                                     bwindowsizekb=windowsizekb,
                                                     log=self.log)
+        if isinstance(density, pd.DataFrame):
+            for col in density.columns:
+                self.data[col] = density[col]
+        elif density is not None:
+            self.data["DENSITY"] = density
 
         
     def get_novel(self, **args):
@@ -573,6 +769,9 @@ class Sumstats():
                            **args)
         return output
         
+    def anno_region(self, **args):
+        self.data = annoregion(self.data, log=self.log, **args)
+
     def get_per_snp_r2(self,**args):
         self.data = _get_per_snp_r2(self.data, beta="BETA", af="EAF", n="N", log=self.log, **args)
         #add data inplace
@@ -597,6 +796,10 @@ class Sumstats():
             self.meta["Genomic inflation factor"] = output
             return output 
 
+# save ####################################################################################################
+    def save(self, path="./mysumstats", overwrite=False, verbose=True):
+        save_sumstats(self, path=path, overwrite=overwrite, verbose=verbose)
+
 # to_format ###############################################################################################       
     def to_format(self,
               path="./sumstats",
@@ -622,7 +825,8 @@ class Sumstats():
               md5sum=False,
               bgzip=False,
               tabix=False,
-              tabix_indexargs={}):
+              tabix_indexargs={},
+              mode="w"):
         
         onetime_log = copy.deepcopy(self.log)
         if  to_csvargs is None:
@@ -720,7 +924,7 @@ class Sumstats():
                   cols=cols,
                   suffix=suffix,
                   build=build,
-                  verbose=True,
+                  verbose=verbose,
                   no_status=no_status,
                   log=onetime_log,
                   to_csvargs=to_csvargs,
@@ -732,7 +936,8 @@ class Sumstats():
                   tabix_indexargs=tabix_indexargs,
                   md5sum=md5sum,
                   xymt_number=xymt_number,
-                  xymt=xymt)
+                  xymt=xymt,
+                  mode=mode)
         if output_log is True:
             log_path = path + "."+ suffix + ".log"
             if verbose: onetime_log.write(" -Saveing log file to: {}".format(log_path))
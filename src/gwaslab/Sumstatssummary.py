@@ -1,6 +1,7 @@
 import pandas as pd
 import time
 import numpy as np
+from gwaslab.vchangestatus import status_to_string
 def summarize(insumstats,
               snpid="SNPID",
               rsid="rsID",
@@ -89,9 +90,11 @@ def sum_status(id_to_use, sumstats):
         return results
     
 def lookupstatus(status):
+    status = status_to_string(status)
     uniq_status = status.unique()
     status_dic_12={
     "13":"CHM13",
+    "18":"hg18",
     "19":"hg19",
     "38":"hg38",
     "97":"Unmapped",
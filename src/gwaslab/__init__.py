@@ -30,11 +30,17 @@ from gwaslab.download import check_available_ref
 from gwaslab.download import remove_file
 from gwaslab.download import get_path
 from gwaslab.download import update_record
+from gwaslab.refcache import build_reference_cache
+from gwaslab.refcache import build_rsid_index
+from gwaslab.refcache import build_variant_index
+from gwaslab.get_hapmap3 import build_hapmap3_positions
 from gwaslab.to_pickle import dump_pickle
 from gwaslab.to_pickle import load_pickle
+from gwaslab.to_parquet import load_sumstats as load
 from gwaslab.config import options
 from gwaslab.version import _show_version as show_version
 from gwaslab.calculate_power import get_power
 from gwaslab.calculate_power import get_beta
 from gwaslab.trumpetplot import plot_power
-from gwaslab.trumpetplot import plot_power_x
\ No newline at end of file
+from gwaslab.trumpetplot import plot_power_x
+from gwaslab.batchplot import batch_plot_mqq
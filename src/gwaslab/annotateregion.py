@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+from os import path
+from gwaslab.Log import Log
+from gwaslab.CommonData import get_chr_to_number
+from gwaslab.CommonData import get_high_ld
+import gc
+
+# vectorized interval membership for bed files
+# intervals of each chromosome are merged into sorted, non-overlapping (start, end] arrays ;
+# a variant at POS (1-based) is in the bed file if start < POS <= end (bed : 0-based start, exclusive end)
+# membership of all variants on one chromosome is then checked with one np.searchsorted
+
+def read_bed(bed_path, verbose=True, log=Log()):
+    '''
+    read the first three columns of a bed file ; CHR is converted to gwaslab chromosome numbers
+    '''
+    if verbose: log.write(" -Loading bed format file: " , bed_path)
+    bed = pd.read_csv(bed_path, sep=r"\s+", header=None, usecols=[0,1,2], comment="#",
+                      dtype={0:"string",1:"Int64",2:"Int64"})
+    bed.columns = ["CHR","START","END"]
+    bed = bed.loc[~bed["CHR"].str.startswith(("track","browser"), na=False),:]
+    bed["CHR"] = bed["CHR"].str.strip("chrCHR").str.upper().map(get_chr_to_number())
+    bed = bed.dropna()
+    return bed.astype({"CHR":"int64","START":"int64","END":"int64"})
+
+def merge_bed_intervals(bed):
+    '''
+    bed (CHR, START, END) -> {CHR : (starts, ends)} with overlapping or touching intervals merged
+    '''
+    merged = {}
+    for chrom, group in bed.groupby("CHR", sort=True):
+        group = group.sort_values(by=["START","END"], kind="mergesort")
+        starts = group["START"].values
+        ends = np.maximum.accumulate(group["END"].values)
+        # a new block starts where the interval does not overlap / touch any previous interval
+        is_new = np.ones(len(starts), dtype="bool")
+        is_new[1:] = starts[1:] > ends[:-1]
+        block_start = np.flatnonzero(is_new)
+        block_end = np.append(block_start[1:], len(starts)) - 1
+        merged[chrom] = (starts[block_start], ends[block_end])
+    return merged
+
+def in_bed_intervals(chrom, pos, merged):
+    '''
+    boolean array : whether each CHR/POS variant is in the merged intervals
+    '''
+    chrom = pd.to_numeric(pd.Series(chrom), errors="coerce").to_numpy(dtype="float64")
+    pos = pd.to_numeric(pd.Series(pos), errors="coerce").to_numpy(dtype="float64")
+    is_in = np.zeros(len(pos), dtype="bool")
+    for chr_number, (starts, ends) in merged.items():
+        on_chrom = np.flatnonzero(chrom == chr_number)
+        if len(on_chrom)==0:
+            continue
+        pos_chrom = pos[on_chrom]
+        # last interval with start < POS
+        i = np.searchsorted(starts, pos_chrom, side="left") - 1
+        i_clipped = np.clip(i, 0, None)
+        is_in[on_chrom] = (i >= 0) & (pos_chrom <= ends[i_clipped])
+    return is_in
+
+def _get_bed_paths(path=None, high_ld=False, build="19", verbose=True, log=Log()):
+    '''
+    return {label : bed path} from a path, a list of paths or a dict of label : path
+    '''
+    if high_ld is True:
+        if verbose: log.write(" -Loading bed format file for hg"+build)
+        return {"HIGH_LD":get_high_ld(build=build)}
+    if path is None:
+        raise ValueError("Please provide path to bed file(s).")
+    if isinstance(path, dict):
+        return path
+    if isinstance(path, str):
+        path = [path]
+    labels={}
+    for bed_path in path:
+        label = _bed_label(bed_path)
+        while label in labels:
+            label = label + "_"
+        labels[label] = bed_path
+    return labels
+
+def _bed_label(bed_path):
+    label = path.basename(bed_path)
+    for suffix in [".gz",".bed"]:
+        if label.endswith(suffix):
+            label = label[:-len(suffix)]
+    return label
+
+def inbed(sumstats, path=None, chrom="CHR", pos="POS", high_ld=False, build="19", verbose=True, log=Log()):
+    '''
+    boolean array : whether each variant is in any of the intervals of the bed file(s)
+    '''
+    bed_paths = _get_bed_paths(path=path, high_ld=high_ld, build=build, verbose=verbose, log=log)
+    bed = pd.concat([read_bed(bed_path, verbose=verbose, log=log) for bed_path in bed_paths.values()], ignore_index=True)
+    merged = merge_bed_intervals(bed)
+    if verbose: log.write(" -Merged {} intervals into {} non-overlapping intervals...".format(len(bed), sum(len(i[0]) for i in merged.values())))
+    return in_bed_intervals(sumstats[chrom], sumstats[pos], merged)
+
+def annoregion(sumstats, path=None, chrom="CHR", pos="POS", high_ld=False, build="19", prefix="IN_", verbose=True, log=Log()):
+    '''
+    annotate variants with one boolean column per bed file : {prefix}{label}
+    path : a bed path, a list of bed paths (label : file name without .bed/.gz) or a dict of label : bed path
+    '''
+    if verbose: log.write("Start to annotate variants with intervals defined in bed files...")
+    if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))
+    bed_paths = _get_bed_paths(path=path, high_ld=high_ld, build=build, verbose=verbose, log=log)
+    for label, bed_path in bed_paths.items():
+        merged = merge_bed_intervals(read_bed(bed_path, verbose=verbose, log=log))
+        sumstats[prefix+label] = in_bed_intervals(sumstats[chrom], sumstats[pos], merged)
+        if verbose: log.write(" -{} : {} variants in the intervals".format(prefix+label, sumstats[prefix+label].sum()))
+    gc.collect()
+    if verbose: log.write("Finished annotating variants.")
+    return sumstats
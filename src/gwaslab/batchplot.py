@@ -0,0 +1,204 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from gwaslab.Log import Log
+from gwaslab.CommonData import get_chr_to_number
+from gwaslab.quickfix import _quick_fix_chr
+from gwaslab.quickfix import _quick_sort_chrpos
+from gwaslab.getsig import _get_lead_index
+from gwaslab.calculate_gc import lambdaGC
+import gc
+
+# Manhattan / QQ plots for many traits
+#   gl.batch_plot_mqq(["trait1.tsv.gz","trait2.tsv.gz",...], out_dir="./plots", n_cores=4, chrom="CHR", pos="POS", p="P")
+# each trait is loaded (CHR, POS, P only) and plotted in a worker process with the Agg backend ;
+# worker processes are kept for the whole batch so that imports, fonts and the gene index cache (gwaslab.geneindex) are reused
+# a failing trait does not stop the batch : it is reported in the summary table
+#   TRAIT, STATUS, N_VARIANTS, LAMBDA_GC, N_LEAD, RENDER_TIME, OUTPUT, ERROR
+
+SUMMARY_COLUMNS = ["TRAIT","STATUS","N_VARIANTS","LAMBDA_GC","N_LEAD","RENDER_TIME","OUTPUT","ERROR"]
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+def _get_trait_names(sumstats_list, names=None):
+    '''
+    names of the traits : names, file names without extensions or study names ; duplicated names get a suffix
+    '''
+    if names is not None:
+        if len(names)!=len(sumstats_list):
+            raise ValueError("Please provide one name for each trait.")
+        return list(names)
+    trait_names = []
+    for i, sumstats in enumerate(sumstats_list):
+        if isinstance(sumstats, str):
+            name = os.path.basename(sumstats).split(".")[0]
+        else:
+            name = sumstats.meta["gwaslab"]["study_name"] if isinstance(sumstats.meta["gwaslab"]["study_name"], str) else "trait{}".format(i+1)
+        candidate = name
+        suffix = 1
+        while candidate in trait_names:
+            suffix += 1
+            candidate = "{}_{}".format(name, suffix)
+        trait_names.append(candidate)
+    return trait_names
+
+def _uses_snpid(plot_args):
+    # annotation, highlight and pinpoint need the variant IDs
+    anno = plot_args.get("anno", None)
+    return (anno is not None and anno is not False) or len(plot_args.get("highlight", []))>0 or len(plot_args.get("pinpoint", []))>0
+
+def _load_trait(sumstats, fmt=None, chrom="CHR", pos="POS", p="P", snpid=None, keep_snpid=False, readargs=None):
+    '''
+    CHR, POS, P (or MLOG10P) and SNPID (if snpid is given or keep_snpid is True) of a path or a Sumstats object
+    '''
+    if isinstance(sumstats, str):
+        from gwaslab.Sumstats import Sumstats
+        if readargs is None:
+            readargs = {}
+        sumstats = Sumstats(sumstats, fmt=fmt, chrom=chrom, pos=pos, p=p, snpid=snpid, verbose=False, **readargs)
+    cols = [col for col in ["SNPID","CHR","POS","P","MLOG10P"] if col in sumstats.data.columns]
+    if snpid is None and keep_snpid is False and "SNPID" in cols:
+        cols.remove("SNPID")
+    if keep_snpid is True and "SNPID" not in cols:
+        raise ValueError("SNPID is required for anno / highlight / pinpoint. Please provide snpid.")
+    if "P" in cols and "MLOG10P" in cols:
+        cols.remove("MLOG10P")
+    return sumstats.data.loc[:,cols]
+
+def _count_leads(data, sig_level=5e-8, windowsizekb=500):
+    '''
+    number of lead variants (loci separated by > windowsizekb) with P < sig_level
+    '''
+    if "P" in data.columns:
+        scaledp = pd.to_numeric(data["P"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        is_sig = scaledp < sig_level
+    else:
+        scaledp = -pd.to_numeric(data["MLOG10P"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        is_sig = scaledp < np.log10(sig_level)
+    sig = pd.DataFrame({"CHR":_quick_fix_chr(data["CHR"], chr_dict=get_chr_to_number()).to_numpy(dtype="float64", na_value=np.nan)[is_sig],
+                        "POS":pd.to_numeric(data["POS"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)[is_sig],
+                        "SCALEDP":scaledp[is_sig]})
+    sig = _quick_sort_chrpos(sig.dropna(subset=["CHR","POS"]))
+    return len(_get_lead_index(sig["CHR"], sig["POS"], sig["SCALEDP"], windowsizekb))
+
+def _plot_trait(task):
+    '''
+    load and plot one trait ; return one row of the summary table
+    '''
+    name, sumstats, out_path, load_args, lead_args, plot_args = task
+    import matplotlib.pyplot as plt
+    from gwaslab.mqqplot import mqqplot
+    row = {"TRAIT":name, "STATUS":"FAILED", "N_VARIANTS":np.nan, "LAMBDA_GC":np.nan, "N_LEAD":np.nan,
+           "RENDER_TIME":np.nan, "OUTPUT":"", "ERROR":""}
+    try:
+        data = _load_trait(sumstats, **load_args)
+        row["N_VARIANTS"] = len(data)
+        scaled = "P" not in data.columns
+        # the plot cache returns lambda GC of the QQ panel
+        plot_cache = {}
+        start_time = time.time()
+        fig, log = mqqplot(data,
+                           chrom="CHR",
+                           pos="POS",
+                           p="P",
+                           snpid="SNPID" if "SNPID" in data.columns else None,
+                           scaled=scaled,
+                           save=out_path,
+                           verbose=False,
+                           _cache=plot_cache,
+                           **plot_args)
+        plt.close(fig)
+        row["RENDER_TIME"] = time.time() - start_time
+        row["OUTPUT"] = out_path
+        lambdagc = [value for key, value in plot_cache.items() if key[0]=="gc"]
+        if len(lambdagc)>0:
+            row["LAMBDA_GC"] = lambdagc[0]
+        else:
+            row["LAMBDA_GC"] = lambdaGC(data, mode="MLOG10P" if scaled else "P", verbose=False)
+        row["N_LEAD"] = _count_leads(data, **lead_args)
+        row["STATUS"] = "OK"
+    except Exception as error:
+        plt.close("all")
+        row["ERROR"] = "{}: {}".format(type(error).__name__, error)
+    del sumstats
+    gc.collect()
+    return row
+
+def _spawn_plot_columns(glsumstats):
+    # Sumstats object with only the columns used by the batch plot
+    cols = [col for col in ["SNPID","CHR","POS","P","MLOG10P"] if col in glsumstats.data.columns]
+    new_sumstats = glsumstats._spawn()
+    new_sumstats.data = glsumstats.data.loc[:,cols]
+    return new_sumstats
+
+def _log_trait(row, log):
+    if row["STATUS"]=="OK":
+        log.write(" -{} : {} variants, lambda GC = {:.4f}, {} lead variants, {:.2f} s".format(row["TRAIT"], row["N_VARIANTS"], row["LAMBDA_GC"], row["N_LEAD"], row["RENDER_TIME"]))
+    else:
+        log.write(" -{} : failed ({})".format(row["TRAIT"], row["ERROR"]))
+
+def batch_plot_mqq(sumstats_list,
+                   out_dir="./",
+                   n_cores=1,
+                   names=None,
+                   fmt=None,
+                   chrom="CHR",
+                   pos="POS",
+                   p="P",
+                   snpid=None,
+                   readargs=None,
+                   sig_level=5e-8,
+                   windowsizekb=500,
+                   fig_format="png",
+                   verbose=True,
+                   log=Log(),
+                   **plot_args):
+    '''
+    Manhattan / QQ plots of many traits (paths or Sumstats objects) with n_cores worker processes
+    plot_args are passed to mqqplot ; return the summary table (also saved to out_dir/batch_plot_mqq_summary.tsv)
+    '''
+    if verbose: log.write("Start to create Manhattan / QQ plots for {} traits...".format(len(sumstats_list)))
+    if verbose: log.write(" -CPU Cores to use :",n_cores)
+    os.makedirs(out_dir, exist_ok=True)
+    trait_names = _get_trait_names(sumstats_list, names=names)
+    plot_args["sig_level"] = sig_level
+
+    load_args = {"fmt":fmt, "chrom":chrom, "pos":pos, "p":p, "snpid":snpid, "keep_snpid":_uses_snpid(plot_args), "readargs":readargs}
+    lead_args = {"sig_level":sig_level, "windowsizekb":windowsizekb}
+    tasks = []
+    for name, sumstats in zip(trait_names, sumstats_list):
+        if not isinstance(sumstats, str):
+            # only the columns to plot are sent to the workers
+            sumstats = _spawn_plot_columns(sumstats)
+        out_path = os.path.join(out_dir, "{}_mqq.{}".format(name, fig_format))
+        tasks.append((name, sumstats, out_path, load_args, lead_args, plot_args))
+
+    if len(tasks)==0:
+        rows = []
+    elif n_cores>1:
+        pool = Pool(min(n_cores, len(tasks)), initializer=_init_worker)
+        rows = []
+        for row in pool.imap(_plot_trait, tasks):
+            rows.append(row)
+            if verbose: _log_trait(row, log)
+        pool.close()
+        pool.join()
+    else:
+        rows = []
+        for task in tasks:
+            row = _plot_trait(task)
+            rows.append(row)
+            if verbose: _log_trait(row, log)
+
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+    summary = summary.astype({"N_VARIANTS":"Int64","N_LEAD":"Int64"})
+    summary_path = os.path.join(out_dir, "batch_plot_mqq_summary.tsv")
+    summary.to_csv(summary_path, sep="\t", index=None)
+    if verbose: log.write(" -Plotted {} traits ; {} failed".format((summary["STATUS"]=="OK").sum(), (summary["STATUS"]!="OK").sum()))
+    if verbose: log.write(" -Summary is saved to : {}".format(summary_path))
+    if verbose: log.write("Finished creating Manhattan / QQ plots.")
+    return summary
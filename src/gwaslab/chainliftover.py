@@ -0,0 +1,228 @@
+import os
+import gzip
+import numpy as np
+import pandas as pd
+from gwaslab.Log import Log
+from gwaslab.CommonData import get_chr_to_number
+from gwaslab.CommonData import get_number_to_chr
+import gc
+
+# native batch liftover with UCSC chain files
+# the chain file is loaded once into per-chromosome sorted, non-overlapping interval arrays:
+#   start / end (0-based, source build) , target chromosome , target position at start , strand
+# positions of a whole chromosome are then mapped with one np.searchsorted
+#
+# chain format (https://genome.ucsc.edu/goldenPath/help/chain.html):
+#   chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id
+#   size dt dq
+#   ...
+#   size
+# t : source build ; q : target build ; q coordinates on the - strand are counted from the end of qName
+
+_CHAIN_INDEX = {}
+
+#################################################################################################################
+
+def get_chain_path(from_build="19", to_build="38", chain_path=None, verbose=True, log=Log()):
+    '''
+    return the path to the chain file hg{from_build}ToHg{to_build}.over.chain.gz
+    the file is searched in (and downloaded to) the cache directory used by the liftover package
+    '''
+    if chain_path is not None:
+        if not os.path.isfile(chain_path):
+            raise ValueError("Chain file not found: {}".format(chain_path))
+        return chain_path
+
+    try:
+        from liftover.lifter import default_cache_dir
+        from liftover.download_file import download_file
+        cache_dir = default_cache_dir()
+    except ImportError:
+        # older liftover releases : ~/.liftover and urllib
+        cache_dir = os.path.expanduser("~/.liftover")
+        download_file = _download_file
+
+    basename = "hg{}ToHg{}.over.chain.gz".format(from_build, to_build)
+    for directory in [cache_dir, os.path.expanduser("~/.liftover")]:
+        path = os.path.join(directory, basename)
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            return path
+
+    path = os.path.join(cache_dir, basename)
+    url = "https://hgdownload.soe.ucsc.edu/goldenPath/hg{}/liftOver/{}".format(from_build, basename)
+    if verbose: log.write(" -Downloading chain file from {} ...".format(url))
+    os.makedirs(cache_dir, exist_ok=True)
+    download_file(url, path)
+    return path
+
+def _download_file(url, path):
+    # download to a temporary file first so that an interrupted download does not leave a truncated chain file
+    import urllib.request
+    import shutil
+    tmp_path = path + ".tmp"
+    with urllib.request.urlopen(url) as response, open(tmp_path, "wb") as f:
+        shutil.copyfileobj(response, f)
+    os.replace(tmp_path, path)
+
+def _read_chain_blocks(chain_path):
+    '''
+    parse a chain file into a dataframe of aligned blocks (one row per block, in file order)
+    '''
+    t_chrom=[]
+    t_start=[]
+    q_chrom=[]
+    q_size=[]
+    q_strand=[]
+    q_start=[]
+    size=[]
+
+    opener = gzip.open if chain_path.endswith(".gz") else open
+    with opener(chain_path, "rt") as file:
+        for line in file:
+            fields = line.split()
+            if len(fields)==0:
+                continue
+            if fields[0]=="chain":
+                chain_t_chrom = fields[2]
+                chain_q_chrom, chain_q_size, chain_q_strand = fields[7], int(fields[8]), fields[9]
+                t_pos, q_pos = int(fields[5]), int(fields[10])
+                continue
+            block_size = int(fields[0])
+            t_chrom.append(chain_t_chrom)
+            t_start.append(t_pos)
+            q_chrom.append(chain_q_chrom)
+            q_size.append(chain_q_size)
+            q_strand.append(chain_q_strand)
+            q_start.append(q_pos)
+            size.append(block_size)
+            if len(fields)==3:
+                t_pos += block_size + int(fields[1])
+                q_pos += block_size + int(fields[2])
+
+    blocks = pd.DataFrame({"T_CHR":t_chrom,
+                           "T_START":np.array(t_start,dtype="int64"),
+                           "SIZE":np.array(size,dtype="int64"),
+                           "Q_CHR":q_chrom,
+                           "Q_SIZE":np.array(q_size,dtype="int64"),
+                           "Q_STRAND":q_strand,
+                           "Q_START":np.array(q_start,dtype="int64")})
+    return blocks
+
+def _build_chrom_index(blocks):
+    '''
+    blocks of one source chromosome (file order = priority) -> sorted non-overlapping intervals
+    overlapping blocks (e.g. duplications) are resolved in favour of the block that comes first in the chain file
+    '''
+    starts = blocks["T_START"].values
+    ends = starts + blocks["SIZE"].values
+    order = np.argsort(starts, kind="mergesort")
+
+    if np.all(starts[order][1:] >= np.maximum.accumulate(ends[order])[:-1]):
+        # no overlap : one interval per block
+        owner = order
+        seg_start = starts[order]
+        seg_end = ends[order]
+    else:
+        # split into elementary segments and assign each segment to the first covering block
+        boundaries = np.unique(np.concatenate([starts, ends]))
+        first = np.searchsorted(boundaries, starts)
+        last = np.searchsorted(boundaries, ends)
+        segment_owner = np.full(len(boundaries)-1, -1, dtype="int64")
+        for i in range(len(blocks)-1, -1, -1):
+            segment_owner[first[i]:last[i]] = i
+        covered = segment_owner >= 0
+        owner = segment_owner[covered]
+        seg_start = boundaries[:-1][covered]
+        seg_end = boundaries[1:][covered]
+
+    q_chr = blocks["Q_CHR"].values[owner]
+    q_size = blocks["Q_SIZE"].values[owner]
+    is_minus = blocks["Q_STRAND"].values[owner]=="-"
+    q_at_start = blocks["Q_START"].values[owner] + (seg_start - starts[owner])
+    # - strand : convert to 0-based + strand coordinates ; position decreases along the source build
+    q_at_start = np.where(is_minus, q_size - 1 - q_at_start, q_at_start)
+
+    return {"start":seg_start,
+            "end":seg_end,
+            "q_chr":q_chr,
+            "q_pos":q_at_start,
+            "strand":np.where(is_minus, -1, 1).astype("int8")}
+
+def load_chain(chain_path, verbose=True, log=Log()):
+    '''
+    load a chain file into {source contig : interval index} (cached in memory by path)
+    '''
+    if chain_path in _CHAIN_INDEX:
+        return _CHAIN_INDEX[chain_path]
+    if verbose: log.write(" -Loading chain file: {}".format(chain_path))
+    blocks = _read_chain_blocks(chain_path)
+    chain_index = {}
+    for contig, group in blocks.groupby("T_CHR", sort=False):
+        chain_index[contig] = _build_chrom_index(group.reset_index(drop=True))
+    if verbose: log.write(" -Loaded {} aligned blocks on {} contigs...".format(len(blocks), len(chain_index)))
+    _CHAIN_INDEX[chain_path] = chain_index
+    del blocks
+    gc.collect()
+    return chain_index
+
+def _get_chrom_index(chain_index, contig):
+    for name in ["chr"+str(contig), str(contig)]:
+        if name in chain_index:
+            return chain_index[name]
+    return None
+
+def map_positions(chain_index, contig, pos_0_based):
+    '''
+    map an array of 0-based positions on one source contig (1, X, M ... with or without chr prefix)
+    return target contig (object, None if unmapped), 0-based target position (-1 if unmapped), strand (1/-1, 0 if unmapped)
+    '''
+    pos_0_based = np.asarray(pos_0_based, dtype="int64")
+    q_chr = np.full(len(pos_0_based), None, dtype="object")
+    q_pos = np.full(len(pos_0_based), -1, dtype="int64")
+    strand = np.zeros(len(pos_0_based), dtype="int8")
+
+    index = _get_chrom_index(chain_index, contig)
+    if index is None or len(index["start"])==0:
+        return q_chr, q_pos, strand
+
+    i = np.searchsorted(index["start"], pos_0_based, side="right") - 1
+    i_clipped = np.clip(i, 0, None)
+    is_mapped = (i >= 0) & (pos_0_based < index["end"][i_clipped])
+    hit = i_clipped[is_mapped]
+
+    q_chr[is_mapped] = index["q_chr"][hit]
+    q_pos[is_mapped] = index["q_pos"][hit] + index["strand"][hit] * (pos_0_based[is_mapped] - index["start"][hit])
+    strand[is_mapped] = index["strand"][hit]
+    return q_chr, q_pos, strand
+
+def liftover_chain(chrom_array, pos_array, chain_index):
+    '''
+    batch liftover of 1-based positions (CHR as gwaslab chromosome numbers)
+    return target CHR number (float, NaN if not mapped), 1-based target POS (float, NaN if not mapped),
+           strand (1/-1, 0 if not mapped) and whether the variant was mapped to another chromosome
+    '''
+    chr_to_number = get_chr_to_number(out_chr=False)
+    number_to_chr = get_number_to_chr(in_chr=False, xymt=["X","Y","M"])
+    chrom_array = pd.Series(chrom_array).to_numpy(dtype="object")
+    pos_array = pd.to_numeric(pd.Series(pos_array), errors="coerce").to_numpy(dtype="float64")
+
+    lifted_chr = np.full(len(pos_array), np.nan)
+    lifted_pos = np.full(len(pos_array), np.nan)
+    lifted_strand = np.zeros(len(pos_array), dtype="int8")
+    is_cross_chr = np.zeros(len(pos_array), dtype="bool")
+
+    is_valid = ~pd.isna(chrom_array) & ~np.isnan(pos_array)
+    for chr_number in pd.unique(chrom_array[is_valid]):
+        on_chrom = np.flatnonzero(is_valid & (chrom_array == chr_number))
+        contig = number_to_chr.get(chr_number, str(chr_number))
+        q_chr, q_pos, strand = map_positions(chain_index, contig, pos_array[on_chrom].astype("int64") - 1)
+
+        q_chr_number = pd.Series(q_chr).str.replace("^chr", "", regex=True).map(chr_to_number).to_numpy(dtype="float64")
+        is_mapped = strand != 0
+        is_same_chr = is_mapped & (q_chr_number == float(chr_number))
+
+        lifted_chr[on_chrom[is_same_chr]] = q_chr_number[is_same_chr]
+        lifted_pos[on_chrom[is_same_chr]] = q_pos[is_same_chr] + 1
+        lifted_strand[on_chrom[is_same_chr]] = strand[is_same_chr]
+        is_cross_chr[on_chrom[is_mapped & ~is_same_chr]] = True
+    return lifted_chr, lifted_pos, lifted_strand, is_cross_chr
@@ -13,6 +13,7 @@ from statsmodels.stats.multitest import fdrcorrection
 from matplotlib.patches import Rectangle
 from adjustText import adjust_text
 from gwaslab.figuresave import save_figure
+from gwaslab.variantkey import id_key
 
 #20220422
 def compare_effect(path1,
@@ -135,7 +136,8 @@ def compare_effect(path1,
     else:
         sumstats=pd.read_table(path2,sep=sep[1],usecols=[cols_name_list_2[0]])
         
-    common_snp_set=set(sumstats[cols_name_list_2[0]].values)
+    # IDs are compared as uint64 hashes instead of a python set of strings
+    common_snp_set = np.unique(id_key(sumstats[cols_name_list_2[0]]))
     
     ######### 3 extract snplist1
     if snplist is not None:
@@ -158,7 +160,8 @@ def compare_effect(path1,
     if scaled1==True:
         sumstats[cols_name_list_1[1]] = np.power(10,-sumstats[cols_name_list_1[1]])
     ######### 5 extract the common set
-    common_snp_set = common_snp_set.intersection(sumstats[cols_name_list_1[0]].values)
+    common_snp_set = np.intersect1d(common_snp_set, id_key(sumstats[cols_name_list_1[0]]))
+    common_snp_set = common_snp_set[common_snp_set!=0]
     if verbose: log.write(" -Counting  variants available for both datasets:",len(common_snp_set)," variants...")
     
     ######### 6 rename the sumstats
@@ -173,7 +176,7 @@ def compare_effect(path1,
     sumstats.rename(columns=rename_dict,inplace=True)
     
     ######### 7 exctract only available variants from sumstats1 
-    sumstats = sumstats.loc[sumstats["SNPID"].isin(common_snp_set),:]
+    sumstats = sumstats.loc[np.isin(id_key(sumstats["SNPID"]), common_snp_set),:]
     
     if verbose: log.write(" -Using only variants available for both datasets...")
     ######### 8 extact SNPs for comparison 
@@ -219,7 +222,7 @@ def compare_effect(path1,
     sumstats.rename(columns=rename_dict,inplace=True)
     
     ######### 11 exctract only overlapping variants from sumstats2
-    sumstats = sumstats.loc[sumstats["SNPID"].isin(common_snp_set),:]
+    sumstats = sumstats.loc[np.isin(id_key(sumstats["SNPID"]), common_snp_set),:]
     
     ######## 12 extact SNPs for comparison 
     if snplist: 
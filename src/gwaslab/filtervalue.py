@@ -5,6 +5,12 @@ import numpy as np
 from os import path
 from gwaslab.CommonData import get_high_ld
 from gwaslab.CommonData import get_chr_to_number
+from gwaslab.variantkey import chrpos_key
+from gwaslab.get_hapmap3 import get_hapmap3_positions
+from gwaslab.get_hapmap3 import is_hapmap3_positions_available
+from gwaslab.annotateregion import inbed
+from gwaslab.lazyfilter import compare_column
+from gwaslab.lazyfilter import take_rows
 from gwaslab.Log import Log
 from gwaslab.vchangestatus import vchange_status
 from gwaslab.fixdata import sortcoordinate
@@ -13,7 +19,8 @@ import gc
 def filtervalues(sumstats,expr,remove=False,verbose=True,log=Log()):
     if verbose: log.write("Start filtering values by condition:",expr)
     prenum = len(sumstats)
-    sumstats = sumstats.query(expr,engine='python').copy()
+    is_met = sumstats.eval(expr,engine='python').fillna(False).to_numpy(dtype="bool")
+    sumstats = take_rows(sumstats, is_met)
     afternum = len(sumstats)
     if verbose: log.write(" -Removing "+ str(prenum-afternum) +" variants not meeting the conditions:",expr)
     if verbose: log.write("Finished filtering values.")
@@ -22,240 +29,144 @@ def filtervalues(sumstats,expr,remove=False,verbose=True,log=Log()):
 
 def filterout(sumstats,interval={},lt={},gt={},eq={},remove=False,verbose=True,log=Log()):
     if verbose: log.write("Start filtering values:")
+    # one mask for all conditions ; counts are reported on the variants left by the previous conditions
+    keep = np.ones(len(sumstats), dtype="bool")
     for key,threshold in gt.items():
-        num = len(sumstats.loc[sumstats[key]>threshold,:])
+        num = np.count_nonzero(keep & compare_column(sumstats[key],"gt",threshold))
         if verbose:log.write(" -Removing "+ str(num) +" variants with "+key+" > "+ str(threshold)+" ...")
-        sumstats = sumstats.loc[sumstats[key]<threshold,:]
+        keep &= compare_column(sumstats[key],"lt",threshold)
     for key,threshold in lt.items():
-        num = len(sumstats.loc[sumstats[key]<threshold,:])
+        num = np.count_nonzero(keep & compare_column(sumstats[key],"lt",threshold))
         if verbose:log.write(" -Removing "+ str(num) +" variants with "+key+" < "+ str(threshold)+" ...")
-        sumstats = sumstats.loc[sumstats[key]>threshold,:]
+        keep &= compare_column(sumstats[key],"gt",threshold)
     for key,threshold in eq.items():
-        num = len(sumstats.loc[sumstats[key]==threshold,:])
+        num = np.count_nonzero(keep & compare_column(sumstats[key],"eq",threshold))
         if verbose:log.write(" -Removing "+ str(num) +" variants with "+key+" = "+ str(threshold)+" ...")
-        sumstats = sumstats.loc[sumstats[key]!=threshold,:]
+        keep &= ~compare_column(sumstats[key],"eq",threshold)
+    sumstats = take_rows(sumstats, keep)
     if verbose: log.write("Finished filtering values.")
     gc.collect()
-    return sumstats.copy()
+    return sumstats
 
 def filterin(sumstats,lt={},gt={},eq={},remove=False,verbose=True,log=Log()):
     if verbose: log.write("Start filtering values:")
+    keep = np.ones(len(sumstats), dtype="bool")
     for key,threshold in gt.items():
-        num = len(sumstats.loc[sumstats[key]>threshold,:])
-        if verbose:log.write(" -Keeping "+ str(num) +" variants with "+key+" > "+ str(threshold)+" ...")
-        sumstats = sumstats.loc[sumstats[key]>threshold,:]
+        keep &= compare_column(sumstats[key],"gt",threshold)
+        if verbose:log.write(" -Keeping "+ str(np.count_nonzero(keep)) +" variants with "+key+" > "+ str(threshold)+" ...")
     for key,threshold in lt.items():
-        num = len(sumstats.loc[sumstats[key]<threshold,:])
-        if verbose:log.write(" -Keeping "+ str(num) +" variants with "+key+" < "+ str(threshold)+" ...")
-        sumstats = sumstats.loc[sumstats[key]<threshold,:]
+        keep &= compare_column(sumstats[key],"lt",threshold)
+        if verbose:log.write(" -Keeping "+ str(np.count_nonzero(keep)) +" variants with "+key+" < "+ str(threshold)+" ...")
     for key,threshold in eq.items():
-        num = len(sumstats.loc[sumstats[key]==threshold,:])
-        if verbose:log.write(" -Keeping "+ str(num) +" variants with "+key+" = "+ str(threshold)+" ...")
-        sumstats = sumstats.loc[sumstats[key]==threshold,:]
+        keep &= compare_column(sumstats[key],"eq",threshold)
+        if verbose:log.write(" -Keeping "+ str(np.count_nonzero(keep)) +" variants with "+key+" = "+ str(threshold)+" ...")
+    sumstats = take_rows(sumstats, keep)
     if verbose: log.write("Finished filtering values.")
     gc.collect()
-    return sumstats.copy()
+    return sumstats
 
 def filterregionin(sumstats,path=None, chrom="CHR",pos="POS", high_ld=False, build="19", verbose=True,log=Log()):
-    sumstats = sortcoordinate(sumstats,verbose=verbose)
+    '''
+    keep variants in the intervals of the bed file(s) ; path : a bed path or a list of bed paths
+    '''
     if verbose: log.write("Start to filter in variants if in intervals defined in bed files:")
     if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))
     
-    if high_ld is True:
-        path = get_high_ld(build=build)
-        if verbose: log.write(" -Loading bed format file for hg"+build)
-
-    else:
-        if verbose: log.write(" -Loading bed format file: " , path)
-    bed = pd.read_csv(path,sep="\s+",header=None,dtype={0:"string",1:"Int64",2:"Int64"})
-    
-    bed["tuple"] = bed.apply(lambda x: (x[1],x[2]),axis=1)
-    sumstats["bed_indicator"]=False
-    dic=get_chr_to_number(out_chr=True)
-    bed[0]=bed[0].str.strip("chr")
-    bed[0]=bed[0].map(dic).astype("string")
-    bed[0]=bed[0].astype("Int64")
-    sumstats = sumstats.sort_values(["CHR","POS"])
+    bed_indicator = inbed(sumstats, path=path, chrom=chrom, pos=pos, high_ld=high_ld, build=build, verbose=verbose, log=log)
     
-    if len(bed)<100:
-        if verbose: log.write(" -Bed file < 100 lines: using pd IntervalIndex... ")
-        for i in sumstats[chrom].unique():
-            if sum(bed[0]==i)>0:
-                interval = pd.IntervalIndex.from_tuples(bed.loc[bed[0]==i,"tuple"])
-                sumstats.loc[sumstats[chrom]==i,"bed_indicator"] = sumstats.loc[sumstats[chrom]==i,pos].apply(lambda x: any(interval.contains(x)))
-            else:
-                continue
-    else:
-        if verbose: log.write(" -Bed file > 100 lines: using two pointers, please make files are all sorted... ")
-        bed_num  =0
-        bed_chr   =bed.iloc[bed_num,0]
-        bed_left  =bed.iloc[bed_num,1]
-        bed_right =bed.iloc[bed_num,2]
-        
-        sum_num=0
-        sum_chr_col = sumstats.columns.get_loc(chrom)
-        sum_pos_col = sumstats.columns.get_loc(pos)
-        sum_ind_col = sumstats.columns.get_loc("bed_indicator")
-        while bed_num<len(bed) and sum_num<len(sumstats):
-            #sumstats variant chr < bed chr
-            if sumstats.iat[sum_num,sum_chr_col]<bed_chr:
-                # next variant
-                sum_num+=1
-                continue
-            #sumstats variant chr > bed chr
-            elif sumstats.iat[sum_num,sum_chr_col]>bed_chr:
-                # next bed record
-                bed_num+=1
-                bed_chr  =bed.iat[bed_num,0]
-                bed_left  = bed.iat[bed_num,1]
-                bed_right  = bed.iat[bed_num,2]
-                continue
-            #sumstats variant chr == bed chr
-            else:
-                #sumstats variant pos < bed left
-                if sumstats.iat[sum_num,sum_pos_col]<bed_left:
-                    # next variant
-                    sum_num+=1
-                    continue
-                #sumstats variant pos > bed right
-                elif sumstats.iat[sum_num,sum_pos_col]>bed_right:
-                    # next bed record
-                    bed_num+=1
-                    bed_chr  =bed.iat[bed_num,0]
-                    bed_left  = bed.iat[bed_num,1]
-                    bed_right  = bed.iat[bed_num,2]
-                # bed left  < sumstats variant  pos < bed right
-                else:
-                    # set to true
-                    sumstats.iat[sum_num,sum_ind_col]=True
-                    # next variant
-                    sum_num+=1
-                           
     ## in
-    
-    sumstats = sumstats.loc[sumstats["bed_indicator"],:]
-    if verbose: log.write(" -Number of variants in the specified regions to keep:",sum(sumstats["bed_indicator"]))
-    if verbose: log.write(" -Number of variants removed:",sum(~sumstats["bed_indicator"]))
-    sumstats = sumstats.drop(columns="bed_indicator")
+    sumstats = sumstats.loc[bed_indicator,:]
+    if verbose: log.write(" -Number of variants in the specified regions to keep:",sum(bed_indicator))
+    if verbose: log.write(" -Number of variants removed:",sum(~bed_indicator))
     if verbose: log.write("Finished filtering in variants.")
     gc.collect()
     return sumstats
 
 def filterregionout(sumstats, path=None, chrom="CHR",pos="POS", high_ld=False, build="19", verbose=True,log=Log()):
-    sumstats = sortcoordinate(sumstats,verbose=verbose)
+    '''
+    remove variants in the intervals of the bed file(s) ; path : a bed path or a list of bed paths
+    '''
     if verbose: log.write("Start to filter out variants if in intervals defined in bed files:")
     if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))
-    if high_ld is True:
-        path = get_high_ld(build=build)
-        if verbose: log.write(" -Loading bed format file for hg"+build)
-
-    else:
-        if verbose: log.write(" -Loading bed format file: " , path)
-            
-    bed = pd.read_csv(path,sep="\s+",header=None,dtype={0:"string",1:"Int64",2:"Int64"})
-    bed["tuple"] = bed.apply(lambda x: (x[1],x[2]),axis=1)
-    sumstats["bed_indicator"]=False
     
-    dic=get_chr_to_number(out_chr=True)
-    bed[0]=bed[0].str.strip("chr")
-    bed[0]=bed[0].map(dic).astype("string")
-    bed[0]=bed[0].astype("Int64")
+    bed_indicator = inbed(sumstats, path=path, chrom=chrom, pos=pos, high_ld=high_ld, build=build, verbose=verbose, log=log)
     
-    if len(bed)<100:
-        if verbose: log.write(" -Bed file < 100 lines: using pd IntervalIndex... ")
-        for i in sumstats[chrom].unique():
-            if sum(bed[0]==i)>0:
-                interval = pd.IntervalIndex.from_tuples(bed.loc[bed[0]==i,"tuple"])
-                sumstats.loc[sumstats[chrom]==i,"bed_indicator"] = sumstats.loc[sumstats[chrom]==i,pos].apply(lambda x: any(interval.contains(x)))
-            else:
-                continue
-    else:
-        if verbose: log.write(" -Bed file > 100 lines: using two pointers, please make files are all sorted... ")
-        bed_num  =0
-        bed_chr  =bed.iloc[bed_num,0]
-        bed_left  =bed.iloc[bed_num,1]
-        bed_right =bed.iloc[bed_num,2]
-        
-        sum_num=0
-        sum_chr_col = sumstats.columns.get_loc(chrom)
-        sum_pos_col = sumstats.columns.get_loc(pos)
-        sum_ind_col = sumstats.columns.get_loc("bed_indicator")
-        while bed_num<len(bed) and sum_num<len(sumstats):
-            if sumstats.iat[sum_num,sum_chr_col]<bed_chr:
-                sum_num+=1
-                continue
-            elif sumstats.iat[sum_num,sum_chr_col]>bed_chr:
-                bed_num+=1
-                bed_chr  =bed.iat[bed_num,0]
-                bed_left  = bed.iat[bed_num,1]
-                bed_right  = bed.iat[bed_num,2]
-                continue
-            else:
-                if sumstats.iat[sum_num,sum_pos_col]<bed_left:
-                    sum_num+=1
-                    continue
-                elif sumstats.iat[sum_num,sum_pos_col]>bed_right:
-                    bed_num+=1
-                    bed_chr  =bed.iat[bed_num,0]
-                    bed_left  = bed.iat[bed_num,1]
-                    bed_right  = bed.iat[bed_num,2]
-                else:
-                    sumstats.iat[sum_num,sum_ind_col]=True
-                    sum_num+=1
-                           
     ## out
-    
-    sumstats = sumstats.loc[~sumstats["bed_indicator"],:]
-    if verbose: log.write(" -Number of variants in the specified regions to exclude:",sum(sumstats["bed_indicator"]))
+    sumstats = sumstats.loc[~bed_indicator,:]
+    if verbose: log.write(" -Number of variants in the specified regions to exclude:",sum(bed_indicator))
     if verbose: log.write(" -Number of variants left:",len(sumstats))
-    sumstats = sumstats.drop(columns="bed_indicator")
     if verbose: log.write("Finished filtering out variants.")
     gc.collect()
     return sumstats
 
-def inferbuild(sumstats,status="STATUS",chrom="CHR", pos="POS", ea="EA", nea="NEA",build="19", verbose=True,log=Log()):
+def _isin_sorted(sorted_keys, keys):
+    idx = np.searchsorted(sorted_keys, keys)
+    idx_clipped = np.clip(idx, 0, max(len(sorted_keys)-1, 0))
+    return (idx < len(sorted_keys)) & (sorted_keys[idx_clipped] == keys)
+
+def inferbuild(sumstats,status="STATUS",chrom="CHR", pos="POS", ea="EA", nea="NEA",build="19", 
+               builds=None, n_sample=100000, batch_size=10000, z_threshold=5, random_state=0, verbose=True,log=Log()):
+    '''
+    infer the genome build by matching CHR:POS against packed HapMap3 positions of each build (binary search)
+    up to n_sample randomly sampled variants are checked in batches of batch_size ; checking stops early when the best build
+    is decisive : (only_best - only_second) / sqrt(only_best + only_second) >= z_threshold
+    builds : candidate builds (default : 19 and 38, plus 18 if its packed positions are available)
+    '''
     inferred_build="Unknown"
+    status_digits = {"19":("1","9"),"38":("3","8"),"18":("1","8")}
     if verbose:log.write("Start to infer genome build version using hapmap3 SNPs...")    
-    data_path_19 =  path.dirname(__file__) + '/data/hapmap3_SNPs/hapmap3_db150_hg19.snplist.gz'    
-    data_path_38 =  path.dirname(__file__) + '/data/hapmap3_SNPs/hapmap3_db151_hg38.snplist.gz'    
-    if verbose:log.write(" -Loading Hapmap3 variants data...")        
-    hapmap3_ref_19 = pd.read_csv(data_path_19,sep="\s+",usecols=["#CHROM","POS"],dtype={"#CHROM":"string","POS":"string"})
-    hapmap3_ref_38 = pd.read_csv(data_path_38,sep="\s+",usecols=["#CHROM","POS"],dtype={"#CHROM":"string","POS":"string"})
-    
-    if chrom in sumstats.columns and pos in sumstats.columns:
-        if verbose: log.write(" -CHR:POS will be used for matching...")
-        raw_chrpos = sumstats[chrom].astype("string")+":"+sumstats[pos].astype("string")
-        
-        hapmap3_ref_19["chr:pos"] = hapmap3_ref_19["#CHROM"]+":"+hapmap3_ref_19["POS"]
-        hapmap3_ref_38["chr:pos"] = hapmap3_ref_38["#CHROM"]+":"+hapmap3_ref_38["POS"]
-        
-        match_count_for_19 = sum(raw_chrpos.isin(hapmap3_ref_19["chr:pos"].values))
-        match_count_for_38 = sum(raw_chrpos.isin(hapmap3_ref_38["chr:pos"].values))
-        
-        if verbose:log.write(" -Matching variants for hg19: num_hg19 = ",match_count_for_19)        
-        if verbose:log.write(" -Matching variants for hg38: num_hg38 = ",match_count_for_38) 
-        
-        if max(match_count_for_19, match_count_for_38)<10000:
-            if verbose:log.write(" -Warning: please be cautious due to the limited number of variants.") 
-        
-        if match_count_for_19 > match_count_for_38:
-            if verbose:log.write(" -Since num_hg19 >> num_hg38, assigning genome build hg19...") 
-            sumstats.loc[:,status] = vchange_status(sumstats.loc[:,status],1,"9","1")
-            sumstats.loc[:,status] = vchange_status(sumstats.loc[:,status],2,"9","9")
-            inferred_build="19"
-        elif match_count_for_19 < match_count_for_38:
-            if verbose:log.write(" -Since num_hg19 << num_hg38, assigning genome build hg38...") 
-            sumstats.loc[:,status] = vchange_status(sumstats.loc[:,status],1,"9","3")
-            sumstats.loc[:,status] = vchange_status(sumstats.loc[:,status],2,"9","8")
-            inferred_build="38"
-        else:
-            if verbose:log.write(" -Since num_hg19 = num_hg38, unable to infer...") 
-        gc.collect()
-        if verbose:log.write("Finished inferring genome build version using hapmap3 SNPs...") 
-        return sumstats, inferred_build
-    else:
+    if chrom not in sumstats.columns or pos not in sumstats.columns:
         gc.collect()
         raise ValueError("Not enough information to match SNPs. Please check if CHR and POS columns are in your sumstats...")
+    if builds is None:
+        builds = [i for i in ["19","38","18"] if is_hapmap3_positions_available(i)]
+    if verbose:log.write(" -Loading packed Hapmap3 positions for : {}".format(",".join(["hg"+i for i in builds])))
+    hapmap3_keys = {i:get_hapmap3_positions(i, verbose=verbose, log=log) for i in builds}
+    
+    if verbose: log.write(" -CHR:POS will be used for matching...")
+    # sample rows first so that only the sampled variants are keyed
+    rng = np.random.default_rng(random_state)
+    if len(sumstats) > n_sample:
+        sampled = rng.choice(len(sumstats), n_sample, replace=False)
+    else:
+        sampled = rng.permutation(len(sumstats))
+    raw_chrpos = chrpos_key(sumstats[chrom].values[sampled], sumstats[pos].values[sampled])
+    raw_chrpos = raw_chrpos[raw_chrpos!=-1]
+
+    is_matched = {i:np.zeros(0, dtype="bool") for i in builds}
+    is_decisive = False
+    for batch_start in range(0, len(raw_chrpos), batch_size):
+        batch = raw_chrpos[batch_start:batch_start+batch_size]
+        for i in builds:
+            is_matched[i] = np.concatenate([is_matched[i], _isin_sorted(hapmap3_keys[i], batch)])
+        ranked = sorted(builds, key=lambda i:is_matched[i].sum(), reverse=True)
+        if len(ranked) > 1:
+            only_best = (is_matched[ranked[0]] & ~is_matched[ranked[1]]).sum()
+            only_second = (is_matched[ranked[1]] & ~is_matched[ranked[0]]).sum()
+            if only_best + only_second > 0 and (only_best - only_second)/np.sqrt(only_best + only_second) >= z_threshold:
+                is_decisive = True
+                break
+    n_checked = len(is_matched[builds[0]]) if len(builds)>0 else 0
+    match_count = {i:int(is_matched[i].sum()) for i in builds}
+    
+    if verbose:log.write(" -Checked {} of {} variants...".format(n_checked, len(sumstats)))
+    for i in builds:
+        if verbose:log.write(" -Matching variants for hg{}: num_hg{} = ".format(i,i),match_count[i])        
+    
+    if not is_decisive:
+        if verbose:log.write(" -Warning: please be cautious due to the limited number of variants.") 
+    
+    ranked = sorted(builds, key=lambda i:match_count[i], reverse=True)
+    if len(ranked)>0 and (len(ranked)==1 or match_count[ranked[0]] > match_count[ranked[1]]) and match_count[ranked[0]]>0:
+        inferred_build = ranked[0]
+        if verbose:log.write(" -Since num_hg{} is the largest, assigning genome build hg{}...".format(inferred_build,inferred_build)) 
+        sumstats.loc[:,status] = vchange_status(sumstats.loc[:,status],1,"9",status_digits[inferred_build][0])
+        sumstats.loc[:,status] = vchange_status(sumstats.loc[:,status],2,"9",status_digits[inferred_build][1])
+    else:
+        if verbose:log.write(" -Since the numbers of matching variants are equal, unable to infer...") 
+    gc.collect()
+    if verbose:log.write("Finished inferring genome build version using hapmap3 SNPs...") 
+    return sumstats, inferred_build
 
 def sampling(sumstats,n=1, p=None, verbose=True,log=Log(),**args):
     if verbose:log.write("Start to randomly select variants from the sumstats...") 
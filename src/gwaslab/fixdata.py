@@ -9,10 +9,19 @@ from functools import partial
 from gwaslab.vchangestatus import vchange_status
 from gwaslab.vchangestatus import status_match
 from gwaslab.vchangestatus import change_status
+from gwaslab.vchangestatus import match_digit
+from gwaslab.vchangestatus import get_digit
+from gwaslab.vchangestatus import status_to_int
+from gwaslab.vchangestatus import STATUS_DTYPE
 from gwaslab.Log import Log
+from gwaslab.chainliftover import get_chain_path
+from gwaslab.chainliftover import load_chain
+from gwaslab.chainliftover import liftover_chain
 from gwaslab.CommonData import get_chr_to_number
 from gwaslab.CommonData import get_number_to_chr
 from gwaslab.CommonData import get_chr_list
+from gwaslab.variantkey import build_snpid
+from gwaslab.variantkey import duplicated_variants
 from gwaslab.datatype_check import check_datatype
 #fixID
 #rsidtochrpos
@@ -21,7 +30,6 @@ from gwaslab.datatype_check import check_datatype
 #fixpos
 #fixallele
 #normalizeallele
-#normalizevariant
 #checkref
 #sanitycheckstats
 #flipallelestats
@@ -222,37 +230,29 @@ def fixID(sumstats,
             
             if overwrite is False:
                 #fix empty 
-                to_fix = sumstats[snpid].isna() & sumstats[status].str.match( r"\w\w\w[0]\w\w\w", case=False, flags=0, na=False ) 
-                #status_match(sumstats[status],4,0)
-                #
+                to_fix = sumstats[snpid].isna() & match_digit(sumstats[status],4,[0])
             else:
                 #fix all
-                to_fix = sumstats[status].str.match( r"\w\w\w[0]\w\w\w", case=False, flags=0, na=False ) 
-                # status_match(sumstats[status],4,0)
-                #
+                to_fix = match_digit(sumstats[status],4,[0])
             
             if (ea in sumstats.columns) and (nea in sumstats.columns):
             # when ea and nea is available  -> check status -> fix to chr:pos:nea:ea 
                 
-                pattern = r"\w\w\w[0]\w\w\w"  
-                matched_index = sumstats[status].str.match(pattern)
-                #matched_index = status_match(sumstats[status],4,0) #
+                # xxx0xxx
+                matched_index = match_digit(sumstats[status],4,[0])
                 to_part_fix = matched_index & to_fix 
                 
-                #pattern = r"\w\w\w[0][01267][01234]\w"  
-                pattern = r"\w\w\w\w[0123][01267][01234]"
-                matched_index = sumstats[status].str.match(pattern)
-                #status_match(sumstats[status],5,[0,1,2,3]) | status_match(sumstats[status],6,[0,1,2,6,7])| status_match(sumstats[status],7,[0,1,2,3,4])
-                #
+                # xxxx[0123][01267][01234]
+                matched_index = match_digit(sumstats[status],5,[0,1,2,3]) & match_digit(sumstats[status],6,[0,1,2,6,7]) & match_digit(sumstats[status],7,[0,1,2,3,4])
                 if forcefixid is True:
                     matched_index = to_fix
                 to_full_fix = matched_index & to_fix 
                 
                 
                 if sum(to_part_fix)>0:
-                    sumstats.loc[to_part_fix,snpid] = sumstats.loc[to_part_fix,chrom].astype("string") + ":"+sumstats.loc[to_part_fix,pos].astype("string")
+                    sumstats.loc[to_part_fix,snpid] = build_snpid(sumstats.loc[to_part_fix,chrom], sumstats.loc[to_part_fix,pos])
                 if sum(to_full_fix)>0:
-                    sumstats.loc[to_full_fix,snpid] = sumstats.loc[to_full_fix,chrom].astype("string") + ":"+sumstats.loc[to_full_fix,pos].astype("string") +":"+ sumstats.loc[to_full_fix,nea].astype("string") +":"+ sumstats.loc[to_full_fix,ea].astype("string")
+                    sumstats.loc[to_full_fix,snpid] = build_snpid(sumstats.loc[to_full_fix,chrom], sumstats.loc[to_full_fix,pos], sumstats.loc[to_full_fix,nea], sumstats.loc[to_full_fix,ea])
                 if verbose: log.write(" -Filling "+str(sum(to_part_fix)-sum(to_full_fix)) +" SNPID using CHR:POS...")
                 if verbose: log.write(" -Filling "+str(sum(to_full_fix)) +" SNPID using CHR:POS:NEA:EA...")
                 sumstats.loc[(to_full_fix),status] = vchange_status(sumstats.loc[(to_full_fix),status],3,"975","630") 
@@ -263,7 +263,7 @@ def fixID(sumstats,
                 to_part_fix = to_fix & sumstats[chrom].notnull() & sumstats[pos].notnull()
                 if verbose: log.write(" -Filling "+str(sum(to_part_fix)) +" SNPID using CHR POS...")
                 if sum(to_part_fix)>0:
-                    sumstats.loc[to_part_fix,snpid] = sumstats.loc[to_part_fix,chrom].astype("string") + ":"+sumstats.loc[to_part_fix,pos].astype("string")
+                    sumstats.loc[to_part_fix,snpid] = build_snpid(sumstats.loc[to_part_fix,chrom], sumstats.loc[to_part_fix,pos])
                     sumstats.loc[to_part_fix,status] = vchange_status(sumstats.loc[(to_part_fix),status],3,"975","842")
                     
             after_number=sum(sumstats[snpid].isna())
@@ -283,6 +283,7 @@ def removedup(sumstats,mode="dm",chrom="CHR",pos="POS",snpid="SNPID",ea="EA",nea
     remove duplicate SNPs based on 2. CHR, POS, EA, and NEA
     remove duplicate SNPs based on 3. rsID
     remove multiallelic SNPs based on 4. CHR, POS
+    (2 and 4 are checked on packed integer variant keys)
     '''
     
     # sort the variants using the specified column before removing
@@ -323,7 +324,7 @@ def removedup(sumstats,mode="dm",chrom="CHR",pos="POS",snpid="SNPID",ea="EA",nea
         pre_number =len(sumstats)   
         if snpid in sumstats.columns:
             # keep na and remove duplicated
-            sumstats = sumstats.loc[(~sumstats[[chrom,pos,ea,nea]].all(axis=1)) | (~sumstats.duplicated(subset=[chrom,pos,ea,nea], keep=keep)),:]
+            sumstats = sumstats.loc[~duplicated_variants(sumstats, chrom=chrom, pos=pos, ea=ea, nea=nea, keep=keep),:]
             after_number=len(sumstats)   
             if verbose:  log.write(" -Removed ",pre_number -after_number ," based on CHR,POS,EA and NEA...") 
     
@@ -333,7 +334,7 @@ def removedup(sumstats,mode="dm",chrom="CHR",pos="POS",snpid="SNPID",ea="EA",nea
         pre_number =len(sumstats) 
         if verbose: log.write("Start to remove multiallelic variants based on chr:pos...")    
         if verbose: log.write(" -Which variant to keep: ",  keep ) 
-        sumstats = sumstats.loc[(~sumstats.loc[:,[chrom,pos]].all(axis=1)) | (~sumstats.duplicated(subset=[chrom,pos], keep=keep)),:]
+        sumstats = sumstats.loc[~duplicated_variants(sumstats, chrom=chrom, pos=pos, ea=None, nea=None, keep=keep),:]
         after_number=len(sumstats)  
         if verbose:  log.write(" -Removed ",pre_number -after_number," multiallelic variants...")   
     after_number=len(sumstats)   
@@ -534,9 +535,7 @@ def fixallele(sumstats,ea="EA", nea="NEA",status="STATUS",remove=False,verbose=T
         
         #if (ea not in sumstats.columns) or (nea not in sumstats.columns):
         if verbose: log.write(" -Converted all bases to string datatype and UPPERCASE.")
-        categories = set(sumstats.loc[:,ea].str.upper())|set(sumstats.loc[:,nea].str.upper())|set("N")
-        sumstats.loc[:,ea]=pd.Categorical(sumstats[ea].str.upper(),categories = categories) 
-        sumstats.loc[:,nea]=pd.Categorical(sumstats[nea].str.upper(),categories = categories) 
+        sumstats = set_allele_categories(sumstats, ea, nea, upper=True)
         all_var_num = len(sumstats)
         
         ## check ATCG
@@ -568,9 +567,7 @@ def fixallele(sumstats,ea="EA", nea="NEA",status="STATUS",remove=False,verbose=T
         else:
             sumstats.loc[:,[ea,nea]] = sumstats.loc[:,[ea,nea]].fillna("N")
             if verbose: log.write(" -Detected "+str(sum(exclude))+" variants with alleles that contain bases other than A/C/T/G .") 
-        categories = set(sumstats.loc[:,ea].str.upper())|set(sumstats.loc[:,nea].str.upper())|set("N")
-        sumstats.loc[:,ea]=pd.Categorical(sumstats[ea].str.upper(),categories = categories) 
-        sumstats.loc[:,nea]=pd.Categorical(sumstats[nea].str.upper(),categories = categories) 
+        sumstats = set_allele_categories(sumstats, ea, nea, upper=True)
         
         is_eanea_fixed = good_ea | good_nea
         is_snp = (sumstats[ea].str.len()==1) &(sumstats[nea].str.len()==1)
@@ -594,6 +591,43 @@ def fixallele(sumstats,ea="EA", nea="NEA",status="STATUS",remove=False,verbose=T
         if verbose: log.write("Finished fixing allele successfully!")
         return sumstats
 
+def get_allele_categories(*alleles):
+    '''
+    one category dictionary shared by EA and NEA : A/C/G/T/N + other observed alleles
+    categories of categorical inputs are reused instead of scanning the values
+    '''
+    categories = pd.Index(["A","C","G","T","N"])
+    for allele in alleles:
+        if isinstance(allele, pd.Series) and isinstance(allele.dtype, pd.CategoricalDtype):
+            observed = allele.cat.categories
+        else:
+            observed = pd.Index(pd.unique(pd.Series(allele, dtype="object").dropna()))
+        categories = categories.append(observed[~observed.isin(categories)])
+    return pd.CategoricalDtype(categories)
+
+def set_allele_categories(sumstats, ea="EA", nea="NEA", extra=None, upper=False):
+    '''
+    convert EA and NEA to the shared allele dictionary ; extra : alleles that will be assigned later
+    '''
+    if upper is True:
+        # uppercase the categories instead of every value, then remap the codes
+        alleles = {col:sumstats[col].astype("category") for col in [ea,nea]}
+        upper_categories = {col:pd.Index(allele.cat.categories.astype("str")).str.upper() for col, allele in alleles.items()}
+        dtype = get_allele_categories(*upper_categories.values())
+        for col, allele in alleles.items():
+            mapping = dtype.categories.get_indexer(upper_categories[col])
+            codes = allele.cat.codes.to_numpy()
+            codes = np.where(codes >= 0, mapping[codes], -1)
+            sumstats[col] = pd.Categorical.from_codes(codes, dtype=dtype)
+        return sumstats
+    if extra is None:
+        extra = []
+    dtype = get_allele_categories(sumstats[ea], sumstats[nea], *extra)
+    for col in [ea,nea]:
+        if sumstats[col].dtype != dtype:
+            sumstats[col] = sumstats[col].astype(dtype)
+    return sumstats
+
 ###############################################################################################################   
 # 20220721
 
@@ -604,28 +638,24 @@ def parallelnormalizeallele(sumstats,snpid="SNPID",rsid="rsID",pos="POS",nea="NE
     
     if verbose: log.write("Start to normalize variants...")
     if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))   
-    #variants_to_check = status_match(sumstats[status],5,[4,5]) #
     #r'\w\w\w\w[45]\w\w'
-    variants_to_check = sumstats[status].str[4].str.match(r'4|5', case=False, flags=0, na=False)
+    variants_to_check = match_digit(sumstats[status],5,[4,5])
     if sum(variants_to_check)==0:
         if verbose: log.write(" -No available variants to normalize..")
         if verbose: log.write("Finished normalizing variants successfully!")
         return sumstats
     ###############################################################################################################
-    if sum(variants_to_check)>0:
-        if sum(variants_to_check)<10000: 
-            n_cores=1  
-        pool = Pool(n_cores)
-        map_func = partial(normalizeallele,pos=pos,nea=nea,ea=ea,status=status)
-        df_split = np.array_split(sumstats.loc[variants_to_check,[pos,nea,ea,status]], n_cores)
-        normalized_pd = pd.concat(pool.map(map_func,df_split))
-        pool.close()
-        pool.join()
+    # vectorized normalization on allele arrays grouped by length (no process pool ; n_cores is kept for compatibility)
+    before_pos = pd.array(sumstats.loc[variants_to_check,pos], dtype="Int64")
+    before_nea = sumstats.loc[variants_to_check,nea].astype("object").to_numpy()
+    before_ea  = sumstats.loc[variants_to_check,ea].astype("object").to_numpy()
+    before_status = sumstats.loc[variants_to_check,status].to_numpy()
+    normalized_pos, normalized_nea, normalized_ea, normalized_status = normalizeallele(before_pos, before_nea, before_ea, before_status)
+    is_changed = (before_nea!=normalized_nea) | (before_ea!=normalized_ea)
     ###############################################################################################################
     
     if verbose:
-        before_normalize = sumstats.loc[variants_to_check,[ea,nea]]
-        changed_num = len(normalized_pd.loc[(before_normalize[ea]!=normalized_pd[ea]) | (before_normalize[nea]!=normalized_pd[nea]),:])
+        changed_num = int(is_changed.sum())
         if changed_num>0:
             if snpid in sumstats.columns:
                 before_normalize_id = sumstats.loc[variants_to_check,snpid]
@@ -633,81 +663,88 @@ def parallelnormalizeallele(sumstats,snpid="SNPID",rsid="rsID",pos="POS",nea="NE
                 before_normalize_id = sumstats.loc[variants_to_check,rsid]
             
             log.write(" -Not normalized allele IDs:",end="")
-            for i in before_normalize_id.loc[(before_normalize[ea]!=normalized_pd[ea]) | (before_normalize[nea]!=normalized_pd[nea])].head().values:
+            for i in before_normalize_id.loc[is_changed].head().values:
                 log.write(i,end=" ",show_time=False)
             log.write("... \n",end="",show_time=False) 
 
             log.write(" -Not normalized allele:",end="")
-            for i in before_normalize.loc[(before_normalize[ea]!=normalized_pd[ea]) | (before_normalize[nea]!=normalized_pd[nea]),[ea,nea]].head().values:
+            for i in np.stack([before_ea[is_changed][:5],before_nea[is_changed][:5]],axis=1):
                 log.write(i,end="",show_time=False)
             log.write("... \n",end="",show_time=False)     
             log.write(" -Modified "+str(changed_num) +" variants according to parsimony and left alignment principal.")
         else:
             log.write(" -All variants are already normalized..")
     ###################################################################################################################
-    categories = set(sumstats.loc[:,ea])|set(sumstats.loc[:,nea]) |set(normalized_pd.loc[:,ea]) |set(normalized_pd.loc[:,nea])
-    sumstats.loc[:,ea]  = pd.Categorical(sumstats.loc[:,ea],categories = categories) 
-    sumstats.loc[:,nea] = pd.Categorical(sumstats.loc[:,nea],categories = categories ) 
-    sumstats.loc[variants_to_check,[pos,nea,ea,status]] = normalized_pd.values
-    try:
-        sumstats.loc[:,pos] = sumstats.loc[:,pos].astype('Int64')
-    except:
-        sumstats.loc[:,pos] = np.floor(pd.to_numeric(sumstats.loc[:,pos], errors='coerce')).astype('Int64')
+    sumstats = set_allele_categories(sumstats, ea, nea, extra=[normalized_ea[is_changed], normalized_nea[is_changed]])
+    if not pd.api.types.is_integer_dtype(sumstats[pos].dtype):
+        try:
+            sumstats[pos] = sumstats[pos].astype('Int64')
+        except:
+            sumstats[pos] = np.floor(pd.to_numeric(sumstats[pos], errors='coerce')).astype('Int64')
+    # keep the current integer dtype of POS (int32 / Int32 after optimize_memory)
+    sumstats.loc[variants_to_check,pos] = pd.array(normalized_pos, dtype="Int64").astype(sumstats[pos].dtype)
+    sumstats.loc[variants_to_check,nea] = normalized_nea
+    sumstats.loc[variants_to_check,ea] = normalized_ea
+    sumstats.loc[variants_to_check,status] = normalized_status.astype(STATUS_DTYPE)
   
     if verbose: log.write("Finished normalizing variants successfully!")
     return sumstats
 
-def normalizeallele(sumstats,pos="POS" ,nea="NEA",ea="EA",status="STATUS"):
-    #single df
-    normalized = sumstats.apply(lambda x: normalizevariant(x[0],x[1],x[2],x[3]),axis=1)
-    sumstats = pd.DataFrame(normalized.to_list(), columns=[pos,nea,ea,status],index=sumstats.index)
-    return sumstats
+def _allele_matrix(alleles, length):
+    # fixed-length alleles -> uint8 matrix (n x length)
+    return np.array(alleles, dtype="S{}".format(length)).view(np.uint8).reshape(len(alleles), length)
 
-def normalizevariant(pos,a,b,status):
-    # single record
-    # https://genome.sph.umich.edu/wiki/Variant_Normalization
-    # a - ref - nea    starting -> pos
-    # b - alt - ea
-    # status xx1xx /xx2xx /xx9xx
+def normalizeallele(pos, a, b, status):
+    '''
+    vectorized parsimony and left alignment (https://genome.sph.umich.edu/wiki/Variant_Normalization)
+    a - ref - nea    starting -> pos
+    b - alt - ea
+    pos, a, b, status : numpy arrays ; return normalized pos, a, b, status
+    variants are grouped by (len(a), len(b)) and compared as byte matrices:
+     1. remove the common suffix (keep at least one base in both alleles)
+     2. if both alleles are still longer than one base, remove the common prefix and shift pos
+    '''
+    a = np.array(a, dtype="object")
+    b = np.array(b, dtype="object")
     
-    status_pre=status[:4]
-    status_end=status[5:]
+    len_a = pd.Series(a).str.len().to_numpy()
+    len_b = pd.Series(b).str.len().to_numpy()
+    is_multi = (len_a>1) & (len_b>1)
     
-    if len(a)==1 or len(b)==1:
-        #return pos,a,b,change_status(status,5,0) #status_pre+"0"+status_end
-        return pos,a,b,status_pre+"0"+status_end
-    pos_change=0
-    pointer_a_l, pointer_a_r = 0, len(a)-1
-    pointer_b_l, pointer_b_r = 0, len(b)-1
-
-    #remove from right
-    for i in range(max(len(a),len(b))):
-        if a[pointer_a_r] == b[pointer_b_r]:
-            pointer_a_r-=1
-            pointer_b_r-=1
-        else:
-            break
-        if pointer_a_r-pointer_a_l==0 or pointer_b_r-pointer_b_l==0:
-            if len(a)==1 or len(b)==1:
-                return pos,a[pointer_a_l:pointer_a_r+1],b[pointer_b_l:pointer_b_r+1],status_pre+"0"+status_end #change_status(status,5,0) #
-            return pos,a[pointer_a_l:pointer_a_r+1],b[pointer_b_l:pointer_b_r+1],status_pre+"3"+status_end #change_status(status,5,3) #
-
-    # remove from left
-    for i in range(max(len(a),len(b))):
-
-        if a[pointer_a_l] == b[pointer_b_l]:
-            pointer_a_l+=1
-            pointer_b_l+=1
-            pos_change+=1
-        else:
-            break
-        if pointer_a_r-pointer_a_l==0 or pointer_b_r-pointer_b_l==0:
-            break
-    if len(a)==1 or len(b)==1:
-        return pos+pos_change,a[pointer_a_l:pointer_a_r+1],b[pointer_b_l:pointer_b_r+1],status_pre+"0"+status_end #change_status(status,5,0) #
-    return pos+pos_change,a[pointer_a_l:pointer_a_r+1],b[pointer_b_l:pointer_b_r+1],status_pre+"3"+status_end # change_status(status,5,3) #
-""
-
+    # status xxxx[45]xx -> xxxx0xx (SNP or normalized indel) / xxxx3xx (both alleles longer than one base)
+    status = change_status(np.asarray(status), 5, np.where(is_multi,3,0))
+    
+    suffix = np.zeros(len(a),dtype="int64")
+    prefix = np.zeros(len(a),dtype="int64")
+    
+    length_pairs = pd.DataFrame({"a":len_a[is_multi],"b":len_b[is_multi]},index=np.flatnonzero(is_multi))
+    for (la, lb), group in length_pairs.groupby(["a","b"]):
+        index = group.index.to_numpy()
+        matrix_a = _allele_matrix(a[index], la)
+        matrix_b = _allele_matrix(b[index], lb)
+        max_trim = min(la, lb) - 1
+        
+        # common suffix, at most max_trim bases
+        same_right = matrix_a[:, la-max_trim:][:, ::-1] == matrix_b[:, lb-max_trim:][:, ::-1]
+        group_suffix = np.cumprod(same_right, axis=1).sum(axis=1)
+        
+        # common prefix on the right-trimmed alleles, at most max_trim - suffix bases
+        same_left = matrix_a[:, :max_trim] == matrix_b[:, :max_trim]
+        group_prefix = np.minimum(np.cumprod(same_left, axis=1).sum(axis=1), max_trim - group_suffix)
+        
+        suffix[index] = group_suffix
+        prefix[index] = group_prefix
+    
+    to_trim = (suffix>0) | (prefix>0)
+    if to_trim.sum()>0:
+        trims = pd.DataFrame({"a":a[to_trim], "b":b[to_trim], "la":len_a[to_trim], "lb":len_b[to_trim],
+                              "prefix":prefix[to_trim], "suffix":suffix[to_trim]}, index=np.flatnonzero(to_trim))
+        for (la, lb, p, s), group in trims.groupby(["la","lb","prefix","suffix"]):
+            index = group.index.to_numpy()
+            a[index] = group["a"].str.slice(p, la - s).to_numpy()
+            b[index] = group["b"].str.slice(p, lb - s).to_numpy()
+        pos = pos + prefix
+    return pos, a, b, status
 
 ###############################################################################################################
 # 20220426
@@ -943,9 +980,8 @@ def sanitycheckstats(sumstats,
     pre_number=len(sumstats)    
     if "STATUS" in coltocheck and "STATUS" in sumstats.columns:
         cols_to_check.append("STATUS")
-        if verbose: log.write(" -Checking STATUS and converting STATUS to categories....") 
-        categories = {str(j+i) for j in [1900000,3800000,9700000,9800000,9900000] for i in range(0,100000)}
-        sumstats.loc[:,"STATUS"] = pd.Categorical(sumstats["STATUS"],categories=categories)
+        if verbose: log.write(" -Checking STATUS and converting STATUS to integers....") 
+        sumstats["STATUS"] = status_to_int(sumstats["STATUS"])
     
     pre_number=len(sumstats)  
     sumstats = sumstats.dropna(subset=cols_to_check)
@@ -987,9 +1023,8 @@ def flipallelestats(sumstats,status="STATUS",verbose=True,log=Log()):
     if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))
     
     ###################get reverse complementary####################
-    pattern = r"\w\w\w\w\w[45]\w"  
-    #matched_index = status_match(sumstats[status],6,[4,5]) #
-    matched_index = sumstats[status].str[5].str.match(r"4|5")
+    # xxxxx[45]x
+    matched_index = match_digit(sumstats[status],6,[4,5])
     if sum(matched_index)>0:
         if verbose: log.write("Start to convert alleles to reverse complement for SNPs with status xxxxx[45]x... ") 
         if verbose: log.write(" -Flipping "+ str(sum(matched_index)) +" variants...") 
@@ -997,18 +1032,15 @@ def flipallelestats(sumstats,status="STATUS",verbose=True,log=Log()):
             if verbose: log.write(" -Converting to reverse complement : EA and NEA...") 
             reverse_complement_nea = sumstats.loc[matched_index,'NEA'].apply(lambda x :get_reverse_complementary_allele(x)) 
             reverse_complement_ea = sumstats.loc[matched_index,'EA'].apply(lambda x :get_reverse_complementary_allele(x)) 
-            categories = set(sumstats.loc[:,'EA'])|set(sumstats.loc[:,'NEA']) |set(reverse_complement_ea) |set(reverse_complement_nea)
-            sumstats.loc[:,'EA']=pd.Categorical(sumstats.loc[:,'EA'],categories = categories) 
-            sumstats.loc[:,'NEA']=pd.Categorical(sumstats.loc[:,'NEA'],categories = categories ) 
+            sumstats = set_allele_categories(sumstats, "EA", "NEA", extra=[reverse_complement_ea, reverse_complement_nea])
             sumstats.loc[matched_index,['NEA']] = reverse_complement_nea
             sumstats.loc[matched_index,['EA']] = reverse_complement_ea
             sumstats.loc[matched_index,status] = vchange_status(sumstats.loc[matched_index,status], 6, "4","2")
             if verbose: log.write(" -Changed the status for flipped variants : xxxxx4x -> xxxxx2x")
 
     ###################flip ref####################
-    pattern = r"\w\w\w\w\w[35]\w"  
-    #matched_index = status_match(sumstats[status],6,[3,5]) #sumstats[status].str.match(pattern)
-    matched_index = sumstats[status].str[5].str.match(r"3|5")
+    # xxxxx[35]x
+    matched_index = match_digit(sumstats[status],6,[3,5])
     if sum(matched_index)>0:
         if verbose: log.write("Start to flip allele-specific stats for SNPs with status xxxxx[35]x: alt->ea , ref->nea ... ") 
         if verbose: log.write(" -Flipping "+ str(sum(matched_index)) +" variants...") 
@@ -1053,9 +1085,8 @@ def flipallelestats(sumstats,status="STATUS",verbose=True,log=Log()):
         sumstats.loc[matched_index,status] = vchange_status(sumstats.loc[matched_index,status], 6, "35","12")
         
     ###################flip ref for undistingushable indels####################
-    pattern = r"\w\w\w\w[123][67]6"  
-    #matched_index = status_match(sumstats[status],6,[1,2,3])|status_match(sumstats[status],6,[6,7])|status_match(sumstats[status],7,6) #sumstats[status].str.match(pattern)
-    matched_index = sumstats[status].str[4:].str.match(r"[123][67]6")
+    # xxxx[123][67]6
+    matched_index = match_digit(sumstats[status],5,[1,2,3]) & match_digit(sumstats[status],6,[6,7]) & match_digit(sumstats[status],7,[6])
     if sum(matched_index)>0:
         if verbose: log.write("Start to flip allele-specific stats for standardized indels with status xxxx[123][67][6]: alt->ea , ref->nea ... ") 
         if verbose: log.write(" -Flipping "+ str(sum(matched_index)) +" variants...") 
@@ -1100,9 +1131,8 @@ def flipallelestats(sumstats,status="STATUS",verbose=True,log=Log()):
         sumstats.loc[matched_index,status] = vchange_status(sumstats.loc[matched_index,status], 7, "6","4")
          # flip ref
     ###################flip statistics for reverse strand panlindromic variants####################
-    pattern = r"\w\w\w\w\w[012]5"  
-    #matched_index = status_match(sumstats[status],6,[0,1,2]) | status_match(sumstats[status],7,[5])#sumstats[status].str.match(pattern)
-    matched_index = sumstats[status].str[5:].str.match(r"05|15|25")
+    # xxxxx[012]5
+    matched_index = match_digit(sumstats[status],6,[0,1,2]) & match_digit(sumstats[status],7,[5])
     if sum(matched_index)>0:
         if verbose: log.write("Start to flip allele-specific stats for palindromic SNPs with status xxxxx[12]5: (-)strand <=> (+)strand ... ") 
         if verbose: log.write(" -Flipping "+ str(sum(matched_index)) +" variants...") 
@@ -1150,18 +1180,18 @@ def flipallelestats(sumstats,status="STATUS",verbose=True,log=Log()):
 ###############################################################################################################
 # 20220426
 def liftover_snv(row,chrom,converter,to_build):
-    status_pre=""
-    status_end=row[1][2]+"9"+row[1][4]+"99"  
+    # xx[rsid]9[allele]99 : CHR/POS, alignment and strand need to be checked again 
+    status_end= get_digit(row[1],3)*10000 + 9000 + get_digit(row[1],5)*100 + 99
     pos_0_based = int(row[0]) - 1
     results = converter[chrom][pos_0_based]
     if converter[chrom][pos_0_based]:
         # return chrom, pos_1_based
         if results[0][0].strip("chr")!=chrom:
-            return pd.NA,pd.NA,"97"+status_end
+            return pd.NA,pd.NA,9700000+status_end
         else:
-            return results[0][0].strip("chr"),results[0][1]+1,to_build+status_end
+            return results[0][0].strip("chr"),results[0][1]+1,int(to_build)*100000+status_end
     else:
-        return pd.NA,pd.NA,"97"+status_end
+        return pd.NA,pd.NA,9700000+status_end
 
 def liftover_variant(sumstats, 
              chrom="CHR", 
@@ -1177,26 +1207,45 @@ def liftover_variant(sumstats,
         variants_on_chrom_to_convert = sumstats[chrom]==i
         lifted = sumstats.loc[variants_on_chrom_to_convert,[pos,status]].apply(lambda x: liftover_snv(x[[pos,status]],chrom_to_convert,converter,to_build),axis=1)
         sumstats.loc[variants_on_chrom_to_convert,pos]     =   lifted.str[1]
-        sumstats.loc[variants_on_chrom_to_convert,status]   =  lifted.str[2]
+        sumstats.loc[variants_on_chrom_to_convert,status]   =  lifted.str[2].astype(STATUS_DTYPE)
         sumstats.loc[variants_on_chrom_to_convert,chrom]    =  lifted.str[0].map(dic2).astype("Int64")
     return sumstats
 
-def parallelizeliftovervariant(sumstats,n_cores=1,chrom="CHR", pos="POS", from_build="19", to_build="38",status="STATUS",remove=True, verbose=True,log=Log()):
+def parallelizeliftovervariant(sumstats,n_cores=1,chrom="CHR", pos="POS", from_build="19", to_build="38",status="STATUS",remove=True, engine="chain", chain_path=None, verbose=True,log=Log()):
+    '''
+    engine : "chain" (default, vectorized mapping with the UCSC chain file) or "liftover" (per-variant lookup with the liftover package)
+    '''
     if check_col(sumstats,chrom,pos,status) is not True:
         if verbose: log.write("WARNING:.liftover(): specified columns not detected..skipping...")
         return sumstats
     if verbose: log.write("Start to perform liftover...")
     if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))   
-    if verbose: log.write(" -CPU Cores to use :",n_cores)
+    if engine=="liftover":
+        if verbose: log.write(" -CPU Cores to use :",n_cores)
     if verbose: log.write(" -Performing liftover ...")
     if verbose: log.write(" -Creating converter : hg" + from_build +" to hg"+ to_build)
     # valid chr and pos
-    pattern = r"\w\w\w0\w\w\w"  
-    to_lift = sumstats[status].str.match(pattern)
+    # xxx0xxx
+    to_lift = match_digit(sumstats[status],4,[0])
     sumstats = sumstats.loc[to_lift,:].copy()
     if verbose: log.write(" -Converting variants with status code xxx0xxx :"+str(len(sumstats))+"...")
     ###########################################################################
-    if sum(to_lift)>0:
+    if sum(to_lift)>0 and engine=="chain":
+        chain_index = load_chain(get_chain_path(from_build, to_build, chain_path=chain_path, verbose=verbose, log=log), verbose=verbose, log=log)
+        lifted_chr, lifted_pos, lifted_strand, is_cross_chr = liftover_chain(sumstats[chrom], sumstats[pos], chain_index)
+        is_mapped = lifted_strand != 0
+        
+        # xx[rsid]9[allele]99 : CHR/POS, alignment and strand need to be checked again ; 97 : unmapped
+        status_end = get_digit(sumstats[status],3)*10000 + 9000 + get_digit(sumstats[status],5)*100 + 99
+        sumstats[status] = np.where(is_mapped, int(to_build)*100000, 9700000) + status_end
+        sumstats[status] = sumstats[status].astype(STATUS_DTYPE)
+        sumstats[pos] = pd.array(np.where(is_mapped, lifted_pos, np.nan), dtype="Int64")
+        sumstats[chrom] = pd.array(np.where(is_mapped, lifted_chr, np.nan), dtype="Int64")
+        if verbose: 
+            log.write(" -Mapped variants: {} ({:.2f}%)".format(int(is_mapped.sum()), 100*is_mapped.sum()/len(sumstats)))
+            log.write(" -Mapped to the reverse strand of the target build: {}".format(int((lifted_strand==-1).sum())))
+            log.write(" -Mapped to a different chromosome (treated as unmapped): {}".format(int(is_cross_chr.sum())))
+    elif sum(to_lift)>0:
         if sum(to_lift)<10000:
             n_cores=1
     
@@ -1205,6 +1254,7 @@ def parallelizeliftovervariant(sumstats,n_cores=1,chrom="CHR", pos="POS", from_b
         #df = pd.concat(pool.starmap(func, df_split))
         func=liftover_variant
         sumstats.loc[:,[chrom,pos,status]] = pd.concat(pool.map(partial(func,chrom=chrom,pos=pos,from_build=from_build,to_build=to_build,status=status),df_split))
+        sumstats[status] = sumstats[status].astype(STATUS_DTYPE)
         pool.close()
         pool.join()
     ############################################################################
@@ -1233,7 +1283,7 @@ def sortcoordinate(sumstats,chrom="CHR",pos="POS",reindex=True,verbose=True,log=
     if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))   
     
     try:
-        if sumstats[pos].dtype == "Int64":
+        if pd.api.types.is_integer_dtype(sumstats[pos]):
             pass
         else:
             if verbose: log.write(" -Force converting POS to Int64...")
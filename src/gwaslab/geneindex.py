@@ -0,0 +1,157 @@
+import os
+import numpy as np
+import pandas as pd
+from gwaslab.Log import Log
+from gwaslab.CommonData import get_chr_to_number
+from gwaslab.CommonData import get_NC_to_number
+from gwaslab.CommonData import gtf_to_protein_coding
+from gwaslab.download import check_and_download
+from gwaslab.variantkey import chrpos_key
+from gwaslab.variantkey import POS_BITS
+import gc
+
+# in-memory gene interval index for nearest gene annotation
+# genes (1-based, inclusive) are split into elementary segments : within a segment the set of overlapping genes is constant
+# only segments overlapping at least one gene are kept :
+#   START / END : CHR:POS keys (chrpos_key) of the first and last base of the segment
+#   GENE        : distinct gene names overlapping the segment, sorted and joined by ","
+# a variant is then annotated with one np.searchsorted :
+#   in a segment                   -> 0 , genes of the segment
+#   between segments (same CHR)    -> - distance to the end of the upstream gene / + distance to the start of the downstream gene
+#                                     (the closer one ; upstream if equal) , genes at that position
+# the index is saved next to the GTF file ({gtf}.gene_index.tsv.gz) and cached in memory
+
+_GENE_INDEX = {}
+
+GTF_NAMES = {("ensembl","19"):("ensembl_hg19_gtf", "ensembl_hg19_gtf"),
+             ("ensembl","38"):("ensembl_hg38_gtf", "ensembl_hg38_gtf"),
+             ("refseq","19"):("refseq_hg19_gtf", "NCBI refseq latest GRCh37"),
+             ("refseq","38"):("refseq_hg38_gtf", "NCBI refseq latest GRCh38")}
+
+def _get_index_path(gtf_path):
+    return gtf_path[:-7] + ".gene_index.tsv.gz" if gtf_path.endswith(".gtf.gz") else gtf_path + ".gene_index.tsv.gz"
+
+def _read_genes(gtf_path, source="ensembl", build="19"):
+    '''
+    gene records of a GTF file -> CHR (gwaslab chromosome number), START, END, GENE
+    for refseq, gene names are stored as gene_id
+    '''
+    from gtfparse import read_gtf
+    name_col = "gene_name" if source=="ensembl" else "gene_id"
+    gtf = read_gtf(gtf_path, usecols=["seqname","start","end","feature",name_col], features={"gene"})
+    gtf = pd.DataFrame(gtf)
+    gtf = gtf.loc[gtf["feature"]=="gene",:]
+    if source=="refseq":
+        chr_dict = get_NC_to_number(build=build)
+    else:
+        chr_dict = get_chr_to_number()
+    genes = pd.DataFrame({"CHR":gtf["seqname"].astype("string").str.replace("^chr","",regex=True).map(chr_dict),
+                          "START":pd.to_numeric(gtf["start"], errors="coerce"),
+                          "END":pd.to_numeric(gtf["end"], errors="coerce"),
+                          "GENE":gtf[name_col].astype("string")})
+    genes = genes.dropna()
+    return genes.astype({"CHR":"int64","START":"int64","END":"int64"})
+
+def build_gene_index(genes):
+    '''
+    genes (CHR, START, END, GENE ; 1-based inclusive) -> segment table (START, END, GENE) sorted by START
+    '''
+    segments = []
+    for chrom, group in genes.groupby("CHR", sort=True):
+        starts = group["START"].values
+        ends = group["END"].values + 1
+        boundaries = np.unique(np.concatenate([starts, ends]))
+        first = np.searchsorted(boundaries, starts)
+        last = np.searchsorted(boundaries, ends)
+        # one row per (segment, gene)
+        n_segments = last - first
+        offsets = np.arange(n_segments.sum()) - np.repeat(np.cumsum(n_segments) - n_segments, n_segments)
+        segment = np.repeat(first, n_segments) + offsets
+        pairs = pd.DataFrame({"SEGMENT":segment, "GENE":np.repeat(group["GENE"].values, n_segments)})
+        pairs = pairs.drop_duplicates().sort_values(["SEGMENT","GENE"], kind="mergesort")
+        names = pairs.groupby("SEGMENT", sort=True)["GENE"].agg(",".join)
+        segments.append(pd.DataFrame({"CHR":chrom,
+                                      "START":boundaries[names.index.values],
+                                      "END":boundaries[names.index.values + 1] - 1,
+                                      "GENE":names.str.strip(",").values}))
+    if len(segments)==0:
+        return pd.DataFrame(columns=["CHR","START","END","GENE"])
+    return pd.concat(segments, ignore_index=True)
+
+def load_gene_index(gtf_path, source="ensembl", build="19", verbose=True, log=Log()):
+    '''
+    segment arrays of a GTF file : from memory, from {gtf}.gene_index.tsv.gz or built from the GTF
+    '''
+    if gtf_path in _GENE_INDEX:
+        return _GENE_INDEX[gtf_path]
+    index_path = _get_index_path(gtf_path)
+    if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(gtf_path):
+        if verbose: log.write(" -Loading gene index: {}".format(index_path))
+        segments = pd.read_csv(index_path, sep="\t", dtype={"CHR":"int64","START":"int64","END":"int64","GENE":"string"})
+    else:
+        if verbose: log.write(" -Building gene index from: {}".format(gtf_path))
+        genes = _read_genes(gtf_path, source=source, build=build)
+        segments = build_gene_index(genes)
+        if verbose: log.write(" -Indexed {} genes in {} segments...".format(len(genes), len(segments)))
+        try:
+            segments.to_csv(index_path, sep="\t", index=None)
+            if verbose: log.write(" -Gene index is saved to : {}".format(index_path))
+        except OSError:
+            if verbose: log.write(" -Gene index can not be saved to : {}".format(index_path))
+        del genes
+    start = chrpos_key(segments["CHR"], segments["START"])
+    end = chrpos_key(segments["CHR"], segments["END"])
+    # segments that can not be encoded as CHR:POS keys are dropped to keep the keys sorted
+    is_valid = (start >= 0) & (end >= 0)
+    gene_index = {"start":start[is_valid],
+                  "end":end[is_valid],
+                  "gene":segments["GENE"].to_numpy(dtype="object")[is_valid]}
+    _GENE_INDEX[gtf_path] = gene_index
+    gc.collect()
+    return gene_index
+
+def get_gene_index(build="19", source="ensembl", verbose=True, log=Log()):
+    '''
+    gene index of the protein coding genes in the reference GTF of source (ensembl / refseq) and build (19 / 38)
+    '''
+    name, description = GTF_NAMES[(source, build)]
+    if verbose:log.write(" -Assigning Gene name using {} for protein coding genes".format(description))
+    gtf_path = check_and_download(name)
+    gtf_path = gtf_to_protein_coding(gtf_path,log=log,verbose=verbose)
+    return load_gene_index(gtf_path, source=source, build=build, verbose=verbose, log=log)
+
+def closest_genes(chrom, pos, gene_index, max_distance=1000000):
+    '''
+    nearest gene(s) of each variant
+    return LOCATION (0 : in gene(s) ; <0 : gene upstream ; >0 : gene downstream) and GENE
+    variants without a gene within max_distance on the same chromosome : max_distance , "intergenic"
+    '''
+    key = chrpos_key(chrom, pos)
+    starts, ends, names = gene_index["start"], gene_index["end"], gene_index["gene"]
+    location = np.full(len(key), max_distance, dtype="int64")
+    gene = np.full(len(key), "intergenic", dtype="object")
+    if len(starts)==0:
+        return location, gene
+    key_chr = key >> POS_BITS
+
+    # last segment starting at or before the variant
+    i = np.searchsorted(starts, key, side="right") - 1
+    i_clipped = np.clip(i, 0, len(starts)-1)
+    j_clipped = np.clip(i + 1, 0, len(starts)-1)
+    is_valid = key >= 0
+    is_in = is_valid & (i >= 0) & (key <= ends[i_clipped])
+    has_up = is_valid & ~is_in & (i >= 0) & ((ends[i_clipped] >> POS_BITS) == key_chr)
+    has_down = is_valid & ~is_in & (i + 1 < len(starts)) & ((starts[j_clipped] >> POS_BITS) == key_chr)
+    distance_up = key - ends[i_clipped]
+    distance_down = starts[j_clipped] - key
+
+    use_up = has_up & (~has_down | (distance_up <= distance_down)) & (distance_up <= max_distance)
+    use_down = has_down & ~use_up & (distance_down <= max_distance)
+
+    location[is_in] = 0
+    gene[is_in] = names[i_clipped[is_in]]
+    location[use_up] = -distance_up[use_up]
+    gene[use_up] = names[i_clipped[use_up]]
+    location[use_down] = distance_down[use_down]
+    gene[use_down] = names[j_clipped[use_down]]
+    return location, gene
@@ -1,6 +1,11 @@
+import os
+import numpy as np
 import pandas as pd
 from os import path
 from gwaslab.Log import Log
+from gwaslab.CommonData import get_chr_to_number
+from gwaslab.variantkey import chrpos_key
+from gwaslab.variantkey import unpack_chrpos
 #A unique identifier (e.g., the rs number)
 #Allele 1 (effect allele)
 #Allele 2 (non-effect allele)
@@ -8,6 +13,72 @@ from gwaslab.Log import Log
 #A P-value
 #A signed summary statistic (beta, OR, log odds, Z-score, etc)
 
+HAPMAP3_DIR = path.join(path.dirname(__file__), "data", "hapmap3_SNPs")
+HAPMAP3_SNPLIST = {"19":"hapmap3_db150_hg19.snplist.gz",
+                   "38":"hapmap3_db151_hg38.snplist.gz"}
+# packed HapMap3 positions : sorted unique int64 CHR:POS keys (variantkey.chrpos_key) per build
+# saved in the gwaslab cache directory ({default directory}/cache) by build_hapmap3_positions :
+#   hg19 / hg38 : built from the shipped snplist at first use
+#   hg18        : lifted from hg19 with the hg19ToHg18 chain file (downloaded) ; only built by an explicit build_hapmap3_positions("18")
+HAPMAP3_POSITIONS = "hapmap3_hg{}.chrpos.npy"
+
+def _get_hapmap3_cache_dir():
+    from gwaslab.download import get_default_directory
+    return path.join(get_default_directory(), "cache")
+
+_HAPMAP3_POSITIONS = {}
+
+def build_hapmap3_positions(build="19", out_dir=None, verbose=True, log=Log()):
+    '''
+    convert the HapMap3 snplist of a build (19 / 38 ; 18 lifted from 19) into a sorted array of packed CHR:POS keys
+    and save it as hapmap3_hg{build}.chrpos.npy in out_dir (default: the gwaslab cache directory)
+    '''
+    if build in HAPMAP3_SNPLIST:
+        if verbose:log.write(" -Loading Hapmap3 variants data (hg{})...".format(build))
+        hapmap3_ref = pd.read_csv(path.join(HAPMAP3_DIR, HAPMAP3_SNPLIST[build]),sep="\s+",usecols=["#CHROM","POS"],dtype={"#CHROM":"string","POS":"string"})
+        key = chrpos_key(hapmap3_ref["#CHROM"].map(get_chr_to_number()), hapmap3_ref["POS"])
+    elif build=="18":
+        from gwaslab.chainliftover import get_chain_path
+        from gwaslab.chainliftover import load_chain
+        from gwaslab.chainliftover import liftover_chain
+        if verbose:log.write(" -Lifting Hapmap3 variants from hg19 to hg18...")
+        chrom, pos = unpack_chrpos(get_hapmap3_positions("19", verbose=verbose, log=log))
+        chain_index = load_chain(get_chain_path("19", "18", verbose=verbose, log=log), verbose=verbose, log=log)
+        lifted_chr, lifted_pos, strand, is_cross_chr = liftover_chain(chrom, pos, chain_index)
+        key = chrpos_key(lifted_chr, lifted_pos)
+    else:
+        raise ValueError("HapMap3 positions are available for hg18, hg19 and hg38 only.")
+    key = np.unique(key[key!=-1])
+
+    if out_dir is None:
+        out_dir = _get_hapmap3_cache_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = path.join(out_dir, HAPMAP3_POSITIONS.format(build))
+    np.save(out_path, key)
+    if verbose:log.write(" -Saved {} packed Hapmap3 positions to {}".format(len(key), out_path))
+    return key
+
+def get_hapmap3_positions(build="19", verbose=True, log=Log()):
+    '''
+    sorted packed CHR:POS keys of HapMap3 variants ; loaded once per session from the gwaslab cache directory
+    hg19 / hg38 are built from the shipped snplist if the packed file is not available ; hg18 has to be built with build_hapmap3_positions("18")
+    '''
+    if build in _HAPMAP3_POSITIONS:
+        return _HAPMAP3_POSITIONS[build]
+    packed_path = path.join(_get_hapmap3_cache_dir(), HAPMAP3_POSITIONS.format(build))
+    if path.isfile(packed_path):
+        _HAPMAP3_POSITIONS[build] = np.load(packed_path)
+    elif build in HAPMAP3_SNPLIST:
+        _HAPMAP3_POSITIONS[build] = build_hapmap3_positions(build, verbose=verbose, log=log)
+    else:
+        raise ValueError("Packed HapMap3 positions for hg{} are not available. Please run gl.build_hapmap3_positions(\"{}\") first.".format(build, build))
+    return _HAPMAP3_POSITIONS[build]
+
+def is_hapmap3_positions_available(build):
+    if build in _HAPMAP3_POSITIONS or build in HAPMAP3_SNPLIST:
+        return True
+    return path.isfile(path.join(_get_hapmap3_cache_dir(), HAPMAP3_POSITIONS.format(build)))
+
 def gethapmap3(sumstats,rsid="rsID",chrom="CHR", pos="POS", ea="EA", nea="NEA",build="19", verbose=True,log=Log()):
     if verbose:log.write(" -Processing "+str(len(sumstats))+" raw variants...")
 
@@ -26,11 +97,15 @@ def gethapmap3(sumstats,rsid="rsID",chrom="CHR", pos="POS", ea="EA", nea="NEA",b
         return output
     elif chrom in sumstats.columns and pos in sumstats.columns:
         if verbose: log.write(" -Since rsID not in sumstats, chr:pos( build "+build+") will be used for matching...")
-        sumstats   ["chr:pos"] = sumstats[chrom].astype("string")+":"+sumstats[pos].astype("string")
-        hapmap3_ref["chr:pos"] = hapmap3_ref["#CHROM"]+":"+hapmap3_ref["POS"]
+        # integer CHR:POS keys instead of "chr:pos" strings
+        sumstats_key = chrpos_key(sumstats[chrom], sumstats[pos])
+        hapmap3_key = chrpos_key(hapmap3_ref["#CHROM"].map(get_chr_to_number()), hapmap3_ref["POS"])
         hapmap3_ref = hapmap3_ref.rename(columns={"rsid":"rsID"})
-        output = pd.merge(sumstats,hapmap3_ref.loc[:,["chr:pos","rsID"]],left_on="chr:pos",right_on="chr:pos",how="inner",suffixes=('', '_hapmap3')).copy()
-        output = output.drop(columns="chr:pos")
+        hapmap3_ref["_KEY"] = hapmap3_key
+        sumstats = sumstats.copy()
+        sumstats["_KEY"] = sumstats_key
+        output = pd.merge(sumstats.loc[sumstats_key!=-1,:],hapmap3_ref.loc[hapmap3_key!=-1,["_KEY","rsID"]],on="_KEY",how="inner",suffixes=('', '_hapmap3')).copy()
+        output = output.drop(columns="_KEY")
         if verbose: log.write(" -Raw input contains "+str(len(output))+" hapmaps variants based on chr:pos...")
         return output
     else:
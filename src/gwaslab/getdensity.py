@@ -2,69 +2,65 @@
 import pandas as pd
 import numpy as np
 from gwaslab.Log import Log
+from gwaslab.variantkey import chrpos_key
 import gc
 
+# signal density : number of (other) variants within +/- windowsizekb on the same chromosome
+# variants are encoded as CHR:POS keys (chrpos_key) and sorted once ;
+# the number of keys in [key - w, key + w] is then given by two np.searchsorted for all variants
+
+def count_in_window(sorted_keys, keys, window):
+    '''
+    number of sorted_keys in [key - window, key + window] for each key (keys from chrpos_key : same chromosome only)
+    '''
+    left = np.searchsorted(sorted_keys, keys - window, side="left")
+    right = np.searchsorted(sorted_keys, keys + window, side="right")
+    return right - left
+
+def _window_list(bwindowsizekb):
+    if isinstance(bwindowsizekb, (list, tuple)):
+        return list(bwindowsizekb)
+    return [bwindowsizekb]
+
+def _density_columns(bwindowsizekb):
+    # one window : DENSITY ; several windows : DENSITY_{windowsizekb}KB
+    if isinstance(bwindowsizekb, (list, tuple)):
+        return ["DENSITY_{}KB".format(window) for window in bwindowsizekb]
+    return ["DENSITY"]
+
 def getsignaldensity(insumstats, id="SNPID", chrom="CHR",pos="POS", bwindowsizekb=100,log=Log(),verbose=True):    
+    '''
+    number of other variants within +/- bwindowsizekb of each variant
+    bwindowsizekb : a window size (return a Series DENSITY) or a list of window sizes (return a DataFrame DENSITY_{windowsizekb}KB)
+    '''
     if verbose:log.write("Start to calculate signal DENSITY...")
     sumstats = insumstats.loc[:,[id,chrom,pos]].copy()
-    if verbose:log.write(" -Calculating DENSITY with windowsize of ",bwindowsizekb ," kb")
-    #stack=[]
-
-    large_number = 1000000000
-    for i in range(7):
-        if insumstats[pos].max()*10 >  large_number:
-            large_number = int(large_number * 10)
-        else:
-            break
 
-    sumstats["TCHR+POS"] = sumstats[chrom]*large_number +  sumstats[pos]
+    sumstats["TCHR+POS"] = chrpos_key(sumstats[chrom], sumstats[pos])
     sumstats = sumstats.sort_values(by=["TCHR+POS"])
     positions = sumstats["TCHR+POS"].values
-    #sumstats = sumstats.reset_index()
-    density = np.zeros(len(sumstats))
-
-    last_left_pos = 0
-    for current_pos, position in enumerate(positions):
-        for current_left_pos in range(last_left_pos,current_pos):
-            if  positions[current_left_pos] >= position-1000 * bwindowsizekb:
-                
-                # from p_left to p_current -1, plus 1 density (update the rightside numbers)
-                density[current_left_pos:current_pos]+=1
-                
-                # for p_current, plus p_current - p_left (update the leftside numbers)
-                density[current_pos]+= current_pos - current_left_pos
-                
-                # update left pointer
-                last_left_pos = current_left_pos
-                break
-        
-        #stack.append([row[id],row["TCHR+POS"],0])  
-        #for i in range(2,len(stack)+1):
-        ## closest signals in range	
-        #    if stack[-i][1]>= (row["TCHR+POS"]- 1000*bwindowsizekb):
-        #        #add 1 to both point
-        #        stack[-i][2]+=1
-        #        stack[-1][2]+=1
-        #    else:
-        #    	# closest signals still out out range
-        #        break
     
-    sumstats["DENSITY"] = density
-    sumstats["DENSITY"]  = sumstats["DENSITY"].astype("Int32")
-    # mean and median
-    bmean = sumstats["DENSITY"].mean()
-    bmedian = sumstats["DENSITY"].median()
-    bsd = sumstats["DENSITY"].std()
-    bmax = sumstats["DENSITY"].max()
-    bmaxid = sumstats["DENSITY"].idxmax()
+    for window, col in zip(_window_list(bwindowsizekb), _density_columns(bwindowsizekb)):
+        if verbose:log.write(" -Calculating DENSITY with windowsize of ",window ," kb")
+        # excluding the variant itself
+        sumstats[col] = count_in_window(positions, positions, 1000 * window) - 1
+        sumstats[col] = sumstats[col].astype("Int32")
+        # mean and median
+        bmean = sumstats[col].mean()
+        bmedian = sumstats[col].median()
+        bsd = sumstats[col].std()
+        bmax = sumstats[col].max()
+        bmaxid = sumstats[col].idxmax()
 
-    if verbose:log.write(" -Mean : {} signals per {} kb".format(bmean,bwindowsizekb))
-    if verbose:log.write(" -SD : {}".format(bsd))
-    if verbose:log.write(" -Median : {} signals per {} kb".format(bmedian,bwindowsizekb))
-    if verbose:log.write(" -Max : {} signals per {} kb at variant(s) {}".format(bmax,bwindowsizekb,sumstats.loc[bmaxid,id]))
+        if verbose:log.write(" -Mean : {} signals per {} kb".format(bmean,window))
+        if verbose:log.write(" -SD : {}".format(bsd))
+        if verbose:log.write(" -Median : {} signals per {} kb".format(bmedian,window))
+        if verbose:log.write(" -Max : {} signals per {} kb at variant(s) {}".format(bmax,window,sumstats.loc[bmaxid,id]))
     
     sumstats = sumstats.drop("TCHR+POS",axis=1)
     if verbose:log.write("Finished calculating signal DENSITY successfully!")
+    if isinstance(bwindowsizekb, (list, tuple)):
+        return sumstats[_density_columns(bwindowsizekb)]
     return sumstats["DENSITY"]
 
 def assigndensity(insumstats,
@@ -74,25 +70,18 @@ def assigndensity(insumstats,
 				pos="POS", 
 				bwindowsizekb=100,
 				log=Log(),verbose=True):
-
-    large_number = 1000000000
-    for i in range(7):
-        if insumstats[pos].max()*10 >  large_number:
-            large_number = int(large_number * 10)
-        else:
-            break
+    '''
+    number of variants in sig_sumstats within +/- bwindowsizekb of each variant in insumstats
+    bwindowsizekb : a window size (return a Series DENSITY) or a list of window sizes (return a DataFrame DENSITY_{windowsizekb}KB)
+    '''
     sumstats = insumstats.loc[:,[id,chrom,pos]].copy()
-    sumstats["DENSITY"] = 0
-    sumstats["TCHR+POS"] = sumstats[chrom]*large_number +  sumstats[pos]
-    sig_sumstats["TCHR+POS"] = sig_sumstats[chrom]*large_number +  sig_sumstats[pos]
-    counter = 0
-
-    for index,row in sig_sumstats.iterrows():
-        counter+=1
-        to_add =(sumstats["TCHR+POS"]>=(row["TCHR+POS"]- 1000*bwindowsizekb)) & (sumstats["TCHR+POS"]<=(row["TCHR+POS"]+ 1000*bwindowsizekb))
-        sumstats.loc[to_add,"DENSITY"] += 1
-        if counter%1000==0:
-            if verbose:log.write(" -Processed {} signals".format(counter//1000))
-            gc.collect()
-	
+    keys = chrpos_key(sumstats[chrom], sumstats[pos])
+    sig_keys = np.sort(chrpos_key(sig_sumstats[chrom], sig_sumstats[pos]))
+    if verbose:log.write(" -Counting {} signals around {} variants...".format(len(sig_keys), len(keys)))
+    
+    for window, col in zip(_window_list(bwindowsizekb), _density_columns(bwindowsizekb)):
+        sumstats[col] = count_in_window(sig_keys, keys, 1000 * window)
+    
+    if isinstance(bwindowsizekb, (list, tuple)):
+        return sumstats[_density_columns(bwindowsizekb)]
     return sumstats["DENSITY"]
@@ -3,19 +3,15 @@ import numpy as np
 import scipy as sp
 from gwaslab.Log import Log
 from gwaslab.CommonData import get_chr_to_number
-from gwaslab.CommonData import get_number_to_chr
-from gwaslab.CommonData import get_chr_to_NC
-from gwaslab.CommonData import gtf_to_protein_coding
-from gwaslab.download import check_and_download
+from gwaslab.variantkey import chrpos_key
+from gwaslab.variantkey import POS_BITS
 from gwaslab.gwascatalog import gwascatalog_trait
-from pyensembl import EnsemblRelease
-from pyensembl import Genome
-from os import path
 from gwaslab.fill import fill_p
+from gwaslab.geneindex import get_gene_index
+from gwaslab.geneindex import closest_genes
 import gc
 
 # getsig
-# closest_gene
 # annogene
 # getnovel
 
@@ -43,6 +39,67 @@ def getsig(insumstats,
     if verbose: log.write(" -Significance threshold :", sig_level)
     if verbose: log.write(" -Sliding window size:", str(windowsizekb) ," kb")
     
+    sumstats_sig, use_p = _get_sig_variants(insumstats, id, chrom, pos, p, scaled, sig_level, mlog10p, log, verbose)
+    if verbose:log.write(" -Found "+str(len(sumstats_sig))+" significant variants in total...")
+
+    lead_index = _get_lead_index(sumstats_sig[chrom], sumstats_sig[pos], sumstats_sig["__SCALEDP"], windowsizekb)
+    if verbose:log.write(" -Identified "+str(len(lead_index))+" lead variants!")
+    
+    output = _get_lead_output(sumstats_sig, lead_index, chrom, pos, anno, xymt, build, source, log, verbose)
+    # Finishing
+    if verbose: log.write("Finished extracting lead variants successfully!")
+    gc.collect()
+    return output
+
+def getsigbatch(insumstats,
+           id,
+           chrom,
+           pos,
+           p,
+           scaled=False,
+           windowsizekb=[500],
+           sig_level=[5e-8],
+           log=Log(),
+           xymt=["X","Y","MT"],
+           anno=False,
+           build="19",
+           source="ensembl",
+           mlog10p="MLOG10P",
+           verbose=True):
+    """
+    Extract the lead variants for all combinations of sig_level and windowsizekb (lists) in one pass.
+    The variants are converted and sorted once at the loosest threshold.
+    Return a dict : (sig_level, windowsizekb) -> lead variants (same as getsig with the same arguments).
+    """
+    if verbose: log.write("Start to extract lead variants for {} significance threshold(s) x {} window size(s)...".format(len(sig_level),len(windowsizekb)))
+    if verbose: log.write(" -Processing "+str(len(insumstats))+" variants...")
+    
+    sumstats_sig, use_p = _get_sig_variants(insumstats, id, chrom, pos, p, scaled, max(sig_level), mlog10p, log, verbose)
+    if verbose:log.write(" -Found "+str(len(sumstats_sig))+" significant variants at the loosest threshold :", max(sig_level))
+    
+    outputs = {}
+    for level in sig_level:
+        if use_p is True:
+            is_sig = (sumstats_sig[p] < level).to_numpy(dtype="bool")
+        else:
+            is_sig = (sumstats_sig[mlog10p] > -np.log10(level)).to_numpy(dtype="bool")
+        sig_index = np.flatnonzero(is_sig)
+        chrom_sig = sumstats_sig[chrom].iloc[sig_index]
+        pos_sig = sumstats_sig[pos].iloc[sig_index]
+        scaledp_sig = sumstats_sig["__SCALEDP"].iloc[sig_index]
+        for window in windowsizekb:
+            lead_index = sig_index[_get_lead_index(chrom_sig, pos_sig, scaledp_sig, window)]
+            if verbose: log.write(" -Significance threshold : {} ; window size : {} kb : {} lead variants".format(level, window, len(lead_index)))
+            outputs[(level, window)] = _get_lead_output(sumstats_sig, lead_index, chrom, pos, anno, xymt, build, source, log, verbose)
+    if verbose: log.write("Finished extracting lead variants successfully!")
+    gc.collect()
+    return outputs
+
+def _get_sig_variants(insumstats, id, chrom, pos, p, scaled, sig_level, mlog10p, log, verbose):
+    '''
+    significant variants sorted by CHR and POS with integer CHR / POS, internal __ID and __SCALEDP (P or -MLOG10P)
+    return the variants and whether P (True) or MLOG10P (False) was used for the threshold
+    '''
     #load data
     sumstats=insumstats.loc[~insumstats[id].isna(),:].copy()
     
@@ -57,9 +114,9 @@ def getsig(insumstats,
     
     #create internal uniqid
     sumstats["__ID"] = range(len(sumstats))
-    id = "__ID"
 
     #extract all significant variants
+    use_p = False
     if scaled==True:
         #use MLOG10P 
         if mlog10p in sumstats.columns:
@@ -74,74 +131,44 @@ def getsig(insumstats,
                 sumstats_sig.loc[:,"__SCALEDP"] = -pd.to_numeric(sumstats_sig[mlog10p], errors='coerce')
         else:
             #use P         
+            use_p = True
             sumstats[p] = pd.to_numeric(sumstats[p], errors='coerce')
             sumstats_sig = sumstats.loc[sumstats[p]<sig_level,:].copy()
             sumstats_sig.loc[:,"__SCALEDP"] = pd.to_numeric(sumstats_sig[p], errors='coerce')
-    if verbose:log.write(" -Found "+str(len(sumstats_sig))+" significant variants in total...")
 
     #sort the coordinates
     sumstats_sig = sumstats_sig.sort_values([chrom,pos])
-    if sumstats_sig is None:
-        if verbose:log.write(" -No lead snps at given significance threshold!")
-        return None
-    
-    #init 
-    sig_index_list=[]
-    current_sig_index = False
-    current_sig_p = 1
-    current_sig_pos = 0
-    current_sig_chr = 0
-    
-    p="__SCALEDP"
-    
-    #iterate through all significant snps
-    for line_number,(index, row) in enumerate(sumstats_sig.iterrows()):
-        #when finished one chr 
-        if row[chrom]!=current_sig_chr:
-            #add the current lead variants id to lead variant list
-            if current_sig_index is not False:sig_index_list.append(current_sig_index)
-            
-            #update lead vairant info to the new variant
-            current_sig_chr=row[chrom]
-            current_sig_pos=row[pos]
-            current_sig_p=row[p]
-            current_sig_index=row[id]
-            
-            # only one significant variant on a new chromsome and this is the last sig variant
-            if  line_number == len(sumstats_sig)-1:
-                sig_index_list.append(current_sig_index)
-            continue
-        
-        # next loci : gap > windowsizekb*1000
-        if row[pos]>current_sig_pos + windowsizekb*1000:
-            sig_index_list.append(current_sig_index)
-            current_sig_pos=row[pos]
-            current_sig_p=row[p]
-            current_sig_index=row[id]
-            if  line_number == len(sumstats_sig)-1:
-                sig_index_list.append(current_sig_index)
-            continue
-        
-        # update current pos and p
-        if row[p]<current_sig_p:
-            current_sig_pos=row[pos]
-            current_sig_p=row[p]
-            current_sig_index=row[id]
-        else:
-            current_sig_pos=row[pos]
-            
-        #when last line in sig_index_list
-        if  line_number == len(sumstats_sig)-1:
-            sig_index_list.append(current_sig_index)
-            continue
-    
-    if verbose:log.write(" -Identified "+str(len(sig_index_list))+" lead variants!")
+    return sumstats_sig, use_p
+
+def _get_lead_index(chrom, pos, scaledp, windowsizekb):
+    '''
+    positions of the lead variants in variants sorted by CHR and POS
+    a new locus starts at a new chromosome or when the gap to the previous significant variant is > windowsizekb ;
+    the lead variant is the first variant with the smallest scaled P in each locus
+    '''
+    chrom = pd.Series(chrom).to_numpy(dtype="float64", na_value=np.nan)
+    pos = pd.Series(pos).to_numpy(dtype="float64", na_value=np.nan)
+    scaledp = pd.Series(scaledp).to_numpy(dtype="float64", na_value=np.nan)
+    if len(chrom)==0:
+        return np.array([], dtype="int64")
     
-    # drop internal __SCALEDP
-    sumstats_sig = sumstats_sig.drop("__SCALEDP",axis=1)
+    is_new_locus = np.ones(len(chrom), dtype="bool")
+    is_new_locus[1:] = (chrom[1:] != chrom[:-1]) | (np.diff(pos) > windowsizekb*1000)
+    locus_start = np.flatnonzero(is_new_locus)
+    locus_id = np.cumsum(is_new_locus) - 1
     
+    # first variant reaching the minimum of each locus
+    locus_min = np.fmin.reduceat(scaledp, locus_start)
+    is_min = scaledp == locus_min[locus_id]
+    # as in a sequential scan with "<", a locus starting with a missing P keeps its first variant
+    is_min[locus_start[np.isnan(scaledp[locus_start])]] = True
+    candidates = np.flatnonzero(is_min)
+    _, first = np.unique(locus_id[candidates], return_index=True)
+    return candidates[first]
+
+def _get_lead_output(sumstats_sig, lead_index, chrom, pos, anno, xymt, build, source, log, verbose):
     # extract the lead variants
-    output = sumstats_sig.loc[sumstats_sig[id].isin(sig_index_list),:].copy()
+    output = sumstats_sig.iloc[lead_index,:].drop("__SCALEDP",axis=1)
 
     # annotate GENENAME
     if anno is True and len(output)>0:
@@ -150,7 +177,7 @@ def getsig(insumstats,
         
         output = annogene(
                output,
-               id=id,
+               id="__ID",
                chrom=chrom,
                pos=pos,
                log=log,
@@ -159,74 +186,11 @@ def getsig(insumstats,
                source=source,
                verbose=verbose)
         
-    # Finishing
-    if verbose: log.write("Finished extracting lead variants successfully!")
     # drop internal id
     output = output.drop("__ID",axis=1)
-    gc.collect()
     return output.copy()
 
 
-def closest_gene(x,data,chrom="CHR",pos="POS",maxiter=20000,step=50,source="ensembl",build="19"):
-        #
-        # data
-        # check snp position
-        #convert 23,24,25 back to X,Y,MT for EnsemblRelease query
-        if source=="ensembl":
-            contig = get_number_to_chr()[x[chrom]]
-        elif source=="refseq":
-            contig = get_number_to_chr()[x[chrom]]
-            contig = get_chr_to_NC(build=build)[contig]
-            # for refseq , gene names are stored as gene_id, using gene_ids_at_locus instead
-            data.gene_names_at_locus = data.gene_ids_at_locus
-        position = int(x[pos])
-        # query
-        gene = data.gene_names_at_locus(contig=contig, position=position)
-        if len(gene)==0:
-            # if not in any gene
-            i=0
-            while i<=maxiter:
-                # using distance to check upstram and downstream region
-                distance = i*step
-                # upstream
-                gene_u = data.gene_names_at_locus(contig=contig, position=position-distance)
-                
-                # downstream
-                gene_d = data.gene_names_at_locus(contig=contig, position=position+distance)
-                
-                if len(gene_u)>0 and len(gene_d)>0:
-                    # if found gene uptream and downstream at the same time 
-                    # go back to last step
-                    distance = (i-1)*step
-                    for j in range(0,step,1):
-                        # use small step to finemap                        
-                        gene_u = data.gene_names_at_locus(contig=contig, position=position-distance-j)
-                        gene_d = data.gene_names_at_locus(contig=contig, position=position+distance+j)
-                        if len(gene_u)>0:
-                            return -distance-j,",".join(gene_u).strip(",")
-                        elif len(gene_d)>0:
-                            return distance+j,",".join(gene_d).strip(",")
-                elif len(gene_u)>0:                    
-                    # if found gene uptream
-                    distance = (i-1)*step
-                    for j in range(0,step,1):
-                        gene_u2 = data.gene_names_at_locus(contig=contig, position=position-distance-j)
-                        if len(gene_u2)>0:
-                            return -distance-j,",".join(gene_u).strip(",")
-                elif len(gene_d)>0:
-                    # if found gene downstream
-                    distance = (i-1)*step
-                    for j in range(0,step,1):
-                        gene_d2 = data.gene_names_at_locus(contig=contig, position=position+distance+j)
-                        if len(gene_d2)>0:
-                            return distance+j,",".join(gene_d).strip(",")
-                i+=1
-                # increase i by 1
-            return distance,"intergenic"
-        else:
-            return 0,",".join(gene).strip(",")
-
-
 def annogene(
            insumstats,
            id,
@@ -241,75 +205,12 @@ def annogene(
     if verbose: log.write("Start to annotate variants with nearest gene name(s)...")
     output = insumstats.copy()
     
-    if source == "ensembl":
-        if build=="19":
-            #data = EnsemblRelease(75)
-            if verbose:log.write(" -Assigning Gene name using ensembl_hg19_gtf for protein coding genes")
-            #zcat Homo_sapiens.GRCh37.75.gtf.gz| 
-            #grep -E 'processed_transcript|protein_coding|_gene' 
-            #| gzip >Homo_sapiens.GRCh37.75.processed.chr.gtf.gz     
-            
-            #gtf_path = check_and_download("ensembl_hg19_gtf_protein_coding")
-            gtf_path = check_and_download("ensembl_hg19_gtf")
-            gtf_path = gtf_to_protein_coding(gtf_path,log=log,verbose=verbose)
-            gtf_db_path = gtf_path[:-2]+"db"
-            
-            data = Genome(
-                reference_name='GRCh37',
-                annotation_name='Ensembl',
-                gtf_path_or_url=gtf_path)
-            if path.isfile(gtf_db_path) is False:
-                data.index()
-            output.loc[:,["LOCATION","GENE"]] = pd.DataFrame(
-                list(output.apply(lambda x:closest_gene(x,data=data,chrom=chrom,pos=pos,source=source), axis=1)), 
-                index=output.index).values
-        elif build=="38":
-            if verbose:log.write(" -Assigning Gene name using ensembl_hg38_gtf for protein coding genes")
-            #gtf_path = check_and_download("ensembl_hg38_gtf_protein_coding")
-            gtf_path = check_and_download("ensembl_hg38_gtf")
-            gtf_path = gtf_to_protein_coding(gtf_path,log=log,verbose=verbose)
-            gtf_db_path = gtf_path[:-2]+"db"
-            data = Genome(
-                reference_name='GRCh38',
-                annotation_name='Ensembl',
-                gtf_path_or_url=gtf_path)
-            if path.isfile(gtf_db_path) is False:
-                data.index()
-            output.loc[:,["LOCATION","GENE"]] = pd.DataFrame(
-                list(output.apply(lambda x:closest_gene(x,data=data,chrom=chrom,pos=pos,source=source), axis=1)), 
-                index=output.index).values
-    
-    if source == "refseq":
-        if build=="19":
-            if verbose:log.write(" -Assigning Gene name using NCBI refseq latest GRCh37 for protein coding genes")
-            #gtf_path = check_and_download("refseq_hg19_gtf_protein_coding")
-            gtf_path = check_and_download("refseq_hg19_gtf")
-            gtf_path = gtf_to_protein_coding(gtf_path,log=log,verbose=verbose)
-            gtf_db_path = gtf_path[:-2]+"db"
-            data = Genome(
-                reference_name='GRCh37',
-                annotation_name='Refseq',
-                gtf_path_or_url=gtf_path)
-            if path.isfile(gtf_db_path) is False:
-                data.index()
-            output.loc[:,["LOCATION","GENE"]] = pd.DataFrame(
-                list(output.apply(lambda x:closest_gene(x,data=data,chrom=chrom,pos=pos,source=source,build=build), axis=1)), 
-                index=output.index).values
-        elif build=="38":
-            if verbose:log.write(" -Assigning Gene name using NCBI refseq latest GRCh38 for protein coding genes")
-            #gtf_path = check_and_download("refseq_hg38_gtf_protein_coding")
-            gtf_path = check_and_download("refseq_hg38_gtf")
-            gtf_path = gtf_to_protein_coding(gtf_path,log=log,verbose=verbose)
-            gtf_db_path = gtf_path[:-2]+"db"
-            data = Genome(
-                reference_name='GRCh38',
-                annotation_name='Refseq',
-                gtf_path_or_url=gtf_path)
-            if path.isfile(gtf_db_path) is False:
-                data.index()
-            output.loc[:,["LOCATION","GENE"]] = pd.DataFrame(
-                list(output.apply(lambda x:closest_gene(x,data=data,chrom=chrom,pos=pos,source=source,build=build), axis=1)), 
-                index=output.index).values
+    if source in ["ensembl","refseq"] and build in ["19","38"]:
+        # one vectorized lookup in the cached gene interval index (gwaslab.geneindex)
+        gene_index = get_gene_index(build=build, source=source, verbose=verbose, log=log)
+        location, gene = closest_genes(output[chrom], output[pos], gene_index)
+        output["LOCATION"] = location
+        output["GENE"] = gene
     if verbose: log.write("Finished annotating variants with nearest gene name(s) successfully!")
     return output
 
@@ -337,15 +238,8 @@ def getnovel(insumstats,
            id=id,chrom=chrom,pos=pos,p=p,windowsizekb=windowsizekb,sig_level=sig_level,log=log,
            xymt=xymt,anno=anno,build=build, source=source,verbose=verbose)
     
-    big_number = 1000000000
-    for i in range(7):
-        if insumstats["POS"].max()*10 >  big_number:
-            big_number = int(big_number * 10)
-        else:
-            break
-
-    # create helper column TCHR+POS for allsig
-    allsig["TCHR+POS"]=allsig[chrom]*big_number + allsig[pos]
+    # create helper column TCHR+POS (packed CHR:POS key) for allsig
+    allsig["TCHR+POS"]=chrpos_key(allsig[chrom], allsig[pos])
     
     knownsig = pd.DataFrame()
     if efo != False:
@@ -381,7 +275,7 @@ def getnovel(insumstats,
         raise ValueError("Please input a dataframe of known loci or valid efo code")
 
     # create helper column TCHR+POS for knownsig
-    knownsig["TCHR+POS"]=knownsig[chrom]*big_number + knownsig[pos]
+    knownsig["TCHR+POS"]=chrpos_key(knownsig[chrom], knownsig[pos])
     
     if verbose: log.write(" -Lead variants in known loci:",len(knownsig))
     if verbose: log.write(" -Checking the minimum distance between identified lead variants and provided known variants...")
@@ -390,51 +284,29 @@ def getnovel(insumstats,
     allsig = allsig.sort_values(by="TCHR+POS",ignore_index=True)
     knownsig = knownsig.sort_values(by="TCHR+POS",ignore_index=True)
     
-    if "SNPID" in knownsig.columns:
-        knownids=knownsig["SNPID"].values
-    if "PUBMEDID" in knownsig.columns:
-        knownpubmedids=knownsig["PUBMEDID"].values
-    if "AUTHOR" in knownsig.columns:
-        knownauthor=knownsig["AUTHOR"].values
-    if "EFOID" in knownsig.columns:
-        knownefo=knownsig["EFOID"].values
-    
-    # get distance
-    lambda x:np.min(np.abs(knownsig["TCHR+POS"]-x))
-    allsig["DISTANCE_TO_KNOWN"] = allsig["TCHR+POS"].apply(lambda x:min(knownsig["TCHR+POS"]-x, key=abs))
+    # nearest known variant on the same chromosome (one searchsorted for all leads)
+    nearest, is_found = _get_nearest_known(allsig["TCHR+POS"].values, knownsig["TCHR+POS"].values)
+    distance = knownsig["TCHR+POS"].values[nearest] - allsig["TCHR+POS"].values
     
-    # get other info 
-    if "SNPID" in knownsig.columns:
-        allsig["KNOWN_ID"] = allsig["TCHR+POS"].apply(lambda x:knownids[np.argmin(np.abs(knownsig["TCHR+POS"]-x))])    
-    if "PUBMEDID" in knownsig.columns:
-        allsig["KNOWN_PUBMED_ID"] = allsig["TCHR+POS"].apply(lambda x:knownpubmedids[np.argmin(np.abs(knownsig["TCHR+POS"]-x))])
-    if "AUTHOR" in knownsig.columns:
-        allsig["KNOWN_AUTHOR"] = allsig["TCHR+POS"].apply(lambda x:knownauthor[np.argmin(np.abs(knownsig["TCHR+POS"]-x))])
-    if "EFOID" in knownsig.columns:
-        allsig["KNOWN_EFOID"] = allsig["TCHR+POS"].apply(lambda x:knownefo[np.argmin(np.abs(knownsig["TCHR+POS"]-x))])
+    # get distance and other info from the nearest known variant
+    if is_found.all():
+        allsig["DISTANCE_TO_KNOWN"] = distance
+    else:
+        allsig["DISTANCE_TO_KNOWN"] = pd.array(np.where(is_found, distance, 0), dtype="Int64")
+        allsig.loc[~is_found,"DISTANCE_TO_KNOWN"] = pd.NA
+    for known_col, col in [("SNPID","KNOWN_ID"),("PUBMEDID","KNOWN_PUBMED_ID"),("AUTHOR","KNOWN_AUTHOR"),("EFOID","KNOWN_EFOID")]:
+        if known_col in knownsig.columns:
+            allsig[col] = _take_known(knownsig[known_col].values, nearest, is_found)
 
-    # determine if novel
-    allsig["NOVEL"] = allsig["DISTANCE_TO_KNOWN"].abs() > windowsizekb_for_novel*1000
+    # determine if novel (no known variant on the same chromosome : novel)
+    allsig["NOVEL"] = ~is_found | (np.abs(distance) > windowsizekb_for_novel*1000)
     
     # determine location
     allsig["LOCATION_OF_KNOWN"]="Unknown"
-    allsig.loc[ allsig["DISTANCE_TO_KNOWN"]== 0,"LOCATION_OF_KNOWN"] = "Same"
-    allsig.loc[ allsig["DISTANCE_TO_KNOWN"] > 0 ,"LOCATION_OF_KNOWN"] = "Upstream"
-    allsig.loc[ allsig["DISTANCE_TO_KNOWN"] < 0 ,"LOCATION_OF_KNOWN"] = "Downstream"
-
-    # if not on same chromosome, distance set to pd.NA
-    if sum(allsig["DISTANCE_TO_KNOWN"].abs() > insumstats["POS"].max())>0:
-        not_on_same_chromosome = allsig["DISTANCE_TO_KNOWN"].abs() > insumstats["POS"].max()
-        allsig.loc[ not_on_same_chromosome ,"DISTANCE_TO_KNOWN"] = pd.NA
-        allsig.loc[ not_on_same_chromosome ,"LOCATION_OF_KNOWN"] = "NoneOnThisChr"
-        if "SNPID" in knownsig.columns:
-            allsig.loc[ not_on_same_chromosome ,"KNOWN_ID"] = pd.NA
-        if "PUBMEDID" in knownsig.columns:
-            allsig.loc[ not_on_same_chromosome ,"KNOWN_PUBMED_ID"] = pd.NA
-        if "AUTHOR" in knownsig.columns:
-            allsig.loc[ not_on_same_chromosome ,"KNOWN_AUTHOR"] = pd.NA
-        if "EFOID" in knownsig.columns:
-            allsig.loc[ not_on_same_chromosome ,"KNOWN_EFOID"] = pd.NA
+    allsig.loc[ is_found & (distance == 0),"LOCATION_OF_KNOWN"] = "Same"
+    allsig.loc[ is_found & (distance > 0) ,"LOCATION_OF_KNOWN"] = "Upstream"
+    allsig.loc[ is_found & (distance < 0) ,"LOCATION_OF_KNOWN"] = "Downstream"
+    allsig.loc[ ~is_found ,"LOCATION_OF_KNOWN"] = "NoneOnThisChr"
 
     # drop helper column TCHR+POS
     allsig = allsig.drop(["TCHR+POS"], axis=1)
@@ -455,3 +327,38 @@ def getnovel(insumstats,
             return allsig, knownsig
         else:
             return allsig
+
+def _get_nearest_known(lead_key, known_key):
+    '''
+    index of the nearest known variant on the same chromosome for each lead (keys from chrpos_key, known_key sorted)
+    ties are resolved in favour of the first known variant in sorted order (the upstream one)
+    return the index (0 if not found) and whether a known variant was found on the same chromosome
+    '''
+    lead_key = np.asarray(lead_key, dtype="int64")
+    known_key = np.asarray(known_key, dtype="int64")
+    nearest = np.zeros(len(lead_key), dtype="int64")
+    is_found = np.zeros(len(lead_key), dtype="bool")
+    if len(known_key)==0:
+        return nearest, is_found
+    lead_chr = lead_key >> POS_BITS
+    known_chr = known_key >> POS_BITS
+    
+    right = np.searchsorted(known_key, lead_key, side="left")
+    right_clipped = np.clip(right, 0, len(known_key)-1)
+    has_right = (right < len(known_key)) & (known_chr[right_clipped] == lead_chr) & (lead_key >= 0)
+    # first known variant with the key preceding the lead
+    left_clipped = np.clip(right - 1, 0, None)
+    left_clipped = np.searchsorted(known_key, known_key[left_clipped], side="left")
+    has_left = (right > 0) & (known_chr[left_clipped] == lead_chr) & (lead_key >= 0)
+    
+    use_left = has_left & (~has_right | (lead_key - known_key[left_clipped] <= known_key[right_clipped] - lead_key))
+    nearest = np.where(use_left, left_clipped, right_clipped)
+    is_found = has_left | has_right
+    return nearest, is_found
+
+def _take_known(values, nearest, is_found):
+    if is_found.all():
+        return values[nearest]
+    taken = values[nearest].astype("object")
+    taken[~is_found] = pd.NA
+    return taken
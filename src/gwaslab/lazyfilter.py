@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from gwaslab.Log import Log
+from gwaslab.annotateregion import inbed
+import gc
+
+# lazy filter builder for Sumstats objects
+#   mysumstats.filter().gt(INFO=0.8).lt(P=5e-8).region_out(high_ld=True).collect()
+# predicates are only recorded until collect() ; they are then evaluated on the column arrays and combined
+# into one boolean mask, and the rows are taken once (no deepcopy of the Sumstats object, no intermediate dataframes)
+# variants with missing values in a filtered column never meet the condition
+
+_OPERATORS = {"gt":(np.greater, ">"),
+              "ge":(np.greater_equal, ">="),
+              "lt":(np.less, "<"),
+              "le":(np.less_equal, "<="),
+              "eq":(np.equal, "=="),
+              "ne":(np.not_equal, "!=")}
+
+def compare_column(series, op, value):
+    '''
+    boolean array : series {op} value ; False for missing values
+    '''
+    operator = _OPERATORS[op][0]
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+        with np.errstate(invalid="ignore"):
+            return operator(values, value)
+    result = operator(series, value)
+    return result.fillna(False).to_numpy(dtype="bool") & series.notna().to_numpy()
+
+class SumstatsFilter():
+    '''
+    returned by Sumstats.filter() ; chain gt / ge / lt / le / eq / ne / between / isin / notna / expr / region_in / region_out
+    and call collect() to get a new Sumstats object (or collect(inplace=True) to filter the object itself)
+    '''
+    def __init__(self, glsumstats, verbose=True):
+        self.glsumstats = glsumstats
+        self.verbose = verbose
+        self.predicates = []
+
+    def _add(self, description, function):
+        self.predicates.append((description, function))
+        return self
+
+    def _add_comparison(self, op, conditions):
+        for col, value in conditions.items():
+            description = "{} {} {}".format(col, _OPERATORS[op][1], value)
+            self._add(description, lambda data, col=col, value=value: compare_column(data[col], op, value))
+        return self
+
+    def gt(self, **conditions):
+        return self._add_comparison("gt", conditions)
+
+    def ge(self, **conditions):
+        return self._add_comparison("ge", conditions)
+
+    def lt(self, **conditions):
+        return self._add_comparison("lt", conditions)
+
+    def le(self, **conditions):
+        return self._add_comparison("le", conditions)
+
+    def eq(self, **conditions):
+        return self._add_comparison("eq", conditions)
+
+    def ne(self, **conditions):
+        return self._add_comparison("ne", conditions)
+
+    def between(self, **conditions):
+        '''
+        between(EAF=(0.01,0.99)) : 0.01 <= EAF <= 0.99
+        '''
+        for col, (lower, upper) in conditions.items():
+            self._add("{} <= {} <= {}".format(lower, col, upper),
+                      lambda data, col=col, lower=lower, upper=upper: compare_column(data[col], "ge", lower) & compare_column(data[col], "le", upper))
+        return self
+
+    def isin(self, **conditions):
+        for col, values in conditions.items():
+            self._add("{} in {} values".format(col, len(values)),
+                      lambda data, col=col, values=values: data[col].isin(values).to_numpy(dtype="bool"))
+        return self
+
+    def notna(self, *cols):
+        for col in cols:
+            self._add("{} is not missing".format(col), lambda data, col=col: data[col].notna().to_numpy())
+        return self
+
+    def expr(self, expr):
+        '''
+        pandas expression evaluated on the data, e.g. expr("BETA/SE > 2")
+        '''
+        return self._add(expr, lambda data: data.eval(expr, engine="python").fillna(False).to_numpy(dtype="bool"))
+
+    def region_in(self, **args):
+        '''
+        keep variants in the bed intervals (arguments of gwaslab.annotateregion.inbed : path, high_ld, build ...)
+        '''
+        description = "in {}".format("high-LD regions" if args.get("high_ld", False) else args.get("path"))
+        return self._add(description, lambda data: inbed(data, verbose=False, **args))
+
+    def region_out(self, **args):
+        '''
+        remove variants in the bed intervals (arguments of gwaslab.annotateregion.inbed : path, high_ld, build ...)
+        '''
+        description = "not in {}".format("high-LD regions" if args.get("high_ld", False) else args.get("path"))
+        return self._add(description, lambda data: ~inbed(data, verbose=False, **args))
+
+    def mask(self, log=Log()):
+        '''
+        boolean array combining all predicates
+        '''
+        data = self.glsumstats.data
+        keep = np.ones(len(data), dtype="bool")
+        for description, function in self.predicates:
+            is_met = np.asarray(function(data), dtype="bool")
+            if self.verbose: log.write(" -Removing {} variants not meeting : {}".format(np.count_nonzero(keep & ~is_met), description))
+            keep &= is_met
+        return keep
+
+    def collect(self, inplace=False):
+        '''
+        apply all predicates at once ; return a new Sumstats object unless inplace=True
+        '''
+        if inplace is True:
+            glsumstats = self.glsumstats
+        else:
+            glsumstats = self.glsumstats._spawn()
+        log = glsumstats.log
+        if self.verbose: log.write("Start to filter variants with {} condition(s)...".format(len(self.predicates)))
+        keep = self.mask(log=log)
+        glsumstats.data = take_rows(self.glsumstats.data, keep)
+        if self.verbose: log.write(" -Number of variants left: {}".format(len(glsumstats.data)))
+        if self.verbose: log.write("Finished filtering variants.")
+        gc.collect()
+        if inplace is False:
+            return glsumstats
+
+def take_rows(sumstats, keep):
+    '''
+    rows where keep is True as a new dataframe (one take ; unlike .loc[mask].copy() the rows are only copied once)
+    '''
+    return sumstats.take(np.flatnonzero(keep))
@@ -11,6 +11,7 @@ from gwaslab.Log import Log
 from gwaslab.calculate_gc import lambdaGC
 from gwaslab.getsig import getsig
 from gwaslab.getsig import annogene
+from gwaslab.getdensity import count_in_window
 from gwaslab.CommonData import get_chr_to_number
 from gwaslab.CommonData import get_number_to_chr
 from gwaslab.CommonData import get_recombination_rate
@@ -48,6 +49,8 @@ from gwaslab.quickfix import _quick_assign_marker_relative_size
 from gwaslab.quickfix import _cut
 from gwaslab.quickfix import _set_yticklabels
 from gwaslab.quickfix import _jagged_y
+from gwaslab.quickfix import _get_axes_pixels
+from gwaslab.quickfix import _quick_decimate
 from gwaslab.figuresave import save_figure
 # 20230202 ######################################################################################################
 
@@ -177,6 +180,9 @@ def mqqplot(insumstats,
           saveargs=None,
           _invert=False,
           expected_min_mlog10p=0,
+          decimate=True,
+          decimate_mlog10p=2,
+          _cache=None,
           log=Log()
           ):
 
@@ -246,6 +252,11 @@ def mqqplot(insumstats,
                     figargs["dpi"]=72
                     scatter_kwargs["rasterized"]=True
                     qq_scatter_kwargs["rasterized"]=True
+    
+    # pixel grid for decimation : resolution of the saved figure if it is higher than that of the figure
+    decimate_scale = 1
+    if save is not None and saveargs.get("dpi") is not None:
+        decimate_scale = max(1, saveargs["dpi"] / figargs["dpi"])
 
     if verbose: log.write("Start to plot manhattan/qq plot with the following basic settings:")
     if verbose: log.write(" -Genomic coordinates version: {}...".format(build))
@@ -393,85 +404,117 @@ def mqqplot(insumstats,
         usecols.append("DENSITY")
 
     #################################################################################################
-    sumstats = insumstats.loc[:,usecols].copy()
+    # cached plot frame (Sumstats.plot_mqq) ########################################################################
+    # the prepared frame only depends on the data and on the arguments in frame_key (not on cosmetic arguments)
+    frame_key = None
+    cached = None
+    bmean = None
+    bmedian = None
+    if _cache is not None and region is None and vcf_path is None:
+        frame_key = ("frame", tuple(usecols), mode, chrom, pos, p, snpid, eaf, scaled, mlog10p, skip, cut, cutfactor, cut_log, repr(ylabels), repr(anno),
+                     stratified, repr(highlight), highlight_windowkb, density_color, bwindowsizekb, repr(list(lines_to_plot)), repr(chr_dict))
+        cached = _cache.get(frame_key)
+    
+    if cached is not None:
+        if verbose: log.write(" -Using cached plot frame with "+str(len(cached["sumstats"]))+" variants...")
+        if (anno == "GENENAME"):
+            anno_sig=True
+        sumstats = cached["sumstats"].copy(deep=False)
+        p_toplot_raw = cached["p_toplot_raw"]
+        eaf_raw = cached["eaf_raw"]
+        bmean, bmedian = cached["bmean"], cached["bmedian"]
+        maxy, maxticker, cut, cutfactor = cached["maxy"], cached["maxticker"], cached["cut"], cached["cutfactor"]
+        ylabels_converted, lines_to_plot = cached["ylabels_converted"], cached["lines_to_plot"]
+    else:
+        sumstats = insumstats.loc[:,usecols].copy()
 
 
-    #Standardize
-    ## Annotation
-    if (anno == "GENENAME"):
-        anno_sig=True
-    elif (anno is not None) and (anno is not True):
-        sumstats["Annotation"]=sumstats.loc[:,anno].astype("string")   
+        #Standardize
+        ## Annotation
+        if (anno == "GENENAME"):
+            anno_sig=True
+        elif (anno is not None) and (anno is not True):
+            sumstats["Annotation"]=sumstats.loc[:,anno].astype("string")   
       
-    ## P value
-    ## m, qq, r
-    if "b" not in mode:   
-        if scaled is True:
-            sumstats["raw_P"] = pd.to_numeric(sumstats[mlog10p], errors='coerce')
-        else:
-            sumstats["raw_P"] = sumstats[p].astype("float64")
+        ## P value
+        ## m, qq, r
+        if "b" not in mode:   
+            if scaled is True:
+                sumstats["raw_P"] = pd.to_numeric(sumstats[mlog10p], errors='coerce')
+            else:
+                sumstats["raw_P"] = sumstats[p].astype("float64")
     
-    ## CHR & POS
-    ## m, qq, b
-    if "m" in mode or "r" in mode or "b" in mode: 
-        # convert CHR to int
-        ## CHR X,Y,MT conversion ############################
-        sumstats[pos] = _quick_fix_pos(sumstats[pos])
-        sumstats[chrom] = _quick_fix_chr(sumstats[chrom], chr_dict=chr_dict)
+        ## CHR & POS
+        ## m, qq, b
+        if "m" in mode or "r" in mode or "b" in mode: 
+            # convert CHR to int
+            ## CHR X,Y,MT conversion ############################
+            sumstats[pos] = _quick_fix_pos(sumstats[pos])
+            sumstats[chrom] = _quick_fix_chr(sumstats[chrom], chr_dict=chr_dict)
 
-    ## r
-    if region is not None:
-        region_chr = region[0]
-        region_start = region[1]
-        region_end = region[2]
-        marker_size=(25,45)
-        if verbose:log.write(" -Extract SNPs in region : chr"+str(region_chr)+":"+str(region[1])+"-"+str(region[2])+ "...")
+        ## r
+        if region is not None:
+            region_chr = region[0]
+            region_start = region[1]
+            region_end = region[2]
+            marker_size=(25,45)
+            if verbose:log.write(" -Extract SNPs in region : chr"+str(region_chr)+":"+str(region[1])+"-"+str(region[2])+ "...")
         
-        in_region_snp = (sumstats[chrom]==region_chr) &(sumstats[pos]<region_end) &(sumstats[pos]>region_start)
-        if verbose:log.write(" -Extract SNPs in specified regions: "+str(sum(in_region_snp)))
-        sumstats = sumstats.loc[in_region_snp,:]
-        if len(sumstats)==0:
-            log.write(" -Warning : No valid data! Please check the input.")
-            return None
+            in_region_snp = (sumstats[chrom]==region_chr) &(sumstats[pos]<region_end) &(sumstats[pos]>region_start)
+            if verbose:log.write(" -Extract SNPs in specified regions: "+str(sum(in_region_snp)))
+            sumstats = sumstats.loc[in_region_snp,:]
+            if len(sumstats)==0:
+                log.write(" -Warning : No valid data! Please check the input.")
+                return None
     
-    ## EAF
-    eaf_raw = pd.Series(dtype="float64")
-    if stratified is True: 
-        sumstats["MAF"] = _quick_fix_eaf(sumstats[eaf])
-        # for stratified qq plot
-        eaf_raw = sumstats["MAF"].copy()
+        ## EAF
+        eaf_raw = pd.Series(dtype="float64")
+        if stratified is True: 
+            sumstats["MAF"] = _quick_fix_eaf(sumstats[eaf])
+            # for stratified qq plot
+            eaf_raw = sumstats["MAF"].copy()
         
-    if len(highlight)>0 and ("m" in mode):
-        sumstats["HUE"] = pd.NA
-        sumstats["HUE"] = sumstats["HUE"].astype("Int64")
+        if len(highlight)>0 and ("m" in mode):
+            sumstats["HUE"] = pd.NA
+            sumstats["HUE"] = sumstats["HUE"].astype("Int64")
 
-    if verbose: log.write("Finished loading specified columns from the sumstats.")
+        if verbose: log.write("Finished loading specified columns from the sumstats.")
 
 
-#sanity check############################################################################################################
-    if verbose: log.write("Start conversion and sanity check:")
+    #sanity check############################################################################################################
+        if verbose: log.write("Start conversion and sanity check:")
     
-    if ("m" in mode or "r" in mode): 
-        pre_number=len(sumstats)
-        #sanity check : drop variants with na values in chr and pos df
-        sumstats = sumstats.dropna(subset=[chrom,pos])
-        after_number=len(sumstats)
-        if verbose:log.write(" -Removed "+ str(pre_number-after_number) +" variants with nan in CHR or POS column ...")
-        out_of_range_chr = sumstats[chrom]<=0
-        if verbose:log.write(" -Removed {} varaints with CHR <=0...".format(sum(out_of_range_chr)))
-        sumstats = sumstats.loc[~out_of_range_chr,:]
+        if ("m" in mode or "r" in mode): 
+            pre_number=len(sumstats)
+            #sanity check : drop variants with na values in chr and pos df
+            sumstats = sumstats.dropna(subset=[chrom,pos])
+            after_number=len(sumstats)
+            if verbose:log.write(" -Removed "+ str(pre_number-after_number) +" variants with nan in CHR or POS column ...")
+            out_of_range_chr = sumstats[chrom]<=0
+            if verbose:log.write(" -Removed {} varaints with CHR <=0...".format(sum(out_of_range_chr)))
+            sumstats = sumstats.loc[~out_of_range_chr,:]
     
-    if stratified is True: 
-        pre_number=len(sumstats)
-        sumstats = sumstats.dropna(subset=["MAF"])
-        after_number=len(sumstats)
-        if verbose:log.write(" -Removed "+ str(pre_number-after_number) +" variants with nan in EAF column ...")
+        if stratified is True: 
+            pre_number=len(sumstats)
+            sumstats = sumstats.dropna(subset=["MAF"])
+            after_number=len(sumstats)
+            if verbose:log.write(" -Removed "+ str(pre_number-after_number) +" variants with nan in EAF column ...")
             
-        ## Highlight
-    if len(highlight)>0 and ("m" in mode or "r" in mode):
-        if pd.api.types.is_list_like(highlight[0]):
-            for i, highlight_set in enumerate(highlight):
-                to_highlight = sumstats.loc[sumstats[snpid].isin(highlight_set),:]
+            ## Highlight
+        if len(highlight)>0 and ("m" in mode or "r" in mode):
+            if pd.api.types.is_list_like(highlight[0]):
+                for i, highlight_set in enumerate(highlight):
+                    to_highlight = sumstats.loc[sumstats[snpid].isin(highlight_set),:]
+                    #assign colors: 0 is hightlight color
+                    for index,row in to_highlight.iterrows():
+                        target_chr = int(row[chrom])
+                        target_pos = int(row[pos])
+                        right_chr=sumstats[chrom]==target_chr
+                        up_pos=sumstats[pos]>target_pos-highlight_windowkb*1000
+                        low_pos=sumstats[pos]<target_pos+highlight_windowkb*1000
+                        sumstats.loc[right_chr&up_pos&low_pos,"HUE"]=i
+            else:
+                to_highlight = sumstats.loc[sumstats[snpid].isin(highlight),:]
                 #assign colors: 0 is hightlight color
                 for index,row in to_highlight.iterrows():
                     target_chr = int(row[chrom])
@@ -479,94 +522,81 @@ def mqqplot(insumstats,
                     right_chr=sumstats[chrom]==target_chr
                     up_pos=sumstats[pos]>target_pos-highlight_windowkb*1000
                     low_pos=sumstats[pos]<target_pos+highlight_windowkb*1000
-                    sumstats.loc[right_chr&up_pos&low_pos,"HUE"]=i
-        else:
-            to_highlight = sumstats.loc[sumstats[snpid].isin(highlight),:]
-            #assign colors: 0 is hightlight color
-            for index,row in to_highlight.iterrows():
-                target_chr = int(row[chrom])
-                target_pos = int(row[pos])
-                right_chr=sumstats[chrom]==target_chr
-                up_pos=sumstats[pos]>target_pos-highlight_windowkb*1000
-                low_pos=sumstats[pos]<target_pos+highlight_windowkb*1000
-                sumstats.loc[right_chr&up_pos&low_pos,"HUE"]=0
+                    sumstats.loc[right_chr&up_pos&low_pos,"HUE"]=0
 
-# Density #####################################################################################################              
-    if "b" in mode and "DENSITY" not in sumstats.columns:
-        if verbose:log.write(" -Calculating DENSITY with windowsize of ",bwindowsizekb ," kb")
-        large_number = _get_largenumber(sumstats[pos].max(),log=log)
+    # Density #####################################################################################################              
+        if "b" in mode and "DENSITY" not in sumstats.columns:
+            if verbose:log.write(" -Calculating DENSITY with windowsize of ",bwindowsizekb ," kb")
+            large_number = _get_largenumber(sumstats[pos].max(),log=log)
 
-        stack=[]
-        sumstats["TCHR+POS"] = sumstats[chrom]*large_number +  sumstats[pos]
-        sumstats = sumstats.sort_values(by="TCHR+POS")
-        for index,row in sumstats.iterrows():
-            stack.append([row["SNPID"],row["TCHR+POS"],0])  
-            for i in range(2,len(stack)+1):
-                if stack[-i][1]>= (row["TCHR+POS"]- 1000*bwindowsizekb):
-                    stack[-i][2]+=1
-                    stack[-1][2]+=1
-                else:
-                    break
-        df = pd.DataFrame(stack,columns=["SNPID","TCHR+POS","DENSITY"])
-        sumstats["DENSITY"] = df["DENSITY"].values
-        bmean=sumstats["DENSITY"].mean()
-        bmedian=sumstats["DENSITY"].median()
-    elif "b" in mode and "DENSITY" in sumstats.columns:
-        bmean=sumstats["DENSITY"].mean()
-        bmedian=sumstats["DENSITY"].median()
-        if verbose:log.write(" -DENSITY column exists. Skipping calculation...")
+            sumstats["TCHR+POS"] = sumstats[chrom]*large_number +  sumstats[pos]
+            sumstats = sumstats.sort_values(by="TCHR+POS")
+            # number of other variants within the window
+            positions = sumstats["TCHR+POS"].values
+            sumstats["DENSITY"] = count_in_window(positions, positions, 1000*bwindowsizekb) - 1
+            bmean=sumstats["DENSITY"].mean()
+            bmedian=sumstats["DENSITY"].median()
+        elif "b" in mode and "DENSITY" in sumstats.columns:
+            bmean=sumstats["DENSITY"].mean()
+            bmedian=sumstats["DENSITY"].median()
+            if verbose:log.write(" -DENSITY column exists. Skipping calculation...")
      
-    #############################
-# P value conversion #####################################################################################################  
-    ## m,qq,r -> dropna
-    if "b" not in mode:
-        pre_number=len(sumstats)
-        sumstats = sumstats.dropna(subset=["raw_P"])
-        after_number=len(sumstats)
-        if verbose:log.write(" -Removed "+ str(pre_number-after_number) +" variants with nan in P column ...")
+        #############################
+    # P value conversion #####################################################################################################  
+        ## m,qq,r -> dropna
+        if "b" not in mode:
+            pre_number=len(sumstats)
+            sumstats = sumstats.dropna(subset=["raw_P"])
+            after_number=len(sumstats)
+            if verbose:log.write(" -Removed "+ str(pre_number-after_number) +" variants with nan in P column ...")
     
-    ## b: value to plot is density
-    if "b" in mode:
-        sumstats["scaled_P"] = sumstats["DENSITY"].copy()
-        sumstats["raw_P"] = -np.log10(sumstats["DENSITY"].copy()+2)
-    elif scaled is True:
-        if verbose:log.write(" -P values are already converted to -log10(P)!")
-        sumstats["scaled_P"] = sumstats["raw_P"].copy()
-        sumstats["raw_P"] = np.power(10,-sumstats["scaled_P"].astype("float64"))
-    else:
-        if not scaled:
-            # quick fix p
-            sumstats = _quick_fix_p_value(sumstats, verbose=verbose, log=log)
+        ## b: value to plot is density
+        if "b" in mode:
+            sumstats["scaled_P"] = sumstats["DENSITY"].copy()
+            sumstats["raw_P"] = -np.log10(sumstats["DENSITY"].copy()+2)
+        elif scaled is True:
+            if verbose:log.write(" -P values are already converted to -log10(P)!")
+            sumstats["scaled_P"] = sumstats["raw_P"].copy()
+            sumstats["raw_P"] = np.power(10,-sumstats["scaled_P"].astype("float64"))
+        else:
+            if not scaled:
+                # quick fix p
+                sumstats = _quick_fix_p_value(sumstats, verbose=verbose, log=log)
 
-        # quick fix mlog10p
-        sumstats = _quick_fix_mlog10p(sumstats, scaled=scaled, verbose=verbose, log=log)
+            # quick fix mlog10p
+            sumstats = _quick_fix_mlog10p(sumstats, scaled=scaled, verbose=verbose, log=log)
 
-    # raw p for calculate lambda
-    p_toplot_raw = sumstats[["CHR","scaled_P"]].copy()
+        # raw p for calculate lambda
+        p_toplot_raw = sumstats[["CHR","scaled_P"]].copy()
     
-    # filter out variants with -log10p < skip
-    sumstats = sumstats.loc[sumstats["scaled_P"]>=skip,:]
-    garbage_collect.collect()
+        # filter out variants with -log10p < skip
+        sumstats = sumstats.loc[sumstats["scaled_P"]>=skip,:]
+        garbage_collect.collect()
     
 
-    # 
+        # 
 
-    # shrink variants above cut line #########################################################################################
-    try:
-        sumstats["scaled_P"], maxy, maxticker, cut, cutfactor,ylabels_converted, lines_to_plot = _cut(series = sumstats["scaled_P"], 
-                                                                        mode =mode, 
-                                                                        cut=cut,
-                                                                        skip=skip,
-                                                                        cutfactor = cutfactor,
-                                                                        ylabels=ylabels,
-                                                                        cut_log = cut_log,
-                                                                        verbose =verbose, 
-                                                                        lines_to_plot=lines_to_plot,
-                                                                        log = log)
-    except:
-        log.write(" -Warning : No valid data! Please check the input.")
-        return None
+        # shrink variants above cut line #########################################################################################
+        try:
+            sumstats["scaled_P"], maxy, maxticker, cut, cutfactor,ylabels_converted, lines_to_plot = _cut(series = sumstats["scaled_P"], 
+                                                                            mode =mode, 
+                                                                            cut=cut,
+                                                                            skip=skip,
+                                                                            cutfactor = cutfactor,
+                                                                            ylabels=ylabels,
+                                                                            cut_log = cut_log,
+                                                                            verbose =verbose, 
+                                                                            lines_to_plot=lines_to_plot,
+                                                                            log = log)
+        except:
+            log.write(" -Warning : No valid data! Please check the input.")
+            return None
     
+        if frame_key is not None:
+            _cache[frame_key] = {"sumstats":sumstats.copy(deep=False), "p_toplot_raw":p_toplot_raw, "eaf_raw":eaf_raw,
+                                 "bmean":bmean, "bmedian":bmedian, "maxy":maxy, "maxticker":maxticker, "cut":cut, "cutfactor":cutfactor,
+                                 "ylabels_converted":ylabels_converted, "lines_to_plot":lines_to_plot}
+
     # Manhattan plot ##########################################################################################################
     ## regional plot ->rsq
         #calculate rsq]
@@ -587,11 +617,18 @@ def mqqplot(insumstats,
                                vcf_chr_dict=vcf_chr_dict,
                                tabix=tabix)
 
+
     #sort & add id
     ## Manhatann plot ###################################################
     if ("m" in mode) or ("r" in mode): 
         # assign index i and tick position
-        sumstats,chrom_df=_quick_assign_i_with_rank(sumstats, chrpad=chrpad, use_rank=use_rank, chrom="CHR",pos="POS",drop_chr_start=drop_chr_start)
+        i_key = None if frame_key is None else frame_key + ("i", chrpad, use_rank, drop_chr_start)
+        if i_key is not None and i_key in _cache:
+            sumstats, chrom_df = _cache[i_key][0].copy(deep=False), _cache[i_key][1]
+        else:
+            sumstats,chrom_df=_quick_assign_i_with_rank(sumstats, chrpad=chrpad, use_rank=use_rank, chrom="CHR",pos="POS",drop_chr_start=drop_chr_start)
+            if i_key is not None:
+                _cache[i_key] = (sumstats.copy(deep=False), chrom_df)
         
         ## Assign marker size ##############################################
         sumstats["s"]=1
@@ -605,6 +642,19 @@ def mqqplot(insumstats,
             sumstats["chr_hue"]=sumstats["LD"]
 
         if verbose:log.write("Start to create manhattan plot with "+str(len(sumstats))+" variants:")
+        
+        ## Decimation : variants below decimate_mlog10p sharing a pixel (and color / size) are only drawn once
+        sumstats_to_plot = sumstats
+        if decimate is True and region is None and "b" not in mode:
+            groups = [sumstats["chr_hue"], sumstats["s"]]
+            if len(highlight)>0:
+                groups.append(sumstats["HUE"])
+            if density_color == True:
+                groups.append(sumstats["DENSITY"])
+            width, height = _get_axes_pixels(ax1, scale=decimate_scale)
+            is_drawn = _quick_decimate(sumstats["i"], sumstats["scaled_P"], width, height, keep_above=decimate_mlog10p, groups=groups)
+            sumstats_to_plot = sumstats.loc[is_drawn,:]
+            if verbose:log.write(" -Decimation : drawing {} variants , dropping {} variants with -log10(P) < {} on a {} x {} pixel grid...".format(np.count_nonzero(is_drawn), len(sumstats)-np.count_nonzero(is_drawn), decimate_mlog10p, width, height))
         ## default seetings
         
         palette = sns.color_palette(colors,n_colors=sumstats[chrom].nunique())  
@@ -633,7 +683,7 @@ def mqqplot(insumstats,
         ## if highlight 
         highlight_i = pd.DataFrame()
         if len(highlight) >0:
-            plot = sns.scatterplot(data=sumstats, x='i', y='scaled_P',
+            plot = sns.scatterplot(data=sumstats_to_plot, x='i', y='scaled_P',
                                hue='chr_hue',
                                palette=palette,
                                legend=legend,
@@ -646,7 +696,7 @@ def mqqplot(insumstats,
                 for i, highlight_set in enumerate(highlight):
                     if verbose: log.write(" -Highlighting set {} target loci...".format(i+1))
                     print(sumstats["HUE"].dtype)
-                    sns.scatterplot(data=sumstats.loc[sumstats["HUE"]==i], x='i', y='scaled_P',
+                    sns.scatterplot(data=sumstats_to_plot.loc[sumstats_to_plot["HUE"]==i], x='i', y='scaled_P',
                         hue="HUE",
                         palette={i:highlight_color[i%len(highlight_color)]},
                         legend=legend,
@@ -658,7 +708,7 @@ def mqqplot(insumstats,
                 highlight_i = sumstats.loc[~sumstats["HUE"].isna(),"i"].values
             else:
                 if verbose: log.write(" -Highlighting target loci...")
-                sns.scatterplot(data=sumstats.loc[sumstats["HUE"]==0], x='i', y='scaled_P',
+                sns.scatterplot(data=sumstats_to_plot.loc[sumstats_to_plot["HUE"]==0], x='i', y='scaled_P',
                     hue="HUE",
                     palette={0:highlight_color},
                     legend=legend,
@@ -675,7 +725,7 @@ def mqqplot(insumstats,
             if density_color == True:
                 hue = "DENSITY_hue"
                 s = "DENSITY"
-                to_plot = sumstats.sort_values("DENSITY")
+                to_plot = sumstats_to_plot.sort_values("DENSITY")
                 to_plot["DENSITY_hue"] = to_plot["DENSITY"].astype("float")
                 plot = sns.scatterplot(data=to_plot.loc[to_plot["DENSITY"]<=density_threshold,:], x='i', y='scaled_P',
                        hue=hue,
@@ -702,7 +752,7 @@ def mqqplot(insumstats,
                 s = "s"
                 hue = 'chr_hue'
                 hue_norm=None
-                to_plot = sumstats
+                to_plot = sumstats_to_plot
                 plot = sns.scatterplot(data=to_plot, x='i', y='scaled_P',
                        hue=hue,
                        palette= palette,
@@ -985,6 +1035,11 @@ def mqqplot(insumstats,
                     verbose=verbose,
                     qq_scatter_kwargs=qq_scatter_kwargs,
                     expected_min_mlog10p=expected_min_mlog10p,
+                    decimate=decimate,
+                    decimate_mlog10p=decimate_mlog10p,
+                    decimate_scale=decimate_scale,
+                    _cache=_cache if frame_key is not None else None,
+                    _cache_key=frame_key,
                     log=log
                 )
     
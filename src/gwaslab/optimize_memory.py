@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+from gwaslab.Log import Log
+from gwaslab.fixdata import set_allele_categories
+from gwaslab.vchangestatus import status_to_int
+from gwaslab.vchangestatus import STATUS_DTYPE
+import gc
+
+# compact schema for Sumstats.data
+#   CHR                      : int8 (Int8 if missing values)
+#   POS                      : int32 (Int32 if missing values) ; signed to keep window arithmetic (POS - window) safe
+#   N / N_CASE / N_CONTROL   : int32 (Int32 if missing values) if all values are integers
+#   EA / NEA / REF / ALT     : category with one dictionary shared by EA and NEA
+#   STATUS                   : int32
+#   SNPID / rsID             : string[pyarrow]
+#   BETA / SE / EAF ...      : float32 (optional ; P and MLOG10P are always kept as float64)
+
+FLOAT32_COLUMNS = ["BETA","SE","EAF","MAF","INFO","Z","CHISQ","T","F","OR","OR_95L","OR_95U",
+                   "BETA_95L","BETA_95U","HR","HR_95L","HR_95U","I2","SNPR2","DAF"]
+
+def _smallest_int_dtype(series, candidates):
+    is_na = series.isna()
+    values = series[~is_na]
+    if len(values)>0 and (values != np.floor(values.astype("float64"))).any():
+        return None
+    for dtype in candidates:
+        info = np.iinfo(dtype)
+        if len(values)==0 or (values.min() >= info.min and values.max() <= info.max):
+            if is_na.any():
+                return dtype.capitalize()
+            return dtype
+    return None
+
+def _to_int(sumstats, col, candidates):
+    # only columns that are already numeric (e.g. after fixchr / fixpos)
+    if col not in sumstats.columns or not pd.api.types.is_numeric_dtype(sumstats[col]):
+        return
+    series = sumstats[col]
+    dtype = _smallest_int_dtype(series, candidates)
+    if dtype is not None and str(sumstats[col].dtype)!=dtype:
+        sumstats[col] = series.astype(dtype)
+
+def optimizememory(sumstats, float32=False, arrow_string=True, verbose=True, log=Log()):
+    '''
+    convert sumstats to the compact schema in place and report memory usage per column before and after
+    '''
+    if verbose: log.write("Start to optimize memory usage...")
+    before = sumstats.memory_usage(deep=True, index=False)
+
+    _to_int(sumstats, "CHR", ["int8","int16"])
+    _to_int(sumstats, "POS", ["int32","int64"])
+    for col in ["N","N_CASE","N_CONTROL"]:
+        _to_int(sumstats, col, ["int32","int64"])
+
+    if "EA" in sumstats.columns and "NEA" in sumstats.columns:
+        sumstats = set_allele_categories(sumstats, "EA", "NEA")
+    for col in ["REF","ALT"]:
+        if col in sumstats.columns and not isinstance(sumstats[col].dtype, pd.CategoricalDtype):
+            sumstats[col] = sumstats[col].astype("category")
+
+    if "STATUS" in sumstats.columns and sumstats["STATUS"].dtype != STATUS_DTYPE:
+        sumstats["STATUS"] = status_to_int(sumstats["STATUS"])
+
+    if arrow_string is True:
+        try:
+            import pyarrow
+            for col in ["SNPID","rsID"]:
+                if col in sumstats.columns and sumstats[col].dtype!=pd.StringDtype("pyarrow"):
+                    sumstats[col] = sumstats[col].astype("string[pyarrow]")
+        except ImportError:
+            if verbose: log.write(" -pyarrow is not available: ID columns are kept as they are...")
+
+    if float32 is True:
+        for col in FLOAT32_COLUMNS:
+            if col in sumstats.columns and sumstats[col].dtype=="float64":
+                sumstats[col] = sumstats[col].astype("float32")
+
+    after = sumstats.memory_usage(deep=True, index=False)
+    gc.collect()
+    if verbose:
+        log.write(" -Memory usage per column (MB) :")
+        for col in sumstats.columns:
+            log.write("  -{:<10} {:>10} : {:>9.2f} -> {:>9.2f}".format(col, str(sumstats[col].dtype), before.get(col, 0)/1024**2, after[col]/1024**2))
+        log.write(" -Total : {:.2f} MB -> {:.2f} MB ({:.1f}%)".format(before.sum()/1024**2, after.sum()/1024**2, 100*after.sum()/max(before.sum(),1)))
+        log.write("Finished optimizing memory usage successfully!")
+    return sumstats
@@ -4,9 +4,13 @@ import scipy.stats as ss
 import gzip
 import os
 import gc
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from gwaslab.CommonData import get_format_dict
 from gwaslab.fixdata import sortcolumn
 from gwaslab.datatype_check import check_datatype
+from gwaslab.vchangestatus import status_to_int
+from gwaslab.vchangestatus import STATUS_DTYPE
 
 #20221030
 def preformat(sumstats,
@@ -57,6 +61,14 @@ def preformat(sumstats,
           readargs=None,
           log=None):
 
+    # reader backend : engine="c" (pandas) / "pyarrow" (multithreaded parsing and decompression) ; n_cores : threads for @ files
+    if readargs is None:
+        readargs = {}
+    engine = readargs.pop("engine", "c")
+    n_cores = readargs.pop("n_cores", os.cpu_count())
+    if engine not in ["c","python","pyarrow"]:
+        raise ValueError("engine should be one of c, python or pyarrow.")
+
     #renaming dictionary
     rename_dictionary = {}
     usecols = []
@@ -274,34 +286,39 @@ def preformat(sumstats,
             usecols =  usecols + [study]
  #loading data ##########################################################################################################
     
+    # chunksize in readargs : return a generator of preformatted chunks (see Sumstats.stream)
+    is_chunked = readargs is not None and readargs.get("chunksize") is not None
+    if is_chunked and engine=="pyarrow":
+        raise ValueError("engine=\"pyarrow\" does not support chunksize. Please use engine=\"c\" or \"python\".")
+    
     try:
-        if type(sumstats) is str:
+        if type(sumstats) is str and is_chunked:
+            ## loading data from path chunk by chunk
+            inpath = sumstats
+            if "@" in inpath:
+                if verbose: log.write("Start to initiate from files with pattern in chunks of {} rows :".format(readargs["chunksize"]) + inpath)
+                sumstats = read_chunks(inpath_chr_list, usecols=usecols, dtype_dictionary=dtype_dictionary, readargs=readargs, engine=engine)
+            else:
+                if verbose: log.write("Start to initiate from file in chunks of {} rows :".format(readargs["chunksize"]) + inpath)
+                sumstats = read_chunks([inpath], usecols=usecols, dtype_dictionary=dtype_dictionary, readargs=readargs, engine=engine)
+        elif type(sumstats) is str:
             ## loading data from path
             inpath = sumstats
             if "@" in inpath:
                 if verbose: log.write("Start to initiate from files with pattern :" + inpath)
-                sumstats_chr_list=[]
-                for i in inpath_chr_list:
-                    if verbose: log.write(" -Loading:" + i)
-                    skip_rows = get_skip_rows(i)
-                    readargs["skiprows"] = skip_rows
-                    sumstats_chr = pd.read_table(i,
-                                        usecols=set(usecols),
-                                        dtype=dtype_dictionary,
-                                        **readargs)
-                    sumstats_chr_list.append(sumstats_chr)
+                n_threads = max(min(n_cores, len(inpath_chr_list)),1)
+                if verbose: log.write(" -Loading {} files with {} threads (engine: {})...".format(len(inpath_chr_list), n_threads, engine))
+                read_func = partial(read_sumstats_file, usecols=usecols, dtype_dictionary=dtype_dictionary, readargs=readargs, engine=engine)
+                with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                    sumstats_chr_list = list(executor.map(read_func, inpath_chr_list))
                 if verbose: log.write(" -Merging sumstats for chromosomes:",",".join(inpath_chr_num_list))
                 sumstats = pd.concat(sumstats_chr_list, axis=0, ignore_index=True) 
                 del(sumstats_chr_list)
                 gc.collect()
             else:
-                skip_rows = get_skip_rows(inpath)
-                readargs["skiprows"] = skip_rows
                 if verbose: log.write("Start to initiate from file :" + inpath)
-                sumstats = pd.read_table(inpath,
-                                 usecols=set(usecols),
-                                 dtype=dtype_dictionary,
-                                 **readargs)
+                if verbose and engine!="c": log.write(" -Reading with engine: {}".format(engine))
+                sumstats = read_sumstats_file(inpath, usecols=usecols, dtype_dictionary=dtype_dictionary, readargs=readargs, engine=engine)
 
         elif type(sumstats) is pd.DataFrame:
             ## loading data from dataframe
@@ -314,6 +331,29 @@ def preformat(sumstats,
     except ValueError:
         raise ValueError("Please input a path or a pd.DataFrame, and make sure it contain the columns.")
 
+    postprocess_args = dict(fmt=fmt, usecols=usecols, rename_dictionary=rename_dictionary,
+                            format_cols=format_cols if fmt=="vcf" else None, study=study, vcf_usecols=vcf_usecols if fmt=="vcf" else None,
+                            n=n, ncase=ncase, ncontrol=ncontrol, neaf=neaf, status=status, build=build, log=log)
+    if is_chunked:
+        # only the first chunk is logged
+        return (postprocess_sumstats(chunk, verbose=verbose and i==0, **postprocess_args) for i, chunk in enumerate(sumstats))
+    return postprocess_sumstats(sumstats, verbose=verbose, **postprocess_args)
+
+def read_chunks(inpath_list, usecols, dtype_dictionary, readargs, engine="c"):
+    '''
+    read one or more files (e.g. split by chromosome) chunk by chunk ; readargs must contain chunksize
+    engine : "c" or "python" (pandas readers)
+    '''
+    for inpath in inpath_list:
+        readargs_chunk = readargs.copy()
+        readargs_chunk["skiprows"] = get_skip_rows(inpath)
+        readargs_chunk["engine"] = engine
+        with pd.read_table(inpath, usecols=set(usecols), dtype=dtype_dictionary, **readargs_chunk) as reader:
+            for chunk in reader:
+                yield chunk
+
+def postprocess_sumstats(sumstats, fmt, usecols, rename_dictionary, format_cols, study, vcf_usecols,
+                         n, ncase, ncontrol, neaf, status, build, log, verbose):
     ## renaming columns ###############################################################################################
     if fmt == "vcf":
         sumstats = parse_vcf_study(sumstats,format_cols,study,vcf_usecols,log=log,verbose=verbose)
@@ -340,6 +380,8 @@ def preformat(sumstats,
     ### status ######################################################################################################
     if status is None:
         sumstats = process_status(sumstats=sumstats,build=build,log=log,verbose=verbose)
+    else:
+        sumstats["STATUS"] = status_to_int(sumstats["STATUS"],build=build)
     
     ## ea/nea, ref/alt ##############################################################################################
     sumstats = process_allele(sumstats=sumstats,log=log,verbose=verbose)
@@ -365,20 +407,70 @@ def isfile_casesensitive(path):
 
 def get_readargs_header(inpath,readargs):
     if "vcf.gz" in inpath:
-        with gzip.open(inpath,'r') as file:      
-            skip=0
-            for line in file:        
-                if line.decode('utf-8').startswith('##'):
-                    skip+=1
-                else:
-                    readargs["skiprows"]=skip
-                    readargs["sep"]="\t"
-                    break
+        readargs["skiprows"]=get_skip_rows(inpath)
+        readargs["sep"]="\t"
     readargs_header = readargs.copy()
+    readargs_header.pop("chunksize", None)
     readargs_header["nrows"]=1
     readargs_header["dtype"]="string"
     return readargs_header
 
+def read_sumstats_file(inpath, usecols, dtype_dictionary, readargs, engine="c"):
+    '''
+    read one file with usecols and dtypes applied at parse time
+    engine="pyarrow" : pyarrow.csv (multithreaded, gzip/bgzip decompressed on the reader's I/O thread) ;
+                       falls back to pandas for options pyarrow cannot handle (regex separators, comment, nrows ...)
+    '''
+    readargs = readargs.copy()
+    readargs["skiprows"] = get_skip_rows(inpath)
+    if engine=="pyarrow" and is_pyarrow_readable(readargs):
+        return read_table_pyarrow(inpath, usecols=usecols, dtype_dictionary=dtype_dictionary, readargs=readargs)
+    if engine=="python":
+        readargs["engine"] = "python"
+    return pd.read_table(inpath,
+                         usecols=set(usecols),
+                         dtype=dtype_dictionary,
+                         **readargs)
+
+def is_pyarrow_readable(readargs):
+    try:
+        import pyarrow.csv
+    except ImportError:
+        return False
+    sep = readargs.get("sep", "\t")
+    if sep is None or len(sep)!=1:
+        return False
+    supported = ["sep","skiprows","na_values"]
+    return all(key in supported for key in readargs.keys())
+
+def read_table_pyarrow(inpath, usecols, dtype_dictionary, readargs):
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    usecols = list(dict.fromkeys(usecols))
+    
+    null_values = list(pacsv.ConvertOptions().null_values)
+    na_values = readargs.get("na_values", None)
+    if na_values is not None:
+        if type(na_values) is str:
+            na_values = [na_values]
+        null_values = null_values + [str(i) for i in na_values]
+    
+    column_types = {col:pa.string() for col, dtype in dtype_dictionary.items() if col in usecols and dtype in ["string","category"]}
+    
+    table = pacsv.read_csv(inpath,
+                           read_options=pacsv.ReadOptions(skip_rows=readargs.get("skiprows", 0), use_threads=True),
+                           parse_options=pacsv.ParseOptions(delimiter=readargs.get("sep", "\t")),
+                           convert_options=pacsv.ConvertOptions(include_columns=usecols,
+                                                                column_types=column_types,
+                                                                null_values=null_values,
+                                                                strings_can_be_null=True))
+    sumstats = table.to_pandas()
+    del table
+    for key, value in dtype_dictionary.items():
+        if key in sumstats.columns:
+            sumstats[key] = sumstats[key].astype(value)
+    return sumstats
+
 def get_skip_rows(inpath):
     if "vcf.gz" in inpath:
         with gzip.open(inpath,'r') as file:      
@@ -480,8 +572,6 @@ def process_allele(sumstats,log,verbose):
 
 def process_status(sumstats,build,log,verbose):
     if verbose: log.write(" -Initiating a status column: STATUS ...")
-    #sumstats["STATUS"] = int(build)*(10**5) +99999
-    sumstats["STATUS"] = build +"99999"
-    categories = {str(j+i) for j in [1900000,3800000,9700000,9800000,9900000] for i in range(0,100000)}
-    sumstats["STATUS"] = pd.Categorical(sumstats["STATUS"],categories=categories)
+    sumstats["STATUS"] = int(build)*(10**5) +99999
+    sumstats["STATUS"] = sumstats["STATUS"].astype(STATUS_DTYPE)
     return sumstats
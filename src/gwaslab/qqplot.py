@@ -7,6 +7,8 @@ from gwaslab.Log import Log
 from gwaslab.calculate_gc import lambdaGC
 from math import ceil
 from gwaslab.quickfix import _set_yticklabels
+from gwaslab.quickfix import _get_axes_pixels
+from gwaslab.quickfix import _quick_decimate
 # qq plot module for mqqplot
 def _plot_qq(
     sumstats,
@@ -39,6 +41,11 @@ def _plot_qq(
     ylabels_converted,
     qq_scatter_kwargs,
     expected_min_mlog10p,
+    decimate=False,
+    decimate_mlog10p=2,
+    decimate_scale=1,
+    _cache=None,
+    _cache_key=None,
     verbose=True,
     log=Log()
 ):
@@ -61,16 +68,24 @@ def _plot_qq(
     if stratified is False:
         # sort x,y for qq plot
         # high to low
-        observed = p_toplot.sort_values(ascending=False)
+        # expected / observed arrays are reused from the plot cache of the Sumstats object if available
+        qq_key = None if _cache is None else ("qq", _cache_key, expected_min_mlog10p)
+        if qq_key is not None and qq_key in _cache:
+            expected_all, observed = _cache[qq_key]
+        else:
+            observed = p_toplot.sort_values(ascending=False).values
+            
+            # uniform distribution using raw number -> -log10 -> observed number (omit variants with low -log10p)
+            #expected = -np.log10(np.linspace(minit,1,len(p_toplot_raw)))[:len(observed)]
         
-        # uniform distribution using raw number -> -log10 -> observed number (omit variants with low -log10p)
-        #expected = -np.log10(np.linspace(minit,1,len(p_toplot_raw)))[:len(observed)]
-    
-        expected_all = -np.log10(np.linspace(minit,upper_bound_p,len(p_toplot_raw)))[:len(observed)]
+            expected_all = -np.log10(np.linspace(minit,upper_bound_p,len(p_toplot_raw)))[:len(observed)]
+            if qq_key is not None:
+                _cache[qq_key] = (expected_all, observed)
 
         if verbose:log.write("Expected range of P: (0,{})".format(upper_bound_p))
         #p_toplot = sumstats["scaled_P"]
-        ax2.scatter(expected_all,observed,s=marker_size[1],color=colors[0],**qq_scatter_kwargs)
+        expected_toplot, observed_toplot = _decimate_qq(expected_all, observed, ax2, decimate, decimate_mlog10p, decimate_scale, verbose, log)
+        ax2.scatter(expected_toplot,observed_toplot,s=marker_size[1],color=colors[0],**qq_scatter_kwargs)
 
     else:
         # stratified qq plot
@@ -94,7 +109,8 @@ def _plot_qq(
             expected = -np.log10(np.linspace(minit,upper_bound_p,max(len(databin_raw),len(databin))))[:len(observed)]
 
             label ="("+str(lower)+","+str(upper) +"]"
-            ax2.scatter(expected,observed,s=marker_size[1],color=maf_bin_colors[i],label=label,**qq_scatter_kwargs)
+            expected_toplot, observed_toplot = _decimate_qq(expected, observed.values, ax2, decimate, decimate_mlog10p, decimate_scale, verbose, log)
+            ax2.scatter(expected_toplot,observed_toplot,s=marker_size[1],color=maf_bin_colors[i],label=label,**qq_scatter_kwargs)
             ax2_legend= ax2.legend(loc="best",fontsize=fontsize,markerscale=3,frameon=False)
             plt.setp(ax2_legend.texts, family=font_family)
 
@@ -118,12 +134,19 @@ def _plot_qq(
             if verbose: log.write(" -Level for calculating lambda GC : {}".format(1 - level))
 
         if verbose and not include_chrXYMT : log.write(" -Excluding chrX,Y, MT from calculation of lambda GC.")
-        lambdagc = lambdaGC(p_toplot_raw, 
-                            mode="MLOG10P", 
-                            level=level, 
-                            include_chrXYMT=include_chrXYMT,
-                            log=log,
-                            verbose=True)
+        gc_key = None if _cache is None else ("gc", _cache_key, level, include_chrXYMT)
+        if gc_key is not None and gc_key in _cache:
+            lambdagc = _cache[gc_key]
+            if verbose: log.write(" -Using cached lambda GC : {}".format(lambdagc))
+        else:
+            lambdagc = lambdaGC(p_toplot_raw, 
+                                mode="MLOG10P", 
+                                level=level, 
+                                include_chrXYMT=include_chrXYMT,
+                                log=log,
+                                verbose=True)
+            if gc_key is not None:
+                _cache[gc_key] = lambdagc
         
         # annotate lambda gc to qq plot
         ax2.text(0.10, 1.03,"$\\lambda_{GC}$ = "+"{:.4f}".format(lambdagc),
@@ -186,4 +209,11 @@ def _plot_qq(
     # Creating QQ plot Finished #############################################################################################
     return ax2
 
-
+def _decimate_qq(expected, observed, ax2, decimate, decimate_mlog10p, decimate_scale, verbose=True, log=Log()):
+    # expected and observed values to draw : points below decimate_mlog10p sharing a pixel are only drawn once
+    if decimate is not True:
+        return expected, observed
+    width, height = _get_axes_pixels(ax2, scale=decimate_scale)
+    is_drawn = _quick_decimate(expected, observed, width, height, keep_above=decimate_mlog10p)
+    if verbose:log.write(" -Decimation : drawing {} points , dropping {} points with -log10(P) < {} on a {} x {} pixel grid...".format(np.count_nonzero(is_drawn), len(is_drawn)-np.count_nonzero(is_drawn), decimate_mlog10p, width, height))
+    return expected[is_drawn], observed[is_drawn]
@@ -127,91 +127,92 @@ def _quick_merge_sumstats(sumstats1, sumstats2):
     merged_sumstats = merged_sumstats.drop(labels=["CHR_1", "CHR_2", "POS_1", "POS_2"],axis=1)
     return merged_sumstats
 
+def _quick_sort_chrpos(sumstats, chrom="CHR", pos="POS"):
+    # one stable argsort by CHR and POS (missing values last, as sort_values)
+    chrom_values = sumstats[chrom].to_numpy(dtype="float64", na_value=np.nan)
+    pos_values = sumstats[pos].to_numpy(dtype="float64", na_value=np.nan)
+    if len(pos_values)>0 and np.all(np.isfinite(chrom_values)) and np.all(np.isfinite(pos_values)) \
+        and np.nanmin(chrom_values)>=0 and np.nanmin(pos_values)>=0 and np.nanmax(chrom_values)<2**20 and np.nanmax(pos_values)<2**40:
+        # non-negative integers : sort a single CHR * 2^40 + POS key 
+        key = chrom_values.astype("int64") * 2**40 + pos_values.astype("int64")
+        if np.array_equal(key, chrom_values * 2**40 + pos_values):
+            return sumstats.take(np.argsort(key, kind="stable"))
+    order = np.lexsort((pos_values, chrom_values))
+    return sumstats.take(order)
+
+def _quick_chr_offsets(chrom, pos, pad):
+    # x axis offset of each chromosome, indexed by chromosome number : 
+    # offsets[c] = sum of the max POS of chromosomes < c + pad for each chromosome in 1..c-1 (0 for c=1)
+    max_pos = pos.groupby(chrom).max()
+    max_pos = dict(zip(max_pos.index.astype("int64"), max_pos.values))
+    n_chr = int(chrom.max())
+    cumulative = [max_pos.get(0, 0)]
+    for i in range(1, n_chr+1):
+        cumulative.append(cumulative[i-1] + max_pos.get(i, 0) + pad)
+    offsets = np.zeros(n_chr+1, dtype="float64")
+    offsets[1:] = cumulative[:-1]
+    return offsets
+
+def _quick_chr_starts(chrom, pos):
+    # cumulative sum of the min POS of chromosomes <= c, indexed by chromosome number
+    min_pos = pos.groupby(chrom).min()
+    n_chr = int(chrom.max())
+    starts = np.zeros(n_chr+1, dtype="float64")
+    starts[min_pos.index.astype("int64")] = min_pos.values
+    return np.cumsum(starts)
+
+def _quick_dense_rank(chrom, pos):
+    # dense rank of POS within each chromosome ; chrom and pos sorted by CHR and POS
+    chrom = np.asarray(chrom)
+    pos = np.asarray(pos)
+    is_chr_start = np.ones(len(chrom), dtype="bool")
+    is_chr_start[1:] = chrom[1:]!=chrom[:-1]
+    is_new_pos = is_chr_start.copy()
+    is_new_pos[1:] |= pos[1:]!=pos[:-1]
+    dense = np.cumsum(is_new_pos)
+    chr_start_rank = np.maximum.accumulate(np.where(is_chr_start, dense, 0))
+    return (dense - chr_start_rank + 1).astype("float64")
+
+def _quick_chrom_ticks(sumstats, chrom="CHR"):
+    # for plot, get the chr text tick position  
+    i_range = sumstats.groupby(chrom)["i"].agg(["min","max"])
+    return ((i_range["min"] + i_range["max"])/2).rename("i")
+
 def _quick_assign_i(sumstats, chrom="CHR",pos="POS"):
     # sort by CHR an POS
-    sumstats = sumstats.sort_values([chrom,pos])
+    sumstats = _quick_sort_chrpos(sumstats, chrom=chrom, pos=pos)
     # set new id
     sumstats["_ID"]=range(len(sumstats))
     sumstats = sumstats.set_index("_ID")
-    #create a df , groupby by chromosomes , and get the maximum position
-    posdic = sumstats.groupby(chrom)[pos].max()
-    # convert to dictionary
-    posdiccul = dict(posdic)
-    # fill empty chr with 0
-    for i in range(0,26):
-        if i in posdiccul: 
-            continue
-        else: 
-            posdiccul[i]=0
-    # get interval
+    # chromosome offsets with an interval of 5% of the max POS between chromosomes
     interval_between_chr = sumstats[pos].max()*0.05
-    # cumulative sum dictionary
-    for i in range(1,sumstats[chrom].max()+1):
-        posdiccul[i] =  posdiccul[i-1] + posdiccul[i] + interval_between_chr
-    # convert base pair postion to x axis position using the cumulative sum dictionary
-    sumstats["_ADD"] = sumstats[chrom].apply(lambda x : posdiccul[int(x)-1])
-    sumstats["i"]   = sumstats[pos] + sumstats["_ADD"]
-    # drop add
-    sumstats = sumstats.drop(labels=["_ADD"],axis=1)
-    #for plot, get the chr text tick position  
-    chrom_df=sumstats.groupby(chrom)['i'].agg(lambda x: (x.min()+x.max())/2)
+    offsets = _quick_chr_offsets(sumstats[chrom], sumstats[pos], interval_between_chr)
+    # convert base pair postion to x axis position 
+    chr_index = sumstats[chrom].to_numpy(dtype="int64")
+    sumstats["i"] = sumstats[pos] + offsets[chr_index]
+    chrom_df = _quick_chrom_ticks(sumstats, chrom=chrom)
     # fix dtype for i
     sumstats["i"] = np.floor(pd.to_numeric(sumstats["i"], errors='coerce')).astype('Int64')
     return sumstats, chrom_df
 
 def _quick_assign_i_with_rank(sumstats, chrpad, use_rank=False, chrom="CHR",pos="POS",drop_chr_start=False):
-        sumstats = sumstats.sort_values([chrom,pos])
+        sumstats = _quick_sort_chrpos(sumstats, chrom=chrom, pos=pos)
         if use_rank is True: 
-            sumstats["_POS_RANK"] = sumstats.groupby(chrom)[pos].rank("dense", ascending=True)
+            sumstats["_POS_RANK"] = _quick_dense_rank(sumstats[chrom].values, sumstats[pos].values)
             pos="_POS_RANK"
         sumstats["_ID"]=range(len(sumstats))
         sumstats=sumstats.set_index("_ID")
 
-        #create a df , groupby by chromosomes , and get the maximum position
-        if use_rank is True: 
-            posdic = sumstats.groupby(chrom)["_POS_RANK"].max()
-        else:
-            posdic = sumstats.groupby(chrom)[pos].max()
-                
-        # convert to dictionary
-        posdiccul = dict(posdic)
-        
-        # fill empty chr with 0
-        for i in range(0,sumstats[chrom].max()+1):
-            if i in posdiccul: 
-                continue
-            else: 
-                posdiccul[i]=0
-  
-        # cumulative sum dictionary
-        for i in range(1,sumstats[chrom].max()+1):
-            posdiccul[i]= posdiccul[i-1] + posdiccul[i] + sumstats[pos].max()*chrpad
-
-        # convert base pair postion to x axis position using the cumulative sum dictionary
-        sumstats["_ADD"]=sumstats[chrom].apply(lambda x : posdiccul[int(x)-1])
-        
+        # chromosome offsets (array indexed by chromosome number)
+        offsets = _quick_chr_offsets(sumstats[chrom], sumstats[pos], sumstats[pos].max()*chrpad)
         if drop_chr_start==True:
-                posdic_min =  sumstats.groupby(chrom)[pos].min()
-                posdiccul_min= dict(posdic_min)
-                for i in range(0,sumstats[chrom].max()+1):
-                    if i in posdiccul_min: 
-                        continue
-                    else: 
-                        posdiccul_min[i]=0
-                for i in range(1,sumstats[chrom].max()+1):
-                    posdiccul_min[i]= posdiccul_min[i-1] + posdiccul_min[i]
-                sumstats["_ADD"]=sumstats["_ADD"] - sumstats[chrom].apply(lambda x : posdiccul_min[int(x)])
-            
-        if use_rank is True: 
-            sumstats["i"]=sumstats["_POS_RANK"]+sumstats["_ADD"]
-        else:
-            sumstats["i"]=sumstats[pos]+sumstats["_ADD"]
-        
+            offsets = offsets - _quick_chr_starts(sumstats[chrom], sumstats[pos])
 
-        #for plot, get the chr text tick position      
-        chrom_df=sumstats.groupby(chrom)['i'].agg(lambda x: (x.min()+x.max())/2)
-        #sumstats["i"] = sumstats["i"]+((sumstats[chrom].map(dict(chrom_df)).astype("int")))*0.02
-        #sumstats["i"] = sumstats["i"].astype("Int64")
+        # convert base pair postion to x axis position 
+        chr_index = sumstats[chrom].to_numpy(dtype="int64")
+        sumstats["i"]=sumstats[pos]+offsets[chr_index]
+
+        chrom_df = _quick_chrom_ticks(sumstats, chrom=chrom)
         sumstats["i"] = np.floor(pd.to_numeric(sumstats["i"], errors='coerce')).astype('Int64')
         return sumstats, chrom_df
 
@@ -439,4 +440,45 @@ def _jagged_y(cut,skip,ax1,mode,mqqratio,jagged_len,jagged_wid):
     ax1.plot((x0,-dx), (tycut,tycut+dy), zorder=1001, **kwargs)
     ax1.plot((-dx,+dx), (tycut+dy,tycut+3*dy), zorder=1001, **kwargs)
     ax1.plot((+dx,x0), (tycut+3*dy,tycut+4*dy), zorder=1001,  **kwargs)
-    return ax1
\ No newline at end of file
+    return ax1
+def _quick_checksum(series):
+    # checksum of the values of a column (used to detect in-place edits of plotted columns)
+    # numeric columns : sum and xor of the raw 64-bit values (no hashing) ; other columns : sum of pd.util.hash_array
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.to_numpy(dtype="float64", na_value=np.nan).view("uint64")
+        return (int(values.sum()), int(np.bitwise_xor.reduce(values)) if len(values)>0 else 0)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return (_quick_checksum(pd.Series(series.cat.codes.values)), int(pd.util.hash_array(np.asarray(series.cat.categories, dtype="object")).sum()))
+    return int(pd.util.hash_array(series.astype("string").fillna("").to_numpy(dtype="object")).sum())
+
+def _get_axes_pixels(ax, scale=1):
+    # width and height of the axes in pixels (scale : output dpi / figure dpi)
+    bbox = ax.get_window_extent()
+    return max(int(bbox.width*scale),1), max(int(bbox.height*scale),1)
+
+def _quick_decimate(x, y, width, height, keep_above=2, groups=None):
+    '''
+    boolean mask of points to draw
+    all points with y >= keep_above are drawn ; for the others, only the first point in each pixel of a width x height grid
+    (and in each combination of groups, e.g. color and size) is drawn
+    '''
+    x = pd.to_numeric(pd.Series(x), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    y = pd.to_numeric(pd.Series(y), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    is_drawn = ~(y < keep_above)
+    to_thin = np.flatnonzero(~is_drawn & ~np.isnan(x))
+    if len(to_thin)==0:
+        return is_drawn
+    
+    # pixel grid over the range of all points
+    x_min, x_max = np.nanmin(x), np.nanmax(x)
+    y_min, y_max = np.nanmin(y), np.nanmax(y)
+    cell_x = np.floor((x[to_thin] - x_min) / max(x_max - x_min, 1e-300) * (width - 1)).astype("int64")
+    cell_y = np.floor((y[to_thin] - y_min) / max(y_max - y_min, 1e-300) * (height - 1)).astype("int64")
+    key = cell_x * height + cell_y
+    if groups is not None:
+        for group in groups:
+            codes, uniques = pd.factorize(pd.Series(group).iloc[to_thin], use_na_sentinel=True)
+            key = key * (len(uniques) + 1) + (codes + 1)
+    is_first = ~pd.Series(key).duplicated().to_numpy()
+    is_drawn[to_thin[is_first]] = True
+    return is_drawn
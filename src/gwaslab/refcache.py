@@ -0,0 +1,741 @@
+import os
+import re
+import gc
+import gzip
+import json
+import hashlib
+import shutil
+import numpy as np
+import pandas as pd
+from os import path
+from pysam import VariantFile
+from Bio import SeqIO
+from gwaslab.Log import Log
+from gwaslab.config import options
+from gwaslab.CommonData import get_chr_to_number
+from gwaslab.CommonData import get_chr_list
+from gwaslab.download import get_path
+from gwaslab.download import update_record
+from gwaslab.download import get_default_directory
+from gwaslab.variantkey import MISSING_KEY
+from gwaslab.variantkey import pack_variant_key
+from gwaslab.variantkey import parse_snpid
+from gwaslab.variantkey import POS_BITS
+from gwaslab.variantkey import ALLELE_BITS
+
+#### reference cache ###################################################################################
+# build_reference_cache(name) converts a downloaded reference file once into a memory-mapped layout
+# (one set of .npy files per chromosome) + meta.json
+#
+# fasta : {chr}.seq.npy                                    uint8 upper-case sequence
+# vcf   : {chr}.pos.npy                                    int32 positions (one row per ALT allele)
+#         {chr}.ref.npy / {chr}.ref_offsets.npy            packed REF alleles (bytes + offsets)
+#         {chr}.alt.npy / {chr}.alt_offsets.npy            packed ALT alleles (bytes + offsets)
+#         {chr}.af.npy                                     float32 allele frequency of ALT (NaN if not available)
+#         {chr}.rsn.npy                                    int64 rsID number (-1 if not rsID)
+# vcf / tsv :
+#         rsid.rsn.npy / rsid.chr.npy / rsid.pos.npy       rsID numbers (uint32 ; int64 if > 2^32-1) sorted for searchsorted lookup
+#                                                          + int8 CHR and int32 POS in the same order
+# rsid  : rsid.*.npy only (built by build_rsid_index from a vcf or tsv ; {name}_rsid_cache)
+# variant : variant.key.npy / variant.rsn.npy             packed CHR:POS:REF:ALT keys (uint64, sorted) and rsID numbers
+#           variant.ref.npy / variant.ref_offsets.npy      packed REF / ALT alleles in the same order (the allele part of the key
+#           variant.alt.npy / variant.alt_offsets.npy      is a hash : matches are confirmed on the alleles)
+#                                                          (built by build_variant_index from a vcf or tsv ; {name}_variant_cache)
+#
+# the cache is versioned by the md5 of the source file and registered in config.json as {name}_cache
+# source file size and modification time are checked before the cache is used
+########################################################################################################
+
+CACHE_VERSION = 1
+
+def seq_to_uint8(seq):
+    '''
+    convert a sequence string to an upper-case uint8 (ASCII) array
+    '''
+    seq_array = np.frombuffer(seq.encode("ascii",errors="replace"), dtype=np.uint8)
+    is_lower = (seq_array>=97) & (seq_array<=122)
+    return np.where(is_lower, seq_array - 32, seq_array).astype(np.uint8)
+
+def get_md5(file_path):
+    md5_hash = hashlib.md5()
+    with open(file_path,"rb") as f:
+        for byte_block in iter(lambda: f.read(4096*1000),b""):
+            md5_hash.update(byte_block)
+    return str(md5_hash.hexdigest())
+
+def infer_reference_type(ref_path):
+    if re.search(r"\.(fa|fasta|fna)(\.gz)?$", ref_path, flags=re.IGNORECASE):
+        return "fasta"
+    if re.search(r"\.(tsv|txt|csv)(\.gz)?$", ref_path, flags=re.IGNORECASE):
+        return "tsv"
+    # vcf / vcf.gz and bcf (binary, read through pysam)
+    return "vcf"
+
+def _is_bcf(ref_path):
+    return re.search(r"\.bcf$", ref_path, flags=re.IGNORECASE) is not None
+
+def _read_vcf_chunks(ref_path, names, dtype, chunksize=5000000):
+    '''
+    yield the first len(names) columns (CHROM POS ID REF ALT) of a vcf in chunks of chunksize records
+    vcf / vcf.gz are read as text ; bcf is binary and read through pysam.VariantFile
+    '''
+    if not _is_bcf(ref_path):
+        yield from pd.read_csv(ref_path, sep="\t", header=None, usecols=list(range(len(names))), comment="#", chunksize=chunksize,
+                               names=names, dtype=dtype)
+        return
+    vcf_reader = VariantFile(ref_path)
+    rows=[]
+    for record in vcf_reader:
+        alts = ",".join(record.alts) if record.alts is not None else "."
+        rows.append((record.contig, record.pos, record.id if record.id is not None else ".", record.ref, alts)[:len(names)])
+        if len(rows)>=chunksize:
+            yield pd.DataFrame(rows, columns=names).astype(dtype)
+            rows=[]
+    vcf_reader.close()
+    if len(rows)>0:
+        yield pd.DataFrame(rows, columns=names).astype(dtype)
+
+def _chr_to_number(contig, chr_dict=get_chr_to_number()):
+    record_chr = str(contig).strip("chrCHR").upper()
+    if record_chr in chr_dict.keys():
+        return record_chr, chr_dict[record_chr]
+    return record_chr, record_chr
+
+def _safe_name(contig):
+    return re.sub(r"[^\w\.]","_",str(contig))
+
+def _pack_alleles(alleles):
+    '''
+    pack a list of strings into a uint8 buffer + int64 offsets
+    '''
+    lengths = np.fromiter((len(i) for i in alleles), dtype="int64", count=len(alleles))
+    offsets = np.zeros(len(alleles)+1, dtype="int64")
+    np.cumsum(lengths, out=offsets[1:])
+    buffer = np.frombuffer("".join(alleles).encode("ascii",errors="replace"), dtype=np.uint8)
+    return buffer, offsets
+
+def _unpack_alleles(buffer, offsets, idx):
+    buffer = np.asarray(buffer)
+    return np.array([buffer[offsets[i]:offsets[i+1]].tobytes().decode("ascii") for i in idx], dtype="object")
+
+def _alleles_equal(buffer, offsets, idx, query_buffer, query_offsets):
+    '''
+    boolean array : whether packed allele idx[k] equals the k-th packed query allele
+    '''
+    offsets = np.asarray(offsets)
+    start = offsets[idx]
+    length = offsets[np.asarray(idx)+1] - start
+    query_length = np.diff(query_offsets)
+    is_equal = length==query_length
+    # compare the bytes of the alleles with equal lengths
+    row = np.repeat(np.arange(len(idx)), np.where(is_equal, length, 0))
+    within = np.arange(len(row)) - np.repeat(np.cumsum(np.where(is_equal, length, 0)) - np.where(is_equal, length, 0), np.where(is_equal, length, 0))
+    is_same_byte = np.asarray(buffer)[start[row] + within] == query_buffer[query_offsets[row] + within]
+    mismatches = np.bincount(row, weights=~is_same_byte, minlength=len(idx))
+    return is_equal & (mismatches==0)
+
+def _take_alleles(buffer, offsets, idx):
+    '''
+    packed alleles idx of packed alleles (buffer + offsets) ; return buffer, offsets
+    '''
+    offsets = np.asarray(offsets)
+    idx = np.asarray(idx, dtype="int64")
+    start = offsets[idx]
+    length = offsets[idx+1] - start
+    new_offsets = np.zeros(len(idx)+1, dtype="int64")
+    np.cumsum(length, out=new_offsets[1:])
+    within = np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1], length)
+    return np.asarray(buffer)[np.repeat(start, length) + within], new_offsets
+
+def _rsid_to_number(rsid):
+    rsn = pd.to_numeric(pd.Series(rsid,dtype="string").str.extract(r'^rs([0-9]+)$',expand=False), errors="coerce")
+    return rsn.fillna(-1).astype("int64").values
+
+def _save_rsid_index(cache_dir, rsn, chrom, pos):
+    is_rs = rsn>=0
+    rsn, chrom, pos = rsn[is_rs], chrom[is_rs], pos[is_rs]
+    order = np.argsort(rsn, kind="stable")
+    rsn_dtype = "uint32" if len(rsn)==0 or rsn.max() <= np.iinfo("uint32").max else "int64"
+    np.save(path.join(cache_dir,"rsid.rsn.npy"), rsn[order].astype(rsn_dtype))
+    np.save(path.join(cache_dir,"rsid.chr.npy"), chrom[order].astype("int8"))
+    np.save(path.join(cache_dir,"rsid.pos.npy"), pos[order].astype("int32"))
+    return len(rsn)
+
+#### parts ##############################################################################################
+# large references are converted in parts (one chunk of one chromosome) written to {cache_dir}/parts
+# parts are merged one chromosome at a time : no step keeps the alleles of the whole reference in memory
+
+def _new_part_dir(cache_dir):
+    part_dir = path.join(cache_dir, "parts")
+    if path.exists(part_dir):
+        shutil.rmtree(part_dir)
+    os.makedirs(part_dir)
+    return part_dir
+
+def _save_part(prefix, arrays, alleles):
+    '''
+    arrays : {name: array} ; alleles : {name: (buffer, offsets)} ; saved as prefix.{name}.npy (+ prefix.{name}_offsets.npy)
+    '''
+    for name, array in arrays.items():
+        np.save(prefix+".{}.npy".format(name), array)
+    for name, (buffer, offsets) in alleles.items():
+        np.save(prefix+".{}.npy".format(name), buffer)
+        np.save(prefix+".{}_offsets.npy".format(name), offsets)
+
+def _load_parts(prefixes, array_names, allele_names):
+    '''
+    concatenate parts in memory ; alleles are returned as (buffer, offsets)
+    '''
+    data = {}
+    for name in array_names:
+        data[name] = np.concatenate([np.load(prefix+".{}.npy".format(name)) for prefix in prefixes])
+    for name in allele_names:
+        buffers = [np.load(prefix+".{}.npy".format(name)) for prefix in prefixes]
+        offsets = [np.load(prefix+".{}_offsets.npy".format(name)) for prefix in prefixes]
+        shifts = np.cumsum([0] + [len(buffer) for buffer in buffers])
+        data[name] = (np.concatenate(buffers).astype("uint8"),
+                      np.concatenate([np.zeros(1, dtype="int64")] + [offset[1:] + shift for offset, shift in zip(offsets, shifts)]))
+    return data
+
+def _write_concatenated(file_path, arrays, dtype, shifts=None):
+    # write arrays one at a time into a single .npy file ; shifts are added to the arrays (allele offsets)
+    total = sum(len(array) for array in arrays)
+    if total==0:
+        np.save(file_path, np.zeros(0, dtype=dtype))
+        return
+    out = np.lib.format.open_memmap(file_path, mode="w+", dtype=dtype, shape=(total,))
+    start = 0
+    for k, array in enumerate(arrays):
+        out[start:start+len(array)] = array if shifts is None else np.asarray(array) + shifts[k]
+        start += len(array)
+    out.flush()
+    del out
+
+def _concatenate_parts(prefixes, out_prefix, dtypes, allele_names):
+    '''
+    write the parts in order to out_prefix.{name}.npy, reading one part at a time ; return the number of rows
+    dtypes : {name: dtype} of the arrays
+    '''
+    n = 0
+    for name, dtype in dtypes.items():
+        arrays = [np.load(prefix+".{}.npy".format(name), mmap_mode="r") for prefix in prefixes]
+        _write_concatenated(out_prefix+".{}.npy".format(name), arrays, dtype)
+        n = sum(len(array) for array in arrays)
+    for name in allele_names:
+        buffers = [np.load(prefix+".{}.npy".format(name), mmap_mode="r") for prefix in prefixes]
+        offsets = [np.load(prefix+".{}_offsets.npy".format(name), mmap_mode="r") for prefix in prefixes]
+        shifts = np.cumsum([0] + [len(buffer) for buffer in buffers])
+        _write_concatenated(out_prefix+".{}.npy".format(name), buffers, "uint8")
+        _write_concatenated(out_prefix+".{}_offsets.npy".format(name), [np.zeros(1, dtype="int64")] + [offset[1:] for offset in offsets],
+                            "int64", shifts=np.concatenate([[0], shifts[:-1]]))
+    return n
+
+#### build ##############################################################################################
+
+def build_reference_cache(name, directory=None, ref_type=None, ref_alt_freq="AF", rsid_index=True,
+                          ref_rsid="rsID", ref_chr="CHR", ref_pos="POS", chunksize=5000000,
+                          overwrite=False, verbose=True, log=Log()):
+    '''
+    Convert a downloaded reference file (fasta / vcf / rsID tsv) into a memory-mapped per-chromosome cache.
+    name : keyword of a downloaded reference file (or a path to a reference file).
+    The cache is registered in config.json as {name}_cache.
+    '''
+    ref_path = get_path(name, verbose=False)
+    if ref_path is False:
+        if path.exists(name):
+            ref_path = name
+        else:
+            raise ValueError("{} is not a downloaded reference or an existing file. Please download it first.".format(name))
+        name = path.basename(name)
+    ref_path = path.abspath(ref_path)
+    if ref_type is None:
+        ref_type = infer_reference_type(ref_path)
+
+    if verbose: log.write("Start to build reference cache for {} ...".format(name))
+    if verbose: log.write(" -Reference file: {}".format(ref_path))
+    if verbose: log.write(" -Reference type: {}".format(ref_type))
+    if verbose: log.write(" -Calculating md5sum...")
+    md5sum = get_md5(ref_path)
+    if verbose: log.write(" -MD5: {}".format(md5sum))
+
+    if directory is None:
+        directory = path.join(get_default_directory(), "cache")
+    cache_dir = path.join(directory, "{}_{}".format(_safe_name(path.basename(ref_path)), md5sum[:10]))
+
+    meta_path = path.join(cache_dir,"meta.json")
+    if path.exists(meta_path) and overwrite is False:
+        meta = json.load(open(meta_path))
+        if meta.get("version")==CACHE_VERSION and meta.get("md5")==md5sum:
+            if verbose: log.write(" -Cache exists : {}".format(cache_dir))
+            _register_cache(name, cache_dir, ref_path, meta, log)
+            if verbose: log.write("Finished building reference cache!")
+            return cache_dir
+
+    if not path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    if verbose: log.write(" -Cache directory: {}".format(cache_dir))
+
+    meta={"version":CACHE_VERSION,
+          "type":ref_type,
+          "source":ref_path,
+          "md5":md5sum,
+          "chromosomes":{}}
+
+    if ref_type=="fasta":
+        _build_fasta_cache(ref_path, cache_dir, meta, verbose=verbose, log=log)
+    elif ref_type=="vcf":
+        _build_vcf_cache(ref_path, cache_dir, meta, ref_alt_freq=ref_alt_freq, rsid_index=rsid_index, chunksize=chunksize, verbose=verbose, log=log)
+    elif ref_type=="tsv":
+        _build_tsv_cache(ref_path, cache_dir, meta, ref_rsid=ref_rsid, ref_chr=ref_chr, ref_pos=ref_pos, chunksize=chunksize, verbose=verbose, log=log)
+    else:
+        raise ValueError("ref_type should be one of fasta, vcf and tsv.")
+
+    _register_cache(name, cache_dir, ref_path, meta, log)
+    gc.collect()
+    if verbose: log.write("Finished building reference cache!")
+    return cache_dir
+
+def build_rsid_index(name, directory=None, ref_rsid="rsID", ref_chr="CHR", ref_pos="POS", chunksize=5000000,
+                     overwrite=False, verbose=True, log=Log()):
+    '''
+    Build only the sorted rsID -> CHR:POS index (rsid.rsn.npy / rsid.chr.npy / rsid.pos.npy) from a vcf or a rsID tsv.
+    name : keyword of a downloaded reference file (or a path to a reference file).
+    The index is registered in config.json as {name}_rsid_cache and used by rsid_to_chrpos(path=...).
+    '''
+    def builder(ref_path, source_type, cache_dir, meta):
+        if source_type=="vcf":
+            _build_vcf_rsid_index(ref_path, cache_dir, meta, chunksize=chunksize, verbose=verbose, log=log)
+        else:
+            _build_tsv_cache(ref_path, cache_dir, meta, ref_rsid=ref_rsid, ref_chr=ref_chr, ref_pos=ref_pos, chunksize=chunksize, verbose=verbose, log=log)
+    return _build_index(name, "rsid", "rsID index", builder, directory=directory, overwrite=overwrite, verbose=verbose, log=log)
+
+def build_variant_index(name, directory=None, ref_snpid="SNPID", ref_rsid="rsID", chunksize=5000000,
+                        overwrite=False, verbose=True, log=Log()):
+    '''
+    Build a sorted CHR:POS:REF:ALT -> rsID index (variant.key.npy / variant.rsn.npy) from a vcf (CHROM POS ID REF ALT)
+    or a SNPID-rsID tsv (SNPID as chr:pos:ref:alt). Keys are packed 64-bit variant keys (gwaslab.variantkey).
+    name : keyword of a downloaded reference file (or a path to a reference file).
+    The index is registered in config.json as {name}_variant_cache and used by assign_rsid(ref_rsid_tsv=...).
+    '''
+    def builder(ref_path, source_type, cache_dir, meta):
+        _build_variant_index(ref_path, source_type, cache_dir, meta, ref_snpid=ref_snpid, ref_rsid=ref_rsid,
+                             chunksize=chunksize, verbose=verbose, log=log)
+    return _build_index(name, "variant", "variant index", builder, directory=directory, overwrite=overwrite, verbose=verbose, log=log)
+
+def _build_index(name, index_type, description, builder, directory=None, overwrite=False, verbose=True, log=Log()):
+    ref_path = get_path(name, verbose=False)
+    if ref_path is False:
+        if path.exists(name):
+            ref_path = name
+        else:
+            raise ValueError("{} is not a downloaded reference or an existing file. Please download it first.".format(name))
+        name = path.basename(name)
+    ref_path = path.abspath(ref_path)
+    source_type = infer_reference_type(ref_path)
+    if source_type not in ["vcf","tsv"]:
+        raise ValueError("{} can only be built from a vcf or a tsv file.".format(description))
+
+    if verbose: log.write("Start to build {} for {} ...".format(description, name))
+    if verbose: log.write(" -Reference file: {}".format(ref_path))
+    if verbose: log.write(" -Calculating md5sum...")
+    md5sum = get_md5(ref_path)
+
+    if directory is None:
+        directory = path.join(get_default_directory(), "cache")
+    cache_dir = path.join(directory, "{}_{}_{}".format(_safe_name(path.basename(ref_path)), md5sum[:10], index_type))
+
+    meta_path = path.join(cache_dir,"meta.json")
+    if path.exists(meta_path) and overwrite is False:
+        meta = json.load(open(meta_path))
+        if meta.get("version")==CACHE_VERSION and meta.get("md5")==md5sum:
+            if verbose: log.write(" -Index exists : {}".format(cache_dir))
+            _register_cache(name, cache_dir, ref_path, meta, log, suffix="_{}_cache".format(index_type))
+            if verbose: log.write("Finished building {}!".format(description))
+            return cache_dir
+
+    if not path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    if verbose: log.write(" -Index directory: {}".format(cache_dir))
+
+    meta={"version":CACHE_VERSION,
+          "type":index_type,
+          "source":ref_path,
+          "md5":md5sum,
+          "chromosomes":{}}
+    builder(ref_path, source_type, cache_dir, meta)
+
+    _register_cache(name, cache_dir, ref_path, meta, log, suffix="_{}_cache".format(index_type))
+    gc.collect()
+    if verbose: log.write("Finished building {}!".format(description))
+    return cache_dir
+
+def _register_cache(name, cache_dir, ref_path, meta, log, suffix="_cache"):
+    meta["size"] = path.getsize(ref_path)
+    meta["mtime"] = path.getmtime(ref_path)
+    with open(path.join(cache_dir,"meta.json"), 'w') as f:
+        json.dump(meta,f,indent=4)
+    update_record(name+suffix, cache_dir, log=log)
+
+def _build_fasta_cache(ref_path, cache_dir, meta, verbose=True, log=Log()):
+    chromlist = get_chr_list(add_number=True)
+    if ref_path.endswith(".gz"):
+        handle = gzip.open(ref_path,"rt")
+    else:
+        handle = open(ref_path,"r")
+    if verbose: log.write(" -Converting sequences: ", end="")
+    for record in SeqIO.parse(handle, "fasta"):
+        record_chr, i = _chr_to_number(record.id)
+        if i not in chromlist:
+            continue
+        if verbose: log.write(record_chr," ", end="",show_time=False)
+        seq = seq_to_uint8(str(record.seq))
+        np.save(path.join(cache_dir, "{}.seq.npy".format(_safe_name(record.id))), seq)
+        meta["chromosomes"][record.id] = {"chr":i, "name":record_chr, "length":len(seq)}
+        del seq
+        gc.collect()
+    handle.close()
+    if verbose: log.write("\n",end="",show_time=False)
+
+def _build_vcf_cache(ref_path, cache_dir, meta, ref_alt_freq="AF", rsid_index=True, chunksize=5000000, verbose=True, log=Log()):
+    vcf_reader = VariantFile(ref_path)
+    if ref_alt_freq is not None and ref_alt_freq not in vcf_reader.header.info.keys():
+        if verbose: log.write(" -{} is not in INFO. Allele frequency will not be cached.".format(ref_alt_freq))
+        ref_alt_freq = None
+    meta["af_field"] = ref_alt_freq
+
+    rsid_rsn=[]
+    rsid_chr=[]
+    rsid_pos=[]
+    part_dir = _new_part_dir(cache_dir)
+    # contig -> parts in file order ; a contig seen again later in the file (not contiguous) gets more parts
+    parts = {}
+
+    def flush(contig, r_pos, r_ref, r_alt, r_af, r_id):
+        if contig is None or len(r_pos)==0:
+            return
+        contig_parts = parts.setdefault(contig, [])
+        prefix = path.join(part_dir, "{}.{}".format(_safe_name(contig), len(contig_parts)))
+        pos_array = np.array(r_pos, dtype="int32")
+        rsn = _rsid_to_number(r_id)
+        _save_part(prefix, {"pos":pos_array, "af":np.array(r_af, dtype="float32"), "rsn":rsn},
+                           {"ref":_pack_alleles(r_ref), "alt":_pack_alleles(r_alt)})
+        contig_parts.append(prefix)
+        record_chr, i = _chr_to_number(contig)
+        if rsid_index is True and isinstance(i, int):
+            rsid_rsn.append(rsn)
+            rsid_chr.append(np.full(len(rsn), i, dtype="int8"))
+            rsid_pos.append(pos_array)
+        gc.collect()
+
+    if verbose: log.write(" -Converting records: ", end="")
+    contig = None
+    r_pos, r_ref, r_alt, r_af, r_id = [],[],[],[],[]
+    for record in vcf_reader.fetch():
+        if record.chrom != contig or len(r_pos) >= chunksize:
+            flush(contig, r_pos, r_ref, r_alt, r_af, r_id)
+            contig = record.chrom
+            r_pos, r_ref, r_alt, r_af, r_id = [],[],[],[],[]
+        alts = record.alts
+        if alts is None:
+            continue
+        if ref_alt_freq is not None:
+            af = record.info.get(ref_alt_freq)
+            if not isinstance(af, tuple):
+                af = (af,)*len(alts)
+        for j, alt in enumerate(alts):
+            r_pos.append(record.pos)
+            r_ref.append(record.ref)
+            r_alt.append(alt)
+            if ref_alt_freq is not None and j < len(af) and af[j] is not None:
+                r_af.append(af[j])
+            else:
+                r_af.append(np.nan)
+            r_id.append(record.id)
+    flush(contig, r_pos, r_ref, r_alt, r_af, r_id)
+    vcf_reader.close()
+
+    for contig, contig_parts in parts.items():
+        record_chr, i = _chr_to_number(contig)
+        n = _concatenate_parts(contig_parts, path.join(cache_dir, _safe_name(contig)),
+                               {"pos":"int32", "af":"float32", "rsn":"int64"}, ["ref","alt"])
+        meta["chromosomes"][contig] = {"chr":i, "name":record_chr, "records":n}
+        if verbose: log.write(record_chr," ", end="",show_time=False)
+    shutil.rmtree(part_dir)
+    if verbose: log.write("\n",end="",show_time=False)
+
+    if rsid_index is True and len(rsid_rsn)>0:
+        n = _save_rsid_index(cache_dir, np.concatenate(rsid_rsn), np.concatenate(rsid_chr), np.concatenate(rsid_pos))
+        meta["rsid_index"] = True
+        if verbose: log.write(" -Indexed {} rsIDs...".format(n))
+
+def _build_vcf_rsid_index(ref_path, cache_dir, meta, chunksize=5000000, verbose=True, log=Log()):
+    # only CHROM / POS / ID are needed : read the vcf as text instead of parsing records with pysam (except for bcf)
+    chr_dict = get_chr_to_number()
+    rsid_rsn=[]
+    rsid_chr=[]
+    rsid_pos=[]
+    if verbose: log.write(" -Loading block: ",end="")
+    for i, dic in enumerate(_read_vcf_chunks(ref_path, names=["CHR","POS","ID"], dtype={"CHR":"string","POS":"Int64","ID":"string"},
+                                             chunksize=chunksize)):
+        if verbose: log.write(i," ",end=" ",show_time=False)
+        chrom = dic["CHR"].str.strip("chrCHR").str.upper().map(chr_dict)
+        is_valid = chrom.notna() & dic["POS"].notna()
+        rsid_rsn.append(_rsid_to_number(dic.loc[is_valid,"ID"]))
+        rsid_chr.append(chrom[is_valid].astype("int8").values)
+        rsid_pos.append(dic.loc[is_valid,"POS"].astype("int64").values)
+    if verbose: log.write("\n",end="",show_time=False)
+    n = _save_rsid_index(cache_dir, np.concatenate(rsid_rsn), np.concatenate(rsid_chr), np.concatenate(rsid_pos))
+    meta["rsid_index"] = True
+    if verbose: log.write(" -Indexed {} rsIDs...".format(n))
+
+def _build_variant_index(ref_path, source_type, cache_dir, meta, ref_snpid="SNPID", ref_rsid="rsID", chunksize=5000000, verbose=True, log=Log()):
+    chr_dict = get_chr_to_number()
+    part_dir = _new_part_dir(cache_dir)
+    # chromosome number -> parts in file order
+    parts = {}
+    if source_type=="vcf":
+        chunks = _read_vcf_chunks(ref_path, names=["CHR","POS","ID","REF","ALT"], dtype="string", chunksize=chunksize)
+    else:
+        chunks = pd.read_csv(ref_path, sep="\t", usecols=[ref_snpid,ref_rsid], chunksize=chunksize, dtype="string")
+    if verbose: log.write(" -Loading block: ",end="")
+    for i, dic in enumerate(chunks):
+        if verbose: log.write(i," ",end=" ",show_time=False)
+        if source_type=="vcf":
+            # one row per ALT allele
+            dic["ALT"] = dic["ALT"].str.split(",")
+            dic = dic.explode("ALT")
+            chrom = dic["CHR"].str.strip("chrCHR").str.upper().map(chr_dict)
+            ref, alt = dic["REF"], dic["ALT"]
+            key = pack_variant_key(chrom, dic["POS"], ref, alt)
+            rsn = _rsid_to_number(dic["ID"])
+        else:
+            chrom, pos, ref, alt = parse_snpid(dic[ref_snpid], chr_dict=chr_dict)
+            key = pack_variant_key(chrom, pos, ref, alt)
+            rsn = _rsid_to_number(dic[ref_rsid])
+        is_valid = (key!=MISSING_KEY) & (rsn>=0)
+        key, rsn = key[is_valid], rsn[is_valid]
+        ref = pd.Series(ref).astype("string").str.upper().to_numpy(dtype="object")[is_valid]
+        alt = pd.Series(alt).astype("string").str.upper().to_numpy(dtype="object")[is_valid]
+        # the chromosome is the top bits of the key
+        key_chr = (key >> np.uint64(POS_BITS + ALLELE_BITS)).astype("int64")
+        for chr_number in np.unique(key_chr):
+            is_chr = key_chr==chr_number
+            chr_parts = parts.setdefault(chr_number, [])
+            prefix = path.join(part_dir, "{}.{}".format(chr_number, len(chr_parts)))
+            _save_part(prefix, {"key":key[is_chr], "rsn":rsn[is_chr]},
+                               {"ref":_pack_alleles(ref[is_chr]), "alt":_pack_alleles(alt[is_chr])})
+            chr_parts.append(prefix)
+        del dic, key, rsn, ref, alt
+        gc.collect()
+    if verbose: log.write("\n",end="",show_time=False)
+
+    # sort and deduplicate one chromosome at a time ; keys sort by CHR first, so the chromosomes are concatenated in key order
+    chr_prefixes = []
+    n_removed = 0
+    rsn_max = 0
+    for chr_number in sorted(parts.keys()):
+        data = _load_parts(parts[chr_number], ["key","rsn"], ["ref","alt"])
+        order = np.lexsort((data["rsn"], data["key"]))
+        key, rsn = data["key"][order], data["rsn"][order]
+        ref = _take_alleles(*data["ref"], order)
+        alt = _take_alleles(*data["alt"], order)
+        del data, order
+        # keys assigned to more than one rsID (or to different alleles) are ambiguous and dropped
+        is_same = (key[1:]==key[:-1]) & (rsn[1:]==rsn[:-1])
+        same_idx = np.flatnonzero(is_same)
+        for buffer, offsets in [ref, alt]:
+            previous_buffer, previous_offsets = _take_alleles(buffer, offsets, same_idx)
+            is_same[same_idx] = is_same[same_idx] & _alleles_equal(buffer, offsets, same_idx+1, previous_buffer, previous_offsets)
+        is_first = np.concatenate([[True], ~is_same])
+        key, rsn = key[is_first], rsn[is_first]
+        ref_idx = np.flatnonzero(is_first)
+        is_unique = np.ones(len(key), dtype="bool")
+        is_unique[1:] = key[1:]!=key[:-1]
+        is_unique[:-1] &= key[:-1]!=key[1:]
+        n_removed += int((~is_unique).sum())
+        keep_idx = ref_idx[is_unique]
+        prefix = path.join(part_dir, "chr{}".format(chr_number))
+        _save_part(prefix, {"key":key[is_unique], "rsn":rsn[is_unique]},
+                           {"ref":_take_alleles(*ref, keep_idx), "alt":_take_alleles(*alt, keep_idx)})
+        if is_unique.any():
+            rsn_max = max(rsn_max, int(rsn[is_unique].max()))
+        chr_prefixes.append(prefix)
+        del key, rsn, ref, alt
+        gc.collect()
+    if verbose: log.write(" -Removed {} variants with more than one rsID...".format(n_removed))
+
+    rsn_dtype = "uint32" if rsn_max <= np.iinfo("uint32").max else "int64"
+    n = _concatenate_parts(chr_prefixes, path.join(cache_dir,"variant"), {"key":"uint64", "rsn":rsn_dtype}, ["ref","alt"])
+    shutil.rmtree(part_dir)
+    meta["variant_index"] = True
+    if verbose: log.write(" -Indexed {} variants...".format(n))
+
+def _build_tsv_cache(ref_path, cache_dir, meta, ref_rsid="rsID", ref_chr="CHR", ref_pos="POS", chunksize=5000000, verbose=True, log=Log()):
+    chr_dict = get_chr_to_number()
+    rsid_rsn=[]
+    rsid_chr=[]
+    rsid_pos=[]
+    if verbose: log.write(" -Loading block: ",end="")
+    for i, dic in enumerate(pd.read_csv(ref_path, sep="\t", usecols=[ref_rsid,ref_chr,ref_pos], chunksize=chunksize,
+                                        dtype={ref_rsid:"string",ref_chr:"string",ref_pos:"Int64"})):
+        if verbose: log.write(i," ",end=" ",show_time=False)
+        chrom = dic[ref_chr].str.strip("chrCHR").str.upper().map(chr_dict)
+        is_valid = chrom.notna() & dic[ref_pos].notna()
+        rsid_rsn.append(_rsid_to_number(dic.loc[is_valid,ref_rsid]))
+        rsid_chr.append(chrom[is_valid].astype("int8").values)
+        rsid_pos.append(dic.loc[is_valid,ref_pos].astype("int64").values)
+    if verbose: log.write("\n",end="",show_time=False)
+    n = _save_rsid_index(cache_dir, np.concatenate(rsid_rsn), np.concatenate(rsid_chr), np.concatenate(rsid_pos))
+    meta["rsid_index"] = True
+    if verbose: log.write(" -Indexed {} rsIDs...".format(n))
+
+#### use ################################################################################################
+
+def get_cache_dir(ref_path, ref_type=None, verbose=True, log=Log()):
+    '''
+    Return the cache directory registered for ref_path, or None if there is no valid cache.
+    '''
+    if ref_path is None:
+        return None
+    config_path = options.paths["config"]
+    if not path.exists(config_path):
+        return None
+    try:
+        dicts = json.load(open(config_path))["downloaded"]
+    except:
+        return None
+    ref_path = path.abspath(ref_path)
+    for key, cache_dir in dicts.items():
+        if not key.endswith("_cache"):
+            continue
+        meta_path = path.join(cache_dir,"meta.json")
+        if not path.exists(meta_path):
+            continue
+        meta = json.load(open(meta_path))
+        if meta.get("source") != ref_path:
+            continue
+        if ref_type is not None and meta.get("type") != ref_type:
+            continue
+        if meta.get("version")!=CACHE_VERSION or meta.get("size")!=path.getsize(ref_path) or meta.get("mtime")!=path.getmtime(ref_path):
+            if verbose: log.write(" -Reference cache {} is outdated. Please run build_reference_cache() again.".format(cache_dir))
+            continue
+        return cache_dir
+    return None
+
+def get_rsid_index_dir(ref_path, verbose=True, log=Log()):
+    '''
+    Return a directory with an rsID index for ref_path : ref_path itself if it is an index directory,
+    otherwise the registered cache / rsID index of ref_path (None if there is none).
+    '''
+    if ref_path is None:
+        return None
+    if path.isdir(ref_path):
+        if path.exists(path.join(ref_path,"rsid.rsn.npy")):
+            return ref_path
+        return None
+    for ref_type in ["rsid","vcf","tsv"]:
+        cache_dir = get_cache_dir(ref_path, ref_type=ref_type, verbose=verbose, log=log)
+        if cache_dir is not None and load_cache_meta(cache_dir).get("rsid_index") is True:
+            return cache_dir
+    return None
+
+def get_variant_index_dir(ref_path, verbose=True, log=Log()):
+    '''
+    Return a directory with a variant -> rsID index for ref_path : ref_path itself if it is an index directory,
+    otherwise the registered variant index of ref_path (None if there is none).
+    '''
+    if ref_path is None:
+        return None
+    if path.isdir(ref_path):
+        index_dir = ref_path if path.exists(path.join(ref_path,"variant.key.npy")) else None
+    else:
+        index_dir = get_cache_dir(ref_path, ref_type="variant", verbose=verbose, log=log)
+    if index_dir is not None and not path.exists(path.join(index_dir,"variant.alt.npy")):
+        # indexes built by earlier versions have no alleles to confirm the hashed keys
+        if verbose: log.write(" -Variant index without alleles is ignored. Please rebuild it with build_variant_index(overwrite=True): {}".format(index_dir))
+        return None
+    return index_dir
+
+def load_cache_meta(cache_dir):
+    return json.load(open(path.join(cache_dir,"meta.json")))
+
+def load_fasta_cache_records(cache_dir, chrom_to_check=None):
+    '''
+    yield (chromosome name, chromosome, memory-mapped uint8 sequence) from a fasta cache
+    '''
+    meta = load_cache_meta(cache_dir)
+    for contig, value in meta["chromosomes"].items():
+        if chrom_to_check is None or value["chr"] in chrom_to_check:
+            seq = np.load(path.join(cache_dir,"{}.seq.npy".format(_safe_name(contig))), mmap_mode="r")
+            yield value["name"], value["chr"], seq
+
+def load_vcf_cache_chrom(cache_dir, contig, positions, ref_alt_freq=None, read_id=False):
+    '''
+    return records at the queried positions from a vcf cache, in the same layout as vcflookup._read_vcf_chrom
+    '''
+    prefix = path.join(cache_dir, _safe_name(contig))
+    columns = ["POS","REF","ALT"] + (["AF"] if ref_alt_freq is not None else []) + (["ID"] if read_id else [])
+    if not path.exists(prefix+".pos.npy"):
+        return pd.DataFrame(columns=columns)
+    pos_array = np.load(prefix+".pos.npy", mmap_mode="r")
+    idx = np.flatnonzero(np.isin(pos_array, np.unique(positions)))
+    ref_df = pd.DataFrame({"POS":np.asarray(pos_array[idx],dtype="int64"),
+                           "REF":_unpack_alleles(np.load(prefix+".ref.npy", mmap_mode="r"), np.load(prefix+".ref_offsets.npy", mmap_mode="r"), idx),
+                           "ALT":_unpack_alleles(np.load(prefix+".alt.npy", mmap_mode="r"), np.load(prefix+".alt_offsets.npy", mmap_mode="r"), idx)})
+    if ref_alt_freq is not None:
+        ref_df["AF"] = np.asarray(np.load(prefix+".af.npy", mmap_mode="r")[idx], dtype="float64")
+    if read_id:
+        rsn = np.asarray(np.load(prefix+".rsn.npy", mmap_mode="r")[idx])
+        ref_df["ID"] = pd.Series(["rs"+str(i) if i>=0 else None for i in rsn], dtype="object").values
+    return ref_df
+
+def lookup_rsid_cache(cache_dir, rsn):
+    '''
+    rsn : int array of rsID numbers (-1 for missing)
+    return CHR (float, NaN if not found) and POS (float, NaN if not found) arrays
+    '''
+    rsid_rsn = np.load(path.join(cache_dir,"rsid.rsn.npy"), mmap_mode="r")
+    rsid_chr = np.load(path.join(cache_dir,"rsid.chr.npy"), mmap_mode="r")
+    rsid_pos = np.load(path.join(cache_dir,"rsid.pos.npy"), mmap_mode="r")
+    chrom = np.full(len(rsn), np.nan)
+    pos = np.full(len(rsn), np.nan)
+    if len(rsid_rsn)==0:
+        return chrom, pos
+    # query with the dtype of the index to avoid converting the memory-mapped array
+    rsn = np.asarray(rsn, dtype="int64")
+    is_valid = (rsn>=0) & (rsn <= np.iinfo(rsid_rsn.dtype).max)
+    query = np.where(is_valid, rsn, 0).astype(rsid_rsn.dtype)
+    idx = np.searchsorted(rsid_rsn, query, side="left")
+    idx_clipped = np.clip(idx, 0, len(rsid_rsn)-1)
+    found = is_valid & (idx < len(rsid_rsn)) & (np.asarray(rsid_rsn[idx_clipped])==query)
+    chrom[found] = rsid_chr[idx_clipped[found]]
+    pos[found] = rsid_pos[idx_clipped[found]]
+    return chrom, pos
+
+def lookup_variant_index(cache_dir, key, ref=None, alt=None):
+    '''
+    key : uint64 array of packed variant keys (0 for missing)
+    ref / alt : alleles used for the keys ; key matches are confirmed on the alleles of the index
+    return rsID numbers (int64, -1 if not found)
+    '''
+    index_key = np.load(path.join(cache_dir,"variant.key.npy"), mmap_mode="r")
+    index_rsn = np.load(path.join(cache_dir,"variant.rsn.npy"), mmap_mode="r")
+    rsn = np.full(len(key), -1, dtype="int64")
+    if len(index_key)==0:
+        return rsn
+    key = np.asarray(key, dtype="uint64")
+    idx = np.searchsorted(index_key, key, side="left")
+    idx_clipped = np.clip(idx, 0, len(index_key)-1)
+    found = (key!=MISSING_KEY) & (idx < len(index_key)) & (np.asarray(index_key[idx_clipped])==key)
+    if ref is not None and alt is not None:
+        found_idx = idx_clipped[found]
+        is_confirmed = np.ones(len(found_idx), dtype="bool")
+        for allele_name, alleles in [("ref",ref),("alt",alt)]:
+            query = pd.Series(alleles).astype("string").str.upper().fillna("").to_numpy(dtype="object")[found]
+            query_buffer, query_offsets = _pack_alleles(query)
+            is_confirmed &= _alleles_equal(np.load(path.join(cache_dir,"variant.{}.npy".format(allele_name)), mmap_mode="r"),
+                                           np.load(path.join(cache_dir,"variant.{}_offsets.npy".format(allele_name)), mmap_mode="r"),
+                                           found_idx, query_buffer, query_offsets)
+        found[found] = is_confirmed
+    rsn[found] = index_rsn[idx_clipped[found]]
+    return rsn
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 from pysam import VariantFile
+from pysam import FastaFile
 from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
@@ -12,6 +13,19 @@ from gwaslab.CommonData import get_number_to_chr
 from gwaslab.CommonData import get_chr_list
 from gwaslab.CommonData import get_chr_to_number
 from gwaslab.vchangestatus import vchange_status
+from gwaslab.vchangestatus import set_digit
+from gwaslab.vchangestatus import match_digit
+from gwaslab.vchangestatus import STATUS_DTYPE
+from gwaslab.vcflookup import lookup_vcf
+from gwaslab.refcache import seq_to_uint8
+from gwaslab.refcache import get_cache_dir
+from gwaslab.refcache import load_fasta_cache_records
+from gwaslab.refcache import lookup_rsid_cache
+from gwaslab.refcache import get_rsid_index_dir
+from gwaslab.refcache import get_variant_index_dir
+from gwaslab.refcache import lookup_variant_index
+from gwaslab.variantkey import pack_variant_key
+from gwaslab.variantkey import parse_snpid
 import re
 import os
 import gc
@@ -32,6 +46,7 @@ def rsidtochrpos(sumstats,
               overwrite=False,remove=False,chunksize=5000000,verbose=True,log=Log()):
     '''
     assign chr:pos based on rsID
+    path : rsID tsv, or a vcf / tsv with an index built by build_rsid_index, or the index directory itself
     '''
     #########################################################################################################
     if verbose:  log.write("Start to update chromosome and position information based on rsID...")  
@@ -46,6 +61,26 @@ def rsidtochrpos(sumstats,
         if verbose:  log.write(" -Filling na in rsID columns with NA_xxx for {} variants...".format(sum(sumstats[rsid].isna())))  
         sumstats.loc[sumstats[rsid].isna(),rsid] = ["NA_" + str(x+1) for x in range(len(sumstats.loc[sumstats[rsid].isna(),rsid]))]
 
+    cache_dir = get_rsid_index_dir(path, verbose=verbose, log=log)
+    if cache_dir is not None:
+        # rsID index available (build_rsid_index / build_reference_cache) : sorted rsID lookup instead of chunked update
+        if verbose:  log.write(" -Using rsID index: {}".format(cache_dir))
+        rsn = pd.to_numeric(sumstats[rsid].astype("string").str.extract(r'^rs([0-9]+)$',expand=False), errors="coerce").fillna(-1).astype("int64").values
+        chrom_found, pos_found = lookup_rsid_cache(cache_dir, rsn)
+        is_found = ~np.isnan(chrom_found)
+        if chrom not in sumstats.columns:
+            sumstats[chrom] =pd.Series(dtype="Int64")
+        if pos not in sumstats.columns:    
+            sumstats[pos] =pd.Series(dtype="Int64")
+        sumstats[chrom] = sumstats[chrom].astype("object")
+        sumstats.loc[is_found,chrom] = chrom_found[is_found].astype("int64")
+        sumstats.loc[is_found,pos] = pos_found[is_found].astype("int64")
+        if verbose:  log.write(" -Updated CHR and POS for {} variants...".format(sum(is_found)))
+        if verbose:  log.write(" -Updating CHR and POS finished.Start to re-fixing CHR and POS... ")
+        sumstats = fixchr(sumstats,verbose=verbose)
+        sumstats = fixpos(sumstats,verbose=verbose)
+        return sumstats
+
     dic_chuncks = pd.read_csv(path,sep="\t",usecols=[ref_rsid,ref_chr,ref_pos],
                       chunksize=chunksize,index_col = ref_rsid,
                       dtype={ref_rsid:"string",ref_chr:"Int64",ref_pos:"Int64"})
@@ -148,93 +183,127 @@ def parallelrsidtochrpos(sumstats, rsid="rsID", chrom="CHR",pos="POS", path=None
     pool.join()
     return sumstats
 ####################################################################################################################
-#20220426 check if non-effect allele is aligned with reference genome 
-def check_status(row,record):
-    #pos,ea,nea
-    # status 
-    #0 /  ----->  match
-    #1 /  ----->  Flipped Fixed
-    #2 /  ----->  Reverse_complementary Fixed
-    #3 /  ----->  flipped
-    #4 /  ----->  reverse_complementary 
-    #5 / ------>  reverse_complementary + flipped
-    #6 /  ----->  both allele on genome + unable to distinguish
-    #7 /  ----> reverse_complementary + both allele on genome + unable to distinguish
-    #8 / -----> not on ref genome
-    #9 / ------> unchecked
-    
-    status_pre=row[3][:5]
-    status_end=row[3][6:]
-    
-    ## nea == ref
-    if row[2] == record[row[0]-1: row[0]+len(row[2])-1].seq.upper():
-        ## ea == ref
-        if row[1] == record[row[0]-1: row[0]+len(row[1])-1].seq.upper():
-            ## len(nea) >len(ea):
-            if len(row[2])!=len(row[1]):
-                # indels both on ref, unable to identify
-                return status_pre+"6"+status_end 
-        else:
-            #nea == ref & ea != ref
-            return status_pre+"0"+status_end 
-    ## nea!=ref
+def get_fasta_records(ref_path, chr_dict=get_chr_to_number(), chrom_to_check=None):
+    '''
+    yield (chromosome, uint8 array of the sequence) one chromosome at a time
+    reference cache : memory-mapped sequences built by build_reference_cache
+    indexed FASTA (.fai) : only the chromosomes in chrom_to_check are fetched
+    otherwise : the FASTA is streamed with SeqIO
+    '''
+    chromlist = get_chr_list(add_number=True)
+    cache_dir = get_cache_dir(ref_path, ref_type="fasta", verbose=False)
+    if cache_dir is not None:
+        for record_chr, i, seq in load_fasta_cache_records(cache_dir, chrom_to_check):
+            yield record_chr, i, seq
+    elif os.path.isfile(ref_path+".fai"):
+        fasta = FastaFile(ref_path)
+        for contig in fasta.references:
+            record_chr = str(contig).strip("chrCHR").upper()
+            i = chr_dict[record_chr] if record_chr in chr_dict.keys() else record_chr
+            if i in chromlist and (chrom_to_check is None or i in chrom_to_check):
+                yield record_chr, i, seq_to_uint8(fasta.fetch(contig))
+        fasta.close()
     else:
-        # ea == ref_seq -> need to flip
-        if row[1] == record[row[0]-1: row[0]+len(row[1])-1].seq.upper():
-            return status_pre+"3"+status_end 
-        # ea !=ref
-        else:
-            #_reverse_complementary
-            row[1] = get_reverse_complementary_allele(row[1])
-            row[2] = get_reverse_complementary_allele(row[2])
-            ## nea == ref
-            if row[2] == record[row[0]-1: row[0]+len(row[2])-1].seq.upper():
-                ## ea == ref
-                if row[1] == record[row[0]-1: row[0]+len(row[1])-1].seq.upper():
-                    ## len(nea) >len(ea):
-                    if len(row[2])!=len(row[1]):
-                        return status_pre+"8"+status_end  # indel reverse complementary
-                else:
-                    return status_pre+"4"+status_end 
-            else:
-                # ea == ref_seq -> need to flip
-                if row[1] == record[row[0]-1: row[0]+len(row[1])-1].seq.upper():
-                    return status_pre+"5"+status_end 
-            # ea !=ref
-            return status_pre+"8"+status_end
-        
+        for record in SeqIO.parse(ref_path, "fasta"):
+            if record is not None:
+                record_chr = str(record.id).strip("chrCHR").upper()
+                i = chr_dict[record_chr] if record_chr in chr_dict.keys() else record_chr
+                if i in chromlist and (chrom_to_check is None or i in chrom_to_check):
+                    yield record_chr, i, seq_to_uint8(str(record.seq))
+
+def match_allele_on_ref(seq, pos_0_based, alleles):
+    '''
+    vectorized check of seq[pos : pos+len(allele)] == allele
+    seq : uint8 array ; pos_0_based : int array ; alleles : str array
+    variants are processed in groups of the same allele length
+    '''
+    alleles = np.asarray(alleles, dtype="object")
+    lengths = pd.Series(alleles).str.len().fillna(0).astype("int64").values
+    matched = np.zeros(len(alleles), dtype=bool)
+    for length in np.unique(lengths):
+        if length==0: continue
+        idx = np.flatnonzero(lengths==length)
+        starts = pos_0_based[idx]
+        in_range = (starts>=0) & (starts + length <= len(seq))
+        idx = idx[in_range]
+        starts = starts[in_range]
+        if len(idx)==0: continue
+        allele_bytes = np.frombuffer("".join(alleles[idx]).encode("ascii",errors="replace"), dtype=np.uint8).reshape(-1,length)
+        ref_bytes = seq[starts[:,None] + np.arange(length)]
+        matched[idx] = (allele_bytes == ref_bytes).all(axis=1)
+    return matched
+
+def check_status_vectorized(status, pos, ea, nea, seq):
+    '''
+    vectorized version of check_status for variants on one chromosome
+    status : int array ; pos : 1-based int array ; ea/nea : str arrays ; seq : uint8 array
+    '''
+    pos_0_based = pos - 1
+    nea_on_ref = match_allele_on_ref(seq, pos_0_based, nea)
+    ea_on_ref = match_allele_on_ref(seq, pos_0_based, ea)
+    same_length = pd.Series(ea).str.len().values == pd.Series(nea).str.len().values
+    
+    # reverse complementary alleles are only needed when neither allele is on ref
+    rc_nea_on_ref = np.zeros(len(status), dtype=bool)
+    rc_ea_on_ref = np.zeros(len(status), dtype=bool)
+    to_rc = (~nea_on_ref) & (~ea_on_ref)
+    if sum(to_rc)>0:
+        uniq_alleles = pd.unique(np.concatenate([ea[to_rc],nea[to_rc]]))
+        rc_dic = {i:get_reverse_complementary_allele(i) for i in uniq_alleles}
+        rc_nea_on_ref[to_rc] = match_allele_on_ref(seq, pos_0_based[to_rc], pd.Series(nea[to_rc]).map(rc_dic).values)
+        rc_ea_on_ref[to_rc]  = match_allele_on_ref(seq, pos_0_based[to_rc], pd.Series(ea[to_rc]).map(rc_dic).values)
+
+    #0 match / 3 flipped / 4 reverse_complementary / 5 reverse_complementary + flipped
+    #6 both allele on genome + unable to distinguish / 8 not on ref genome
+    unchanged = nea_on_ref & ea_on_ref & same_length
+    conditions = [nea_on_ref & ea_on_ref, 
+                  nea_on_ref, 
+                  ea_on_ref, 
+                  rc_nea_on_ref & (~rc_ea_on_ref), 
+                  (~rc_nea_on_ref) & rc_ea_on_ref]
+    align_code = np.select(conditions, [6,0,3,4,5], default=8)
+    return np.where(unchanged, status, set_digit(status, 6, align_code))
 
 def checkref(sumstats,ref_path,chrom="CHR",pos="POS",ea="EA",nea="NEA",status="STATUS",chr_dict=get_chr_to_number(),remove=False,verbose=True,log=Log()):
     if verbose: log.write("Start to check if NEA is aligned with reference sequence...")
     if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns)) 
     if verbose: log.write(" -Reference genome fasta file: "+ ref_path)  
+    
+    to_check_ref = (~sumstats[chrom].isna()) & (~sumstats[pos].isna()) & (~sumstats[nea].isna()) & (~sumstats[ea].isna())
+    chrom_array = sumstats.loc[to_check_ref,chrom].to_numpy(dtype="object")
+    pos_array = sumstats.loc[to_check_ref,pos].astype("int64").values
+    ea_array = sumstats.loc[to_check_ref,ea].astype("object").values
+    nea_array = sumstats.loc[to_check_ref,nea].astype("object").values
+    status_array = sumstats.loc[to_check_ref,status].astype("int64").values.copy()
+    chrom_to_check = set(pd.unique(chrom_array))
+    
+    cache_dir = get_cache_dir(ref_path, ref_type="fasta", verbose=verbose, log=log)
+    if cache_dir is not None:
+        if verbose: log.write(" -Using reference cache: {}".format(cache_dir))
+    elif os.path.isfile(ref_path+".fai"):
+        if verbose: log.write(" -Using indexed FASTA file (faidx)...")
+    records = get_fasta_records(ref_path, chr_dict=chr_dict, chrom_to_check=chrom_to_check)
     if verbose: log.write(" -Checking records: ", end="")  
-    chromlist = get_chr_list(add_number=True)
-    records = SeqIO.parse(ref_path, "fasta")
-    for record in records:
-        #record = next(records)
-        if record is not None:
-            record_chr = str(record.id).strip("chrCHR").upper()
-            if record_chr in chr_dict.keys():
-                i = chr_dict[record_chr]
-            else:
-                i = record_chr
-            if i in chromlist:
-                if verbose:  log.write(record_chr," ", end="",show_time=False) 
-                to_check_ref = (sumstats[chrom]==i) & (~sumstats[pos].isna()) & (~sumstats[nea].isna()) & (~sumstats[ea].isna())
-                sumstats.loc[to_check_ref,status] = sumstats.loc[to_check_ref,[pos,ea,nea,status]].apply(lambda x:check_status(x,record),axis=1)
+    for record_chr, i, seq in records:
+        if verbose:  log.write(record_chr," ", end="",show_time=False) 
+        on_chr = chrom_array == i
+        if sum(on_chr)==0: continue
+        status_array[on_chr] = check_status_vectorized(status_array[on_chr], pos_array[on_chr], ea_array[on_chr], nea_array[on_chr], seq)
+        del seq
+        gc.collect()
+    sumstats.loc[to_check_ref,status] = status_array
     
     if verbose:  log.write("\n",end="",show_time=False) 
         
-    sumstats.loc[:,status] = sumstats.loc[:,status].astype("string")
+    sumstats[status] = sumstats[status].astype(STATUS_DTYPE)
     available_to_check =sum( (~sumstats[pos].isna()) & (~sumstats[nea].isna()) & (~sumstats[ea].isna()))
-    status_0=sum(sumstats["STATUS"].str.match("\w\w\w\w\w[0]\w", case=False, flags=0, na=False))
-    status_3=sum(sumstats["STATUS"].str.match("\w\w\w\w\w[3]\w", case=False, flags=0, na=False))
-    status_4=sum(sumstats["STATUS"].str.match("\w\w\w\w\w[4]\w", case=False, flags=0, na=False))
-    status_5=sum(sumstats["STATUS"].str.match("\w\w\w\w\w[5]\w", case=False, flags=0, na=False))
-    status_6=sum(sumstats["STATUS"].str.match("\w\w\w\w\w[6]\w", case=False, flags=0, na=False))
-    #status_7=sum(sumstats["STATUS"].str.match("\w\w\w\w\w[7]\w", case=False, flags=0, na=False))
-    status_8=sum(sumstats["STATUS"].str.match("\w\w\w\w\w[8]\w", case=False, flags=0, na=False))
+    status_0=sum(match_digit(sumstats[status],6,[0]))
+    status_3=sum(match_digit(sumstats[status],6,[3]))
+    status_4=sum(match_digit(sumstats[status],6,[4]))
+    status_5=sum(match_digit(sumstats[status],6,[5]))
+    status_6=sum(match_digit(sumstats[status],6,[6]))
+    #status_7=sum(match_digit(sumstats[status],6,[7]))
+    status_8=sum(match_digit(sumstats[status],6,[8]))
     
     if verbose: log.write(" -Variants allele on given reference sequence : ",status_0)
     if verbose: log.write(" -Variants flipped : ",status_3)
@@ -253,7 +322,7 @@ def checkref(sumstats,ref_path,chrom="CHR",pos="POS",ea="EA",nea="NEA",status="S
     if verbose: log.write(" -Variants not on given reference sequence : ",status_8)
     
     if remove is True:
-        sumstats = sumstats.loc[~sumstats["STATUS"].str.match("\w\w\w\w\w[8]\w"),:]
+        sumstats = sumstats.loc[~match_digit(sumstats[status],6,[8]),:]
         if verbose: log.write(" -Variants not on given reference sequence were removed.")
     gc.collect()
     return sumstats
@@ -292,14 +361,19 @@ def assign_rsid_single(sumstats,path,rsid="rsID",chr="CHR",pos="POS",ref="NEA",a
 
 def parallelizeassignrsid(sumstats, path, ref_mode="vcf",snpid="SNPID",rsid="rsID",chr="CHR",pos="POS",ref="NEA",alt="EA",status="STATUS",
                           n_cores=1,chunksize=5000000,ref_snpid="SNPID",ref_rsid="rsID",
-                          overwrite="empty",verbose=True,log=Log(),chr_dict=None):
+                          overwrite="empty",verbose=True,log=Log(),chr_dict=None,bulk_threshold=100000):
     '''
     overwrite mode : 
     all ,    overwrite rsid for all availalbe rsid 
     invalid,  only assign rsid for variants with invalid rsid
     empty    only assign rsid for variants with na rsid
+    ref_mode :
+    vcf      per-variant fetch ; switched to vcf_bulk if more than bulk_threshold variants need assignment 
+             or if a reference cache is available
+    vcf_bulk each chromosome of the vcf is streamed once and joined with sumstats on POS + REF/ALT or ALT/REF
+    tsv      SNPID-rsID table (or its variant index built by build_variant_index)
     '''  
-    if ref_mode=="vcf":
+    if ref_mode in ["vcf","vcf_bulk"]:
         ###################################################################################################################
         if verbose: log.write("Start to assign rsID using vcf...")
         if verbose: log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))   
@@ -320,7 +394,8 @@ def parallelizeassignrsid(sumstats, path, ref_mode="vcf",snpid="SNPID",rsid="rsI
         pre_number = sum(~sumstats[rsid].isna())
 
         ##################################################################################################################
-        standardized_normalized = sumstats["STATUS"].str.match("\w\w\w[0][01234]\w\w", case=False, flags=0, na=False)
+        # xxx0[01234]xx
+        standardized_normalized = match_digit(sumstats[status],4,[0]) & match_digit(sumstats[status],5,[0,1,2,3,4])
         if overwrite=="all":
             to_assign = standardized_normalized
         if overwrite=="invalid":
@@ -331,14 +406,30 @@ def parallelizeassignrsid(sumstats, path, ref_mode="vcf",snpid="SNPID",rsid="rsI
         # multicore arrangement
 
         if sum(to_assign)>0:
+            if ref_mode=="vcf" and sum(to_assign) > bulk_threshold:
+                if verbose: log.write(" -{} variants to assign (> {}) : switching to bulk mode...".format(sum(to_assign), bulk_threshold))
+                ref_mode = "vcf_bulk"
+            if ref_mode=="vcf" and get_cache_dir(path, ref_type="vcf", verbose=verbose, log=log) is not None:
+                # reference cache available : bulk lookup
+                ref_mode = "vcf_bulk"
             if sum(to_assign)<10000: n_cores=1
-            df_split = np.array_split(sumstats.loc[to_assign, [chr,pos,ref,alt]], n_cores)
-            pool = Pool(n_cores)
-            map_func = partial(assign_rsid_single,path=path,chr=chr,pos=pos,ref=ref,alt=alt,chr_dict=chr_dict) 
-            assigned_rsid = pd.concat(pool.map(map_func,df_split))
-            sumstats.loc[to_assign,rsid] = assigned_rsid.values 
-            pool.close()
-            pool.join()
+            if ref_mode=="vcf_bulk":
+                # one pass per chromosome (in parallel across chromosomes) + join on POS/REF/ALT and POS/ALT/REF
+                if verbose: log.write(" -Mode : vcf_bulk")
+                matched = lookup_vcf(sumstats.loc[to_assign,[chr,pos,ref,alt]], path, read_id=True,
+                                     chrom=chr, pos=pos, ref=ref, alt=alt, chr_dict=chr_dict, n_cores=n_cores, verbose=verbose, log=log)
+                is_matched = (matched["MATCH"]>0).values
+                if verbose: log.write(" -Matched {} variants in the reference...".format(is_matched.sum()))
+                assigned_rsid = matched["ID"].where(is_matched, pd.NA)
+                sumstats.loc[to_assign,rsid] = assigned_rsid.values
+            else:
+                df_split = np.array_split(sumstats.loc[to_assign, [chr,pos,ref,alt]], n_cores)
+                pool = Pool(n_cores)
+                map_func = partial(assign_rsid_single,path=path,chr=chr,pos=pos,ref=ref,alt=alt,chr_dict=chr_dict) 
+                assigned_rsid = pd.concat(pool.map(map_func,df_split))
+                sumstats.loc[to_assign,rsid] = assigned_rsid.values 
+                pool.close()
+                pool.join()
         gc.collect()
         ##################################################################################################################
 
@@ -355,7 +446,8 @@ def parallelizeassignrsid(sumstats, path, ref_mode="vcf",snpid="SNPID",rsid="rsI
         if verbose:  log.write(" -Current Dataframe shape :",len(sumstats)," x ", len(sumstats.columns))   
         if verbose:  log.write(" -SNPID-rsID text file: "+ path)  
         
-        standardized_normalized = sumstats["STATUS"].str.match("\w\w\w[0][01234][0126]\w", case=False, flags=0, na=False)
+        # xxx0[01234][0126]x
+        standardized_normalized = match_digit(sumstats[status],4,[0]) & match_digit(sumstats[status],5,[0,1,2,3,4]) & match_digit(sumstats[status],6,[0,1,2,6])
         
         if rsid not in sumstats.columns:
             sumstats[rsid]=pd.Series(dtype="string")
@@ -369,7 +461,24 @@ def parallelizeassignrsid(sumstats, path, ref_mode="vcf",snpid="SNPID",rsid="rsI
         total_number= len(sumstats)
         pre_number = sum(~sumstats[rsid].isna())
         if verbose: log.write(" -"+str(sum(to_assign)) +" rsID could be possibly fixed...")
-        if sum(to_assign)>0: 
+        index_dir = get_variant_index_dir(path, verbose=verbose, log=log)
+        if sum(to_assign)>0 and index_dir is not None:
+            # variant index available (build_variant_index) : packed CHR:POS:NEA:EA keys + searchsorted instead of chunked update
+            if verbose:  log.write(" -Using variant index: {}".format(index_dir))
+            if chr in sumstats.columns and pos in sumstats.columns and ref in sumstats.columns and alt in sumstats.columns:
+                query_ref, query_alt = sumstats.loc[to_assign,ref], sumstats.loc[to_assign,alt]
+                key = pack_variant_key(sumstats.loc[to_assign,chr], sumstats.loc[to_assign,pos], query_ref, query_alt)
+            else:
+                query_chr, query_pos, query_ref, query_alt = parse_snpid(sumstats.loc[to_assign,snpid])
+                key = pack_variant_key(query_chr, query_pos, query_ref, query_alt)
+            rsn = lookup_variant_index(index_dir, key, ref=query_ref, alt=query_alt)
+            to_fill = to_assign.copy()
+            to_fill[to_assign] = rsn>=0
+            sumstats.loc[to_fill,rsid] = ("rs" + pd.Series(rsn[rsn>=0]).astype("string")).values
+            after_number = sum(~sumstats[rsid].isna())
+            if verbose: log.write(" -rsID Annotation for "+str(total_number - after_number) +" need to be fixed!")
+            if verbose: log.write(" -Annotated "+str(after_number - pre_number) +" rsID successfully!")
+        elif sum(to_assign)>0: 
             sumstats = sumstats.set_index(snpid)  
             dic_chuncks = pd.read_csv(path,sep="\t",usecols=[ref_snpid,ref_rsid],
                               chunksize=chunksize,index_col=ref_snpid,
@@ -400,57 +509,6 @@ def parallelizeassignrsid(sumstats, path, ref_mode="vcf",snpid="SNPID",rsid="rsI
 #################################################################################################################################################
 #single record assignment
 
-def check_strand_status(chr,start,end,ref,alt,eaf,vcf_reader,alt_freq,status,chr_dict=get_number_to_chr()):
-    ### 0 : not palindromic
-    ### 1 : palindromic +strand 
-    ### 2 : palindromic -strand -> need to flip -> flipped
-    ### 5 : palindromic -strand -> need to flip
-    ### 8 : no ref data
-    if chr_dict is not None: chr=chr_dict[chr]
-    status_pre=status[:6]
-    status_end=""
-    try:
-        chr_seq = vcf_reader.fetch(chr,start,end)
-    except:
-        return status_pre+"8"+status_end
-        
-    
-    for record in chr_seq:
-        if record.pos==end and record.ref==ref and (alt in record.alts):
-            
-            if  (record.info[alt_freq][0]<0.5) and (eaf<0.5):
-                return status_pre+"1"+status_end
-            elif (record.info[alt_freq][0]>0.5) and (eaf>0.5):
-                return status_pre+"1"+status_end
-            else:
-                return status_pre+"5"+status_end
-    return status_pre+"8"+status_end
-
-
-def check_unkonwn_indel(chr,start,end,ref,alt,vcf_reader,alt_freq,status,chr_dict=get_number_to_chr()):
-    ### input : unknown indel, both on genome (xx1[45]x)
-    ### 3 no flip
-    ### 4 unknown indel,fixed   (6->5)
-    ### 6 flip
-    ### 9 noinfo or not matching
-    
-    if chr_dict is not None: chr=chr_dict[chr]
-    status_pre=status[:6]
-    status_end=""
-    
-    try:
-        chr_seq = vcf_reader.fetch(chr,start,end)
-    except:
-        return status_pre+"8"+status_end
-
-    for record in chr_seq:
-        if record.pos==end and record.ref==ref and (alt in record.alts):
-            return status_pre+"3"+status_end
-        elif record.pos==end and record.ref==alt and (ref in record.alts):
-            return status_pre+"6"+status_end
-    return status_pre+"8"+status_end
-
-                                               
 def get_reverse_complementary_allele(a):
     dic = str.maketrans({
        "A":"T",
@@ -467,19 +525,6 @@ def is_palindromic(sumstats,a1="EA",a2="NEA"):
     palindromic = gc | cg | at | ta 
     return palindromic
 ##################################################################################################################################################
-#single df assignment
-
-def check_strand(sumstats,ref_infer,ref_alt_freq=None,chr="CHR",pos="POS",ref="NEA",alt="EA",eaf="EAF",chr_dict=get_number_to_chr(),status="STATUS"):
-    vcf_reader = VariantFile(ref_infer)
-    status_part = sumstats.apply(lambda x:check_strand_status(x[0],x[1]-1,x[1],x[2],x[3],x[4],vcf_reader,ref_alt_freq,x[5],chr_dict),axis=1) 
-    return status_part
-
-def check_indel(sumstats,ref_infer,ref_alt_freq=None,chr="CHR",pos="POS",ref="NEA",alt="EA",eaf="EAF",chr_dict=get_number_to_chr(),status="STATUS"):
-    vcf_reader = VariantFile(ref_infer)
-    status_part = sumstats.apply(lambda x:check_unkonwn_indel(x[0],x[1]-1,x[1],x[2],x[3],vcf_reader,ref_alt_freq,x[4],chr_dict),axis=1)
-    return status_part
-
-##################################################################################################################################################
 
 def parallelinferstrand(sumstats,ref_infer,ref_alt_freq=None,maf_threshold=0.40,remove_snp="",mode="pi",n_cores=1,remove_indel="",
                        chr="CHR",pos="POS",ref="NEA",alt="EA",eaf="EAF",status="STATUS",
@@ -499,7 +544,7 @@ def parallelinferstrand(sumstats,ref_infer,ref_alt_freq=None,maf_threshold=0.40,
             if verbose: log.write(" -Alternative allele frequency in INFO:", ref_alt_freq)  
 
             ## checking \w\w\w\w[0]\w\w -> standardized and normalized snp
-            good_chrpos =  sumstats[status].str.match(r'\w\w\w[0][0]\w\w', case=False, flags=0, na=False) 
+            good_chrpos =  match_digit(sumstats[status],4,[0]) & match_digit(sumstats[status],5,[0])
             palindromic = good_chrpos & is_palindromic(sumstats[[ref,alt]],a1=ref,a2=alt)   
             not_palindromic_snp = good_chrpos & (~palindromic)
 
@@ -514,16 +559,18 @@ def parallelinferstrand(sumstats,ref_infer,ref_alt_freq=None,maf_threshold=0.40,
 
             if verbose: log.write(" -After filtering by MAF< ", maf_threshold ," , the strand of ", sum(palindromic & maf_can_infer)," palindromic SNPs will be inferred...")
             ######################################################################################### 
-            if sum(palindromic & maf_can_infer)>0:
-                if sum(palindromic & maf_can_infer)<10000: 
+            to_infer = palindromic & maf_can_infer
+            if sum(to_infer)>0:
+                if sum(to_infer)<10000: 
                     n_cores=1  
-                df_split = np.array_split(sumstats.loc[(palindromic & maf_can_infer),[chr,pos,ref,alt,eaf,status]], n_cores)
-                pool = Pool(n_cores)
-                map_func = partial(check_strand,chr=chr,pos=pos,ref=ref,alt=alt,eaf=eaf,status=status,ref_infer=ref_infer,ref_alt_freq=ref_alt_freq,chr_dict=chr_dict) 
-                status_inferred = pd.concat(pool.map(map_func,df_split))
-                sumstats.loc[(palindromic & maf_can_infer),status] = status_inferred.values
-            pool.close()
-            pool.join()
+                matched = lookup_vcf(sumstats.loc[to_infer,[chr,pos,ref,alt]], ref_infer, ref_alt_freq=ref_alt_freq,
+                                     chrom=chr, pos=pos, ref=ref, alt=alt, chr_dict=chr_dict, n_cores=n_cores, verbose=verbose, log=log)
+                ref_af = matched["AF"].values
+                snp_eaf = sumstats.loc[to_infer,eaf].astype("float64").values
+                same_direction = (matched["MATCH"].values==1) & (~np.isnan(ref_af))
+                same_strand = ((ref_af<0.5) & (snp_eaf<0.5)) | ((ref_af>0.5) & (snp_eaf>0.5))
+                strand_code = np.where(same_direction, np.where(same_strand,1,5), 8)
+                sumstats.loc[to_infer,status] = set_digit(sumstats.loc[to_infer,status], 7, strand_code)
             #########################################################################################
             #0 Not palindromic SNPs
             #1 Palindromic +strand  -> no need to flip
@@ -536,11 +583,11 @@ def parallelinferstrand(sumstats,ref_infer,ref_alt_freq=None,maf_threshold=0.40,
             #8 Not matching or No information
             #9 Unchecked
 
-            status0 = sumstats[status].str.match(r'\w\w\w\w\w\w[0]', case=False, flags=0, na=False)  
-            status1 = sumstats[status].str.match(r'\w\w\w\w\w\w[1]', case=False, flags=0, na=False)  
-            status5 = sumstats[status].str.match(r'\w\w\w\w\w\w[5]', case=False, flags=0, na=False)  
-            status7 = sumstats[status].str.match(r'\w\w\w\w\w\w[7]', case=False, flags=0, na=False)  
-            status8 = sumstats[status].str.match(r'\w\w\w\w\w[123][8]', case=False, flags=0, na=False)  
+            status0 = match_digit(sumstats[status],7,[0])
+            status1 = match_digit(sumstats[status],7,[1])
+            status5 = match_digit(sumstats[status],7,[5])
+            status7 = match_digit(sumstats[status],7,[7])
+            status8 = match_digit(sumstats[status],6,[1,2,3]) & match_digit(sumstats[status],7,[8])
 
             if verbose: log.write("  -Non-palindromic : ",sum(status0))
             if verbose: log.write("  -Palindromic SNPs on + strand: ",sum(status1))
@@ -560,7 +607,7 @@ def parallelinferstrand(sumstats,ref_infer,ref_alt_freq=None,maf_threshold=0.40,
 
     ### unknow_indel
     if "i" in mode:
-        unknow_indel = sumstats[status].str.match(r'\w\w\w\w\w[6][89]', case=False, flags=0, na=False)   
+        unknow_indel = match_digit(sumstats[status],6,[6]) & match_digit(sumstats[status],7,[8,9])
         if verbose: log.write(" -Identified ", sum(unknow_indel)," indistinguishable Indels...")
         if sum(unknow_indel)>0:
             if verbose: log.write(" -Indistinguishable indels will be inferred from reference vcf ref and alt...")
@@ -568,18 +615,15 @@ def parallelinferstrand(sumstats,ref_infer,ref_alt_freq=None,maf_threshold=0.40,
             if sum(unknow_indel)>0:
                 if sum(unknow_indel)<10000: 
                     n_cores=1    
-                df_split = np.array_split(sumstats.loc[unknow_indel, [chr,pos,ref,alt,status]], n_cores)
-                pool = Pool(n_cores)
-                map_func = partial(check_indel,chr=chr,pos=pos,ref=ref,alt=alt,eaf=eaf,status=status,ref_infer=ref_infer,ref_alt_freq=ref_alt_freq,chr_dict=chr_dict) 
-                status_inferred = pd.concat(pool.map(map_func,df_split))
-                sumstats.loc[unknow_indel,status] = status_inferred.values 
-            pool.close()
-            pool.join()
+                matched = lookup_vcf(sumstats.loc[unknow_indel,[chr,pos,ref,alt]], ref_infer, 
+                                     chrom=chr, pos=pos, ref=ref, alt=alt, chr_dict=chr_dict, n_cores=n_cores, verbose=verbose, log=log)
+                indel_code = np.select([matched["MATCH"].values==1, matched["MATCH"].values==2], [3,6], default=8)
+                sumstats.loc[unknow_indel,status] = set_digit(sumstats.loc[unknow_indel,status], 7, indel_code)
             #########################################################################################
 
-            status3 =  sumstats[status].str.match(r'\w\w\w\w\w\w[3]', case=False, flags=0, na=False)  
-            status6 =  sumstats[status].str.match(r'\w\w\w\w\w\w[6]', case=False, flags=0, na=False)  
-            status8 =  sumstats[status].str.match(r'\w\w\w\w\w[6][8]', case=False, flags=0, na=False)  
+            status3 =  match_digit(sumstats[status],7,[3])
+            status6 =  match_digit(sumstats[status],7,[6])
+            status8 =  match_digit(sumstats[status],6,[6]) & match_digit(sumstats[status],7,[8])
 
             if verbose: log.write("  -Indels ea/nea match reference : ",sum(status3))
             if verbose: log.write("  -Indels ea/nea need to be flipped : ",sum(status6))
@@ -628,25 +672,21 @@ def parallelecheckaf(sumstats,ref_infer,ref_alt_freq=None,maf_threshold=0.4,colu
     if ref_alt_freq is not None:
         if verbose: log.write(" -Alternative allele frequency in INFO:", ref_alt_freq)  
         if not force:
-            good_chrpos =  sumstats[status].str.match(r'\w\w\w[0]\w\w\w', case=False, flags=0, na=False)  
+            good_chrpos =  match_digit(sumstats[status],4,[0])
+        else:
+            good_chrpos = pd.Series(True, index=sumstats.index)
         if verbose: log.write(" -Checking variants:", sum(good_chrpos)) 
         sumstats[column_name]=np.nan
     
     ########################  
         if sum(~sumstats[eaf].isna())<10000: 
             n_cores=1       
-        df_split = np.array_split(sumstats.loc[good_chrpos,[chr,pos,ref,alt,eaf]], n_cores)
-        pool = Pool(n_cores)
-        if sum(~sumstats[eaf].isna())>0:
-            map_func = partial(checkaf,chr=chr,pos=pos,ref=ref,alt=alt,eaf=eaf,ref_infer=ref_infer,ref_alt_freq=ref_alt_freq,column_name=column_name,chr_dict=chr_dict) 
-            sumstats.loc[good_chrpos,[column_name]] = pd.concat(pool.map(map_func,df_split))
-        pool.close()
-        pool.join()
+        if sum(~sumstats[eaf].isna())>0 and sum(good_chrpos)>0:
+            matched = lookup_vcf(sumstats.loc[good_chrpos,[chr,pos,ref,alt]], ref_infer, ref_alt_freq=ref_alt_freq,
+                                 chrom=chr, pos=pos, ref=ref, alt=alt, chr_dict=chr_dict, n_cores=n_cores, verbose=verbose, log=log)
+            daf = sumstats.loc[good_chrpos,eaf].astype("float64").values - matched["AF"].values
+            sumstats.loc[good_chrpos,column_name] = np.where(matched["MATCH"].values==1, daf, np.nan)
     ###########################
-        #status_inferred = sumstats.loc[good_chrpos,[chr,pos,ref,alt,eaf]].apply(lambda x:check_daf(x[0],x[1]-1,x[1],x[2],x[3],x[4],vcf_reader,ref_alt_freq,chr_dict),axis=1)
-        
-        #sumstats.loc[good_chrpos,"DAF"] = status_inferred.values
-        #sumstats.loc[:,"DAF"]=sumstats.loc[:,"DAF"].astype("float")     
         if verbose: log.write(" - {} max:".format(column_name), np.nanmax(sumstats.loc[:,column_name]))
         if verbose: log.write(" - {} min:".format(column_name), np.nanmin(sumstats.loc[:,column_name]))
         if verbose: log.write(" - {} sd:".format(column_name), np.nanstd(sumstats.loc[:,column_name]))
@@ -656,26 +696,6 @@ def parallelecheckaf(sumstats,ref_infer,ref_alt_freq=None,maf_threshold=0.4,colu
         if verbose: log.write("Finished allele frequency checking!") 
     return sumstats
 
-def checkaf(sumstats,ref_infer,ref_alt_freq=None,column_name="DAF",chr="CHR",pos="POS",ref="NEA",alt="EA",eaf="EAF",chr_dict=None):
-    #vcf_reader = vcf.Reader(open(ref_infer, 'rb'))
-    vcf_reader = VariantFile(ref_infer)
-    def afapply(x,vcf,alt_freq,chr_dict):
-            return check_daf(x[0],x[1]-1,x[1],x[2],x[3],x[4],vcf_reader,ref_alt_freq,chr_dict)
-    map_func = partial(afapply,vcf=vcf_reader,alt_freq=ref_alt_freq,chr_dict=chr_dict)
-    status_inferred = sumstats.apply(map_func,axis=1)
-    sumstats.loc[:,column_name] = status_inferred.values
-    sumstats.loc[:,column_name]=sumstats.loc[:,column_name].astype("float") 
-    return sumstats
-
-def check_daf(chr,start,end,ref,alt,eaf,vcf_reader,alt_freq,chr_dict=None):
-    if chr_dict is not None: chr=chr_dict[chr]
-    chr_seq = vcf_reader.fetch(chr,start,end)
-    
-    for record in chr_seq:
-        if record.pos==end:
-            if record.ref==ref and (alt in record.alts):
-                return eaf - record.info[alt_freq][0]
-    return np.nan
 ################################################################################################################
 
 def paralleleinferaf(sumstats,ref_infer,ref_alt_freq=None,n_cores=1, chr="CHR",pos="POS",ref="NEA",alt="EA",eaf="EAF",status="STATUS",chr_dict=None,force=False, verbose=True,log=Log()):
@@ -699,18 +719,19 @@ def paralleleinferaf(sumstats,ref_infer,ref_alt_freq=None,n_cores=1, chr="CHR",p
     if ref_alt_freq is not None:
         if verbose: log.write(" -Alternative allele frequency in INFO:", ref_alt_freq)  
         if not force:
-            good_chrpos =  sumstats[status].str.match(r'\w\w\w[0]\w\w\w', case=False, flags=0, na=False)  
+            good_chrpos =  match_digit(sumstats[status],4,[0])
+        else:
+            good_chrpos = pd.Series(True, index=sumstats.index)
         if verbose: log.write(" -Checking variants:", sum(good_chrpos)) 
     
     ########################  
         if sum(sumstats[eaf].isna())<10000: 
             n_cores=1       
-        df_split = np.array_split(sumstats.loc[good_chrpos,[chr,pos,ref,alt]], n_cores)
-        pool = Pool(n_cores)
-        map_func = partial(inferaf,chr=chr,pos=pos,ref=ref,alt=alt,eaf=eaf,ref_infer=ref_infer,ref_alt_freq=ref_alt_freq,chr_dict=chr_dict) 
-        sumstats.loc[good_chrpos,[eaf]] = pd.concat(pool.map(map_func,df_split))
-        pool.close()
-        pool.join()
+        if sum(good_chrpos)>0:
+            matched = lookup_vcf(sumstats.loc[good_chrpos,[chr,pos,ref,alt]], ref_infer, ref_alt_freq=ref_alt_freq,
+                                 chrom=chr, pos=pos, ref=ref, alt=alt, chr_dict=chr_dict, n_cores=n_cores, verbose=verbose, log=log)
+            ref_af = matched["AF"].values
+            sumstats.loc[good_chrpos,eaf] = np.select([matched["MATCH"].values==1, matched["MATCH"].values==2], [ref_af, 1 - ref_af], default=np.nan)
     ###########################
         
         afternumber = sum(sumstats[eaf].isna())
@@ -719,31 +740,6 @@ def paralleleinferaf(sumstats,ref_infer,ref_alt_freq=None,n_cores=1, chr="CHR",p
         if verbose: log.write("Finished allele frequency inferring!") 
     return sumstats
 
-def inferaf(sumstats,ref_infer,ref_alt_freq=None,chr="CHR",pos="POS",ref="NEA",alt="EA",eaf="EAF",chr_dict=None):
-    #vcf_reader = vcf.Reader(open(ref_infer, 'rb'))
-    vcf_reader = VariantFile(ref_infer)
-    def afapply(x,vcf,alt_freq,chr_dict):
-            return infer_af(x[0],x[1]-1,x[1],x[2],x[3],vcf_reader,ref_alt_freq,chr_dict)
-    map_func = partial(afapply,vcf=vcf_reader,alt_freq=ref_alt_freq,chr_dict=chr_dict)
-    status_inferred = sumstats.apply(map_func,axis=1)
-    sumstats.loc[:,eaf] = status_inferred.values
-    sumstats.loc[:,eaf]=sumstats.loc[:,eaf].astype("float") 
-    return sumstats
-
-def infer_af(chr,start,end,ref,alt,vcf_reader,alt_freq,chr_dict=None):
-    if chr_dict is not None: chr=chr_dict[chr]
-    chr_seq = vcf_reader.fetch(chr,start,end)
-    
-    for record in chr_seq:
-        if record.pos==end:
-            if record.ref==ref and (alt in record.alts):
-                return record.info[alt_freq][0]
-            elif record.ref==alt and (ref in record.alts):
-                return 1 - record.info[alt_freq][0]
-    return np.nan
-
-
-
 ################################################################################################################
 def auto_check_vcf_chr_dict(vcf_path, vcf_chr_dict, verbose, log):    
     if vcf_path is not None:
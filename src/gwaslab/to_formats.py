@@ -11,6 +11,7 @@ from gwaslab.CommonData import get_formats_list
 from datetime import datetime
 from datetime import date
 from gwaslab.preformat_input import print_format_info
+from gwaslab.vchangestatus import match_digit
 # to vcf
 # to fmt
     ## vcf
@@ -39,8 +40,11 @@ def tofmt(sumstats,
           verbose=True,
           no_status=False,
           log=Log(),
-          to_csvargs=None):
-    
+          to_csvargs=None,
+          mode="w"):
+    '''
+    mode : "w" write a new file ; "a" append rows without header (only for formats in the formatbook, used by Sumstats.stream)
+    '''
     if to_csvargs is None:
         to_csvargs=dict()
     
@@ -281,8 +285,10 @@ def tofmt(sumstats,
         sumstats = sumstats.rename(columns=rename_dictionary) 
         
         # calculate meta data
-        harmonised = sum(sumstats["STATUS"].str.match( r"\w\w\w[0][0123][012][01234]", case=False, flags=0, na=False ) )
-        switchedalleles = sum(sumstats["STATUS"].str.match( r"\w\w\w[0][0123][12][24]", case=False, flags=0, na=False ) )
+        # xxx0[0123][012][01234]
+        harmonised = sum(match_digit(sumstats["STATUS"],4,[0]) & match_digit(sumstats["STATUS"],5,[0,1,2,3]) & match_digit(sumstats["STATUS"],6,[0,1,2]) & match_digit(sumstats["STATUS"],7,[0,1,2,3,4]))
+        # xxx0[0123][12][24]
+        switchedalleles = sum(match_digit(sumstats["STATUS"],4,[0]) & match_digit(sumstats["STATUS"],5,[0,1,2,3]) & match_digit(sumstats["STATUS"],6,[1,2]) & match_digit(sumstats["STATUS"],7,[2,4]))
         sumstats["ID"] = sumstats["ID"].str.replace(":","_")
         
         # process Allele frequency data
@@ -414,11 +420,11 @@ def tofmt(sumstats,
                 if verbose: log.write(" -Reordering columns...") 
 
             if verbose: log.write(" -Output columns:",','.join(sumstats.columns))
-            sumstats.to_csv(path, index=None,**to_csvargs)
+            sumstats.to_csv(path, index=None, mode=mode, header=(mode=="w"), **to_csvargs)
 
         if md5sum is True: 
             md5_value = md5sum_file(path,log,verbose)
-        else:
+        elif ssfmeta==True:
             md5_value = calculate_md5sum_file(path)
         
         ## update ssf-style meta data and export to yaml file
@@ -0,0 +1,169 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from gwaslab.Log import Log
+from gwaslab.vchangestatus import status_to_int
+from gwaslab.vchangestatus import STATUS_DTYPE
+from gwaslab.CommonData import get_chr_to_number
+import gc
+
+# columnar storage of a Sumstats object (alternative to dump_pickle / load_pickle)
+# path/
+#   meta.json          : meta, log, column order and dtypes, chromosome -> file
+#   chr{CHR}.parquet   : one file per chromosome, sorted by POS (row groups carry POS min/max statistics)
+#   chrNA.parquet      : variants without CHR
+# load() only reads the requested columns and, with region=(chr,start,end), only the row groups overlapping the region
+
+FORMAT_VERSION = 1
+ROW_GROUP_SIZE = 100000
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def _dtype_name(dtype):
+    # str() does not distinguish string[python] and string[pyarrow]
+    if isinstance(dtype, pd.StringDtype):
+        return "string[{}]".format(dtype.storage)
+    return str(dtype)
+
+def _chr_key(chrom):
+    # 2, 2.0 and "2" -> "2"
+    try:
+        if float(chrom)==int(float(chrom)):
+            return str(int(float(chrom)))
+    except (TypeError, ValueError):
+        pass
+    return str(chrom)
+
+def _region_chr_key(chrom, files):
+    # "X", "chrX", "x" -> "23" if the files are keyed by gwaslab chromosome numbers (after fix_chr)
+    key = _chr_key(chrom)
+    if key in files:
+        return key
+    name = str(chrom).strip()
+    if name.lower().startswith("chr"):
+        name = name[3:]
+    number = get_chr_to_number().get(name.upper(), name)
+    return _chr_key(number)
+
+def save_sumstats(glsumstats, path="./mysumstats", overwrite=False, verbose=True):
+    '''
+    save a Sumstats object as a directory of per-chromosome parquet files + meta.json
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    log = glsumstats.log
+    if verbose: log.write("Start to save the Sumstats Object...")
+    if os.path.exists(path):
+        if overwrite is False:
+            if verbose: log.write(" -Path exists. Skipping. If you want to overwrite, please use overwrite=True.")
+            return
+        if not os.path.isfile(os.path.join(path, "meta.json")):
+            raise ValueError("{} exists and is not a saved Sumstats directory.".format(path))
+        shutil.rmtree(path)
+    os.makedirs(path)
+    if verbose: log.write(" -Saving to : {}".format(path))
+
+    data = glsumstats.data
+    dtypes = {col:_dtype_name(dtype) for col, dtype in data.dtypes.items()}
+    files = {}
+    if "CHR" in data.columns:
+        is_chr_na = data["CHR"].isna()
+        groups = [(chrom, group) for chrom, group in data.loc[~is_chr_na,:].groupby("CHR", sort=True)]
+        if is_chr_na.sum()>0:
+            groups.append(("NA", data.loc[is_chr_na,:]))
+    else:
+        groups = [("NA", data)]
+
+    for chrom, group in groups:
+        if "POS" in group.columns:
+            group = group.sort_values(by="POS", kind="mergesort")
+        file_name = "chr{}.parquet".format(_chr_key(chrom))
+        table = pa.Table.from_pandas(group, preserve_index=False)
+        pq.write_table(table, os.path.join(path, file_name), row_group_size=ROW_GROUP_SIZE)
+        files[_chr_key(chrom)] = file_name
+        if verbose: log.write(" -Saved {} variants on CHR {} to {}".format(len(group), chrom, file_name))
+
+    sidecar = {"format_version":FORMAT_VERSION,
+               "columns":list(data.columns),
+               "dtypes":dtypes,
+               "files":files,
+               "build":glsumstats.build,
+               "meta":glsumstats.meta,
+               "log":glsumstats.log.log_text}
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump(sidecar, file, indent=2, default=_to_json)
+    if verbose: log.write("Finished saving successfully!")
+
+def load_sumstats(path, columns=None, region=None, verbose=True):
+    '''
+    load a Sumstats object saved by Sumstats.save()
+    columns : list of columns to read (None : all)
+    region  : (chr, start, end) ; only variants with start <= POS <= end on chr are read
+    '''
+    import pyarrow.parquet as pq
+    from gwaslab.Sumstats import Sumstats
+
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.isfile(meta_path):
+        raise ValueError("Not a saved Sumstats directory (meta.json not found): {}".format(path))
+    with open(meta_path) as file:
+        sidecar = json.load(file)
+
+    log = Log()
+    log.log_text = sidecar["log"]
+    if verbose: log.write("Start to load the Sumstats Object from : {}".format(path))
+
+    if columns is None:
+        columns = sidecar["columns"]
+    else:
+        missing = [col for col in columns if col not in sidecar["columns"]]
+        if len(missing)>0 and verbose:
+            log.write(" -Columns not found: {}".format(",".join(missing)))
+        columns = [col for col in sidecar["columns"] if col in columns]
+
+    files = sidecar["files"]
+    filters = None
+    read_columns = columns
+    if region is not None:
+        chrom = _region_chr_key(region[0], files)
+        files = {chrom:files[chrom]} if chrom in files else {}
+        filters = [("POS", ">=", int(region[1])), ("POS", "<=", int(region[2]))]
+        if "POS" not in read_columns:
+            read_columns = read_columns + ["POS"]
+        if verbose: log.write(" -Loading region : CHR {} : {} - {}".format(region[0], region[1], region[2]))
+    if verbose: log.write(" -Loading columns : {}".format(",".join(columns)))
+
+    data_list=[]
+    for chrom, file_name in files.items():
+        table = pq.read_table(os.path.join(path, file_name), columns=read_columns, filters=filters)
+        data_list.append(table.to_pandas())
+    if len(data_list)>0:
+        data = pd.concat(data_list, ignore_index=True)
+    else:
+        data = pd.DataFrame(columns=read_columns)
+    data = data.loc[:, columns]
+    del data_list
+    gc.collect()
+
+    # restore dtypes (categories differ between files)
+    for col in columns:
+        dtype = sidecar["dtypes"][col]
+        if col=="STATUS" and dtype!=STATUS_DTYPE:
+            data[col] = status_to_int(data[col])
+        elif _dtype_name(data[col].dtype)!=dtype:
+            data[col] = data[col].astype(dtype)
+
+    glsumstats = Sumstats.__new__(Sumstats)
+    glsumstats.data = data
+    glsumstats.build = sidecar["build"]
+    glsumstats.log = log
+    glsumstats.meta = sidecar["meta"]
+    if verbose: log.write(" -Loaded {} variants x {} columns".format(len(data), len(data.columns)))
+    if verbose: log.write("Finished loading successfully!")
+    return glsumstats
@@ -2,6 +2,8 @@ import pickle
 import os
 import gc
 from gwaslab.Log import Log 
+from gwaslab.vchangestatus import status_to_int
+from gwaslab.vchangestatus import STATUS_DTYPE
 
 def dump_pickle(glsumstats,path="~/mysumstats.pickle",overwrite=False):
     glsumstats.log.write("Start to dump the Sumstats Object.")
@@ -18,6 +20,9 @@ def load_pickle(path):
         with open(path, 'rb') as file:
             glsumstats =  pickle.load(file)
             glsumstats.log.write("Loaded dumped Sumstats object from : ", path)
+            # objects dumped by older versions store STATUS as strings
+            if "STATUS" in glsumstats.data.columns and glsumstats.data["STATUS"].dtype != STATUS_DTYPE:
+                glsumstats.data["STATUS"] = status_to_int(glsumstats.data["STATUS"])
             return glsumstats
     else:
         Log().write("File not exists : ", path)
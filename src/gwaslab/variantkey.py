@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+from gwaslab.CommonData import get_chr_to_number
+
+# packed 64-bit variant key
+#   bits 63-59 : CHR (1-31, gwaslab chromosome number)
+#   bits 58-31 : POS (1 - 2^28-1)
+#   bits 30-0  : hash of (REF, ALT) ; order-dependent : key(NEA,EA) != key(EA,NEA)
+# 0 is used for variants that can not be encoded (missing / out-of-range CHR or POS, missing alleles)
+# keys sort by CHR, POS ; key >> 31 is the CHR:POS part
+
+MISSING_KEY = np.uint64(0)
+CHR_BITS = 5
+POS_BITS = 28
+ALLELE_BITS = 31
+
+def _allele_hash(alleles):
+    alleles = pd.Series(alleles)
+    if isinstance(alleles.dtype, pd.CategoricalDtype):
+        # hash the categories only
+        category_hash = pd.util.hash_array(np.asarray(alleles.cat.categories.astype("string").str.upper(), dtype="object"))
+        codes = alleles.cat.codes.values
+        hashed = category_hash[np.clip(codes, 0, None)]
+        return hashed, codes < 0
+    is_na = alleles.isna().values
+    values = alleles.astype("string").str.upper().fillna("").to_numpy(dtype="object")
+    return pd.util.hash_array(values, categorize=True), is_na
+
+def pack_variant_key(chrom, pos, ref=None, alt=None):
+    '''
+    pack CHR (gwaslab chromosome number), POS and optionally REF/ALT into a uint64 key (0 if not encodable)
+    '''
+    chrom = pd.to_numeric(pd.Series(chrom), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    pos = pd.to_numeric(pd.Series(pos), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    is_valid = (chrom >= 1) & (chrom < 2**CHR_BITS) & (pos >= 1) & (pos < 2**POS_BITS)
+    key = (np.where(is_valid, chrom, 0).astype("uint64") << np.uint64(POS_BITS + ALLELE_BITS)) \
+        | (np.where(is_valid, pos, 0).astype("uint64") << np.uint64(ALLELE_BITS))
+    if ref is not None and alt is not None:
+        ref_hash, ref_na = _allele_hash(ref)
+        alt_hash, alt_na = _allele_hash(alt)
+        with np.errstate(over="ignore"):
+            allele_hash = ref_hash * np.uint64(0x9E3779B97F4A7C15) + alt_hash
+        key = key | (allele_hash >> np.uint64(64 - ALLELE_BITS))
+        is_valid = is_valid & ~ref_na & ~alt_na
+    return np.where(is_valid, key, MISSING_KEY)
+
+def chrpos_part(key):
+    '''
+    CHR:POS part of packed keys (comparable between keys with and without alleles)
+    '''
+    return np.asarray(key, dtype="uint64") >> np.uint64(ALLELE_BITS)
+
+def chrpos_key(chrom, pos):
+    '''
+    int64 CHR:POS key (CHR * 2^28 + POS) ; sorts by CHR, POS and differences on the same chromosome are bp distances
+    -1 if CHR or POS can not be encoded
+    '''
+    key = chrpos_part(pack_variant_key(chrom, pos)).astype("int64")
+    key[key==0] = -1
+    return key
+
+def id_key(ids):
+    '''
+    uint64 hash of ID strings (SNPID / rsID) for isin / intersection on integers ; 0 for missing IDs
+    '''
+    ids = pd.Series(ids)
+    is_na = ids.isna().values
+    key = pd.util.hash_array(ids.astype("string").fillna("").to_numpy(dtype="object"), categorize=True)
+    key[is_na] = MISSING_KEY
+    return key
+
+def duplicated_variants(sumstats, chrom="CHR", pos="POS", ea="EA", nea="NEA", keep="first"):
+    '''
+    pd.Series.duplicated on packed CHR:POS:NEA:EA keys
+    candidate duplicates are confirmed on the original columns so that hash collisions can not remove variants
+    variants without a valid key (NA / out-of-range CHR or POS, NA alleles) are compared on the original columns,
+    the same as sumstats.duplicated(subset=[chrom,pos,ea,nea])
+    '''
+    if ea is None or nea is None:
+        cols = [chrom,pos]
+        key = pd.Series(chrpos_key(sumstats[chrom], sumstats[pos]), index=sumstats.index)
+        is_missing = key==-1
+        is_duplicated = key.duplicated(keep=keep) & ~is_missing
+    else:
+        cols = [chrom,pos,ea,nea]
+        key = pd.Series(pack_variant_key(sumstats[chrom], sumstats[pos], sumstats[nea], sumstats[ea]), index=sumstats.index)
+        is_missing = key==MISSING_KEY
+        is_duplicated = key.duplicated(keep=keep) & ~is_missing
+        if is_duplicated.any():
+            is_candidate = key.duplicated(keep=False) & ~is_missing
+            candidates = sumstats.loc[is_candidate,cols].astype("string")
+            candidates["_KEY"] = key[is_candidate]
+            is_duplicated.loc[is_candidate] = candidates.duplicated(keep=keep).values
+    if is_missing.sum()>1:
+        # a variant with a valid key never equals one without
+        is_duplicated.loc[is_missing] = sumstats.loc[is_missing,cols].duplicated(keep=keep).values
+    return is_duplicated
+
+def unpack_chrpos(key):
+    '''
+    return CHR and POS (int64) of packed keys
+    '''
+    key = np.asarray(key, dtype="uint64")
+    chrom = (key >> np.uint64(POS_BITS + ALLELE_BITS)).astype("int64")
+    pos = ((key >> np.uint64(ALLELE_BITS)) & np.uint64(2**POS_BITS - 1)).astype("int64")
+    return chrom, pos
+
+def parse_snpid(snpid, chr_dict=None):
+    '''
+    split chr:pos:ref:alt IDs (separator : _ -) into CHR (gwaslab number, float), POS, REF and ALT ; NA if not parsable
+    '''
+    if chr_dict is None:
+        chr_dict = get_chr_to_number()
+    parts = pd.Series(snpid, dtype="string").str.extract(r'^(?:chr)?(\w+?)[:_-](\d+)[:_-]([ATCGN]+)[:_-]([ATCGN]+)$', flags=2)
+    chrom = parts[0].str.upper().map(chr_dict)
+    chrom = pd.to_numeric(chrom.astype("object").fillna(np.nan), errors="coerce")
+    pos = pd.to_numeric(parts[1], errors="coerce")
+    return chrom, pos, parts[2].str.upper(), parts[3].str.upper()
+
+def build_snpid(chrom, pos, ref=None, alt=None):
+    '''
+    CHR:POS(:REF:ALT) IDs built column-wise (one vectorized join instead of chained string concatenation)
+    '''
+    columns = [pd.Series(chrom).astype("string"), pd.Series(pos).astype("string")]
+    if ref is not None and alt is not None:
+        columns += [pd.Series(ref).astype("string"), pd.Series(alt).astype("string")]
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        arrays = [pa.array(column.to_numpy(dtype="object", na_value=None), type=pa.string()) for column in columns]
+        joined = pc.binary_join_element_wise(*arrays, ":")
+        return pd.Series(joined.to_numpy(zero_copy_only=False), index=columns[0].index, dtype="string")
+    except ImportError:
+        snpid = columns[0]
+        for column in columns[1:]:
+            snpid = snpid + ":" + column.values
+        return snpid
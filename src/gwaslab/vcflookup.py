@@ -0,0 +1,171 @@
+import pandas as pd
+import numpy as np
+from pysam import VariantFile
+from multiprocessing import Pool
+from functools import partial
+from gwaslab.Log import Log
+from gwaslab.refcache import get_cache_dir
+from gwaslab.refcache import load_cache_meta
+from gwaslab.refcache import load_vcf_cache_chrom
+import gc
+
+# bulk lookup of sumstats variants in a reference vcf/bcf
+# instead of one fetch() per variant, the query is sorted by CHR/POS and each chromosome of the reference
+# is streamed once; records are then joined to the query on POS + alleles in a vectorized way
+#
+# MATCH :
+#   0 : not found in reference
+#   1 : ref==NEA and EA in alts (same direction as reference)
+#   2 : ref==EA and NEA in alts (flipped compared with reference)
+
+#################################################################################################################
+
+def _read_vcf_chrom(vcf_path, contig, positions, ref_alt_freq=None, read_id=False):
+    '''
+    stream the records of one contig once and keep records at the queried positions (multiallelic split into rows)
+    '''
+    pos_set = set(positions.tolist())
+    start = int(positions.min()) - 1
+    end = int(positions.max())
+
+    r_pos=[]
+    r_ref=[]
+    r_alt=[]
+    r_af=[]
+    r_id=[]
+
+    vcf_reader = VariantFile(vcf_path)
+    try:
+        records = vcf_reader.fetch(contig, start, end)
+    except ValueError:
+        # contig not in reference
+        records = []
+
+    for record in records:
+        if record.pos not in pos_set:
+            continue
+        alts = record.alts
+        if alts is None:
+            continue
+        if ref_alt_freq is not None:
+            af = record.info.get(ref_alt_freq)
+            if not isinstance(af, tuple):
+                af = (af,)*len(alts)
+        for i, alt in enumerate(alts):
+            r_pos.append(record.pos)
+            r_ref.append(record.ref)
+            r_alt.append(alt)
+            if ref_alt_freq is not None:
+                r_af.append(af[i] if i < len(af) else None)
+            if read_id:
+                r_id.append(record.id)
+    vcf_reader.close()
+
+    ref_df = pd.DataFrame({"POS":np.array(r_pos,dtype="int64"),
+                           "REF":np.array(r_ref,dtype="object"),
+                           "ALT":np.array(r_alt,dtype="object")})
+    if ref_alt_freq is not None:
+        ref_df["AF"] = pd.to_numeric(pd.Series(r_af,dtype="object"),errors="coerce").astype("float64").values
+    if read_id:
+        ref_df["ID"] = np.array(r_id,dtype="object")
+    return ref_df
+
+def _lookup_vcf_chrom(task, vcf_path, ref_alt_freq=None, read_id=False, cache_dir=None):
+    '''
+    join the query variants on one chromosome with the reference records
+    task : (contig, dataframe with _POS, _NEA, _EA)
+    '''
+    contig, query = task
+    query = query.sort_values(by="_POS", kind="mergesort")
+
+    result = pd.DataFrame(index=query.index)
+    result["MATCH"] = np.zeros(len(query),dtype="int8")
+    if ref_alt_freq is not None:
+        result["AF"] = np.nan
+    if read_id:
+        result["ID"] = pd.Series(pd.NA, index=query.index, dtype="string")
+
+    if contig is None or len(query)==0:
+        return result
+
+    if cache_dir is not None:
+        ref_df = load_vcf_cache_chrom(cache_dir, contig, query["_POS"].values, ref_alt_freq=ref_alt_freq, read_id=read_id)
+    else:
+        ref_df = _read_vcf_chrom(vcf_path, contig, query["_POS"].values, ref_alt_freq=ref_alt_freq, read_id=read_id)
+    if len(ref_df)==0:
+        return result
+
+    # keep the first record (in vcf order) for each POS/REF/ALT
+    ref_df = ref_df.drop_duplicates(subset=["POS","REF","ALT"], keep="first")
+    ref_cols = [i for i in ["AF","ID"] if i in ref_df.columns]
+
+    query = query.reset_index()
+    query = query.rename(columns={query.columns[0]:"_INDEX"})
+
+    # 1 : same direction ; 2 : flipped
+    forward = query.merge(ref_df, how="inner", left_on=["_POS","_NEA","_EA"], right_on=["POS","REF","ALT"], sort=False)
+    reverse = query.merge(ref_df, how="inner", left_on=["_POS","_EA","_NEA"], right_on=["POS","REF","ALT"], sort=False)
+    reverse = reverse.loc[~reverse["_INDEX"].isin(forward["_INDEX"]),:]
+
+    for matched, code in [(reverse,2),(forward,1)]:
+        if len(matched)==0:
+            continue
+        result.loc[matched["_INDEX"].values,"MATCH"] = code
+        for col in ref_cols:
+            result.loc[matched["_INDEX"].values,col] = matched[col].values
+    return result
+
+def lookup_vcf(sumstats, vcf_path, ref_alt_freq=None, read_id=False, chrom="CHR", pos="POS", ref="NEA", alt="EA",
+               chr_dict=None, n_cores=1, verbose=True, log=Log()):
+    '''
+    look up variants in a reference vcf/bcf (bgzipped + indexed) with one sequential pass per chromosome
+    (or in the memory-mapped reference cache if it was built by build_reference_cache)
+    return a dataframe with the same index as sumstats:
+        MATCH (0 not found / 1 same direction / 2 flipped), AF (ref_alt_freq of the matched alt), ID (if read_id)
+    '''
+    query = pd.DataFrame({"_CHR":sumstats[chrom].values,
+                          "_POS":sumstats[pos].values,
+                          "_NEA":sumstats[ref].astype("object").values,
+                          "_EA":sumstats[alt].astype("object").values}, index=sumstats.index)
+    query = query.dropna(subset=["_CHR","_POS"])
+    query["_POS"] = query["_POS"].astype("int64")
+
+    tasks=[]
+    for chr_number, group in query.groupby("_CHR", sort=True):
+        if chr_dict is not None:
+            contig = chr_dict.get(chr_number, None)
+        else:
+            contig = str(chr_number)
+        tasks.append((contig, group[["_POS","_NEA","_EA"]]))
+
+    if verbose: log.write(" -Looking up {} variants on {} chromosomes in the reference...".format(len(query),len(tasks)))
+
+    cache_dir = get_cache_dir(vcf_path, ref_type="vcf", verbose=verbose, log=log)
+    if cache_dir is not None and ref_alt_freq is not None and load_cache_meta(cache_dir).get("af_field")!=ref_alt_freq:
+        cache_dir = None
+    if cache_dir is not None:
+        if verbose: log.write(" -Using reference cache: {}".format(cache_dir))
+
+    map_func = partial(_lookup_vcf_chrom, vcf_path=vcf_path, ref_alt_freq=ref_alt_freq, read_id=read_id, cache_dir=cache_dir)
+    n_cores = max(min(n_cores, len(tasks)),1)
+    if n_cores > 1:
+        pool = Pool(n_cores)
+        results = pool.map(map_func, tasks)
+        pool.close()
+        pool.join()
+    else:
+        results = list(map(map_func, tasks))
+
+    result = pd.DataFrame(index=sumstats.index)
+    result["MATCH"] = np.zeros(len(sumstats),dtype="int8")
+    if ref_alt_freq is not None:
+        result["AF"] = np.nan
+    if read_id:
+        result["ID"] = pd.Series(pd.NA, index=sumstats.index, dtype="string")
+
+    if len(results)>0:
+        found = pd.concat(results)
+        result.loc[found.index, found.columns] = found
+    result["MATCH"] = result["MATCH"].astype("int8")
+    gc.collect()
+    return result
@@ -1,43 +1,83 @@
 import pandas as pd
+import numpy as np
 
-def vchange_status(status,digit,before,after):
-    dic={}
-    for i in range(len(before)):
-        dic[before[i]]=after[i]
-    if digit>1:
-        return status.str[:digit-1]+status.str[digit-1].replace(dic)+status.str[digit:]
-    else:
-        return status.str[digit-1].replace(dic)+status.str[digit:]
-    
-def change_status(status,digit,after):
-    prefix= status // 10**(7-digit+1)
-    #middle= (status // 10**(7-digit) ) % 10
-    suffix= status % 10**(7-digit)
-    status = prefix*10**(7-digit+1) + after*10**(7-digit) + suffix
-    return status
-
-def schange_status(status,digit,after):
-    prefix= status.floordiv(10**(7-digit+1))
-    suffix= status.mod(10**(7-digit))
-    #prefix= pd.eval("status // 10**(7-digit+1)")
-    #suffix= pd.eval("status % 10**(7-digit)")
-    #status = prefix*10**(7-digit+1) + after*10**(7-digit) + suffix
-    status = pd.eval("prefix*10**(7-digit+1) + after*10**(7-digit) + suffix")
-    return status
-
-def status_match(status,digit,to_match):   
-    #middle = status.floordiv(10**(7-digit)).mod(10)
-    middle = pd.eval('(status // 10**(7-digit) ) % 10')
+# STATUS is stored as a 7-digit integer (int32), for example 1999999
+# digit 1-2 : genome build
+# digit 3   : rsID & SNPID
+# digit 4   : CHR & POS
+# digit 5   : standardization & normalization
+# digit 6   : alignment with reference genome
+# digit 7   : palindromic SNPs & indels
+# all operations below are vectorized integer arithmetic ; the 7-character string is only rendered for display / export
+
+STATUS_DTYPE = "int32"
+
+def _digit_base(digit):
+    return 10**(7-digit)
+
+def get_digit(status,digit):
+    '''
+    return the value of the digit-th digit (1-based, from the left) of the status code
+    '''
+    return (status // _digit_base(digit)) % 10
+
+def set_digit(status,digit,after):
+    '''
+    set the digit-th digit (1-based, from the left) of the status code to after (int or array of int)
+    '''
+    return status + (after - get_digit(status,digit)) * _digit_base(digit)
+
+def match_digit(status,digit,to_match):
+    '''
+    check if the digit-th digit of the status code is in to_match ("45" or [4,5] or 4)
+    '''
+    if isinstance(to_match,(int,np.integer)):
+        to_match = [to_match]
+    to_match = [int(i) for i in to_match]
+    middle = get_digit(status,digit)
     if len(to_match)==1:
-        is_match = middle==to_match[0]
-    else:
-        is_match = middle.isin(set(to_match))
-    return is_match
-'''
+        return middle==to_match[0]
+    if isinstance(middle,pd.Series):
+        return middle.isin(to_match)
+    return np.isin(middle,to_match)
+
 def vchange_status(status,digit,before,after):
+    '''
+    change the digit-th digit of the status code : before[i] -> after[i]
+    '''
+    if len(status)==0:
+        return status
+    table = np.arange(10)
     for i in range(len(before)):
-        matched = status_match(status,digit,[int(before[i])])
-        if sum(matched)>0:
-            status[matched] = schange_status(status[matched],digit,int(after[i]))
-    return status
-'''
\ No newline at end of file
+        table[int(before[i])] = int(after[i])
+    middle = np.asarray(get_digit(status,digit))
+    changed = set_digit(status, digit, table[middle])
+    if isinstance(changed,pd.Series):
+        return changed.astype(STATUS_DTYPE)
+    return changed
+
+def change_status(status,digit,after):
+    return set_digit(status,digit,after)
+
+def status_match(status,digit,to_match):
+    return match_digit(status,digit,to_match)
+
+def get_build_from_status(status):
+    '''
+    return the first two digits (genome build) as int
+    '''
+    return status // 100000
+
+def status_to_int(status, build="99"):
+    '''
+    convert STATUS (string / categorical / integer) to int32; invalid values -> build + 99999
+    '''
+    status = pd.to_numeric(pd.Series(status).astype("string"), errors="coerce")
+    status = status.where((status>=1000000)&(status<=9999999), int(build)*100000 + 99999)
+    return status.astype(STATUS_DTYPE)
+
+def status_to_string(status):
+    '''
+    render integer STATUS as 7-character strings (display / export only)
+    '''
+    return pd.Series(status).astype("string")